@@ -71,7 +71,9 @@ def main():
     # Set image path
     controller.set_media_path(path)
 
-    sys.exit(app.exec_())
+    ret = app.exec_()
+    db.close()
+    sys.exit(ret)
 
 
 if __name__ == '__main__':
@@ -141,9 +141,10 @@ class UserComment(object):
         return entities
 
     @abstractmethod
-    def save_comment(self, file):
+    def save_comment(self, file, index=None):
         """
         Save the user comment to the file
+        :param index: metadata index (common.metadata_index.MetadataIndex) updated with the new comment, if any
         """
         raise NotImplementedError()
 
@@ -163,14 +164,22 @@ class ImageUserComment(UserComment):
     def update_exif(self, exif_dict):
         set_user_comment(exif_dict, self.to_dict())
 
-    def save_comment(self, file):
+    def save_comment(self, file, index=None):
         exif_dic = get_exif(file)
         self.update_exif(exif_dic)
         save_exif(exif_dict=exif_dic, path=file)
+        if index is not None:
+            index.update(file)
 
     @staticmethod
     def load_from_file(path: Path):
-        exif_dict = get_exif(path)
+        return ImageUserComment.from_exif(get_exif(path))
+
+    @staticmethod
+    def from_exif(exif_dict):
+        """
+        User comment of an exif dict (see common.exif.get_exif)
+        """
         if piexif.ExifIFD.UserComment in exif_dict["Exif"]:
             try:
                 user_comment_dic = piexif.helper.UserComment.load(exif_dict["Exif"][piexif.ExifIFD.UserComment])
@@ -192,7 +201,7 @@ class VideoUserComment(UserComment):
     def update_exif(self, exif_dict):
         set_user_comment(exif_dict, self.to_dict())
 
-    def save_comment(self, file):
+    def save_comment(self, file, index=None):
         return
         exif_dic = get_exif(file)
         self.update_exif(exif_dic)
@@ -58,17 +58,17 @@ def load_image(path: Path) -> (QImage, dict):
         orientation = exif_dict["0th"].pop(piexif.ImageIFD.Orientation)
         transforms = []
         if orientation == 2:  # Flip left / right
-            transforms = [QTransform().scale(1, -1)]
+            transforms = [QTransform().scale(-1, 1)]
         elif orientation == 3:  # rotate 180
             transforms = [QTransform().rotate(180)]
-        elif orientation == 4:
-            transforms = [QTransform().rotate(180), QTransform().scale(1, -1)]
-        elif orientation == 5:
-            transforms = [QTransform().rotate(90), QTransform().scale(1, -1)]
+        elif orientation == 4:  # Flip top / bottom
+            transforms = [QTransform().scale(1, -1)]
+        elif orientation == 5:  # Transpose
+            transforms = [QTransform().rotate(-90), QTransform().scale(1, -1)]
         elif orientation == 6:
             transforms = [QTransform().rotate(90)]
-        elif orientation == 7:
-            transforms = [QTransform().rotate(-90), QTransform().scale(1, -1)]
+        elif orientation == 7:  # Transverse
+            transforms = [QTransform().rotate(90), QTransform().scale(1, -1)]
         elif orientation == 8:
             transforms = [QTransform().rotate(-90)]
 
@@ -77,6 +77,50 @@ def load_image(path: Path) -> (QImage, dict):
     return qimage, exif_dict
 
 
+def apply_orientation(arr: np.ndarray, orientation) -> np.ndarray:
+    """
+    Apply the exif orientation tag to an image array (views, no copy)
+    """
+    if orientation == 2:  # Flip left / right
+        return arr[:, ::-1]
+    elif orientation == 3:  # rotate 180
+        return arr[::-1, ::-1]
+    elif orientation == 4:  # Flip top / bottom
+        return arr[::-1]
+    elif orientation == 5:  # Transpose
+        return arr.swapaxes(0, 1)
+    elif orientation == 6:  # rotate 90 clockwise
+        return arr.swapaxes(0, 1)[:, ::-1]
+    elif orientation == 7:  # Transverse
+        return arr[::-1, ::-1].swapaxes(0, 1)
+    elif orientation == 8:  # rotate 90 counter-clockwise
+        return arr.swapaxes(0, 1)[::-1]
+    return arr
+
+
+def load_image_array(path: Path, max_size=-1) -> (np.ndarray, dict):
+    """
+    Load an image as a RGB uint8 array, rotated according to the orientation exif tag, without going through QImage.
+
+    If max_size > 0, JPEGs are decoded at a reduced scale (DCT scaling, 1/2, 1/4 or 1/8) keeping the longest
+    side >= max_size, which is much faster than decoding the full image. The result is not resized to max_size.
+    :return: (h, w, 3) array (None if the file cannot be read), exif dict
+    """
+    try:
+        img = Image.open(str(path))
+        exif_dict = piexif.load(img.info['exif']) if 'exif' in img.info else {}
+        if max_size > 0:
+            # Requested size with the image aspect ratio: the longest side is kept >= max_size
+            scale = max_size / max(img.size)
+            img.draft('RGB', (int(np.ceil(img.size[0] * scale)), int(np.ceil(img.size[1] * scale))))
+        arr = np.asarray(img if img.mode == 'RGB' else img.convert('RGB'))
+    except Exception:
+        return None, None
+
+    orientation = exif_dict.get("0th", {}).pop(piexif.ImageIFD.Orientation, 1)
+    return np.ascontiguousarray(apply_orientation(arr, orientation)), exif_dict
+
+
 def toCvMat(qimage: QImage):
     '''  Converts a QImage into an opencv MAT format  '''
 
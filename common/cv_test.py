@@ -0,0 +1,64 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+import piexif
+from PIL import Image
+
+import resources.test_pics as test_pics
+from common.cv import load_image, load_image_array, toCvMat
+
+default_pics_folder = Path(test_pics.__file__).parent
+
+
+class LoadImageArrayTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.file = default_pics_folder / "20210908_122743.jpg"
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.out_dir)
+
+    def test_same_as_load_image(self):
+        arr, exif_dict = load_image_array(self.file)
+        qimage, exif_dict_qt = load_image(self.file)
+        self.assertEqual(arr.dtype, np.uint8)
+        self.assertEqual(arr.shape, (qimage.height(), qimage.width(), 3))
+        # Decoders may differ by rounding
+        self.assertLess(np.abs(arr.astype(np.int16) - toCvMat(qimage)).mean(), 2.)
+        self.assertEqual(exif_dict.keys(), exif_dict_qt.keys())
+
+    def test_draft(self):
+        arr, _ = load_image_array(self.file, max_size=800)
+        # 4000x3000 decoded at 1/4
+        self.assertEqual(arr.shape, (750, 1000, 3))
+        arr, _ = load_image_array(self.file, max_size=1200)
+        self.assertEqual(arr.shape, (1500, 2000, 3))
+
+    def test_orientation(self):
+        arr = np.zeros((40, 60, 3), dtype=np.uint8)
+        arr[:20, :30] = 255
+        expected = {1: (40, 60), 3: (40, 60), 6: (60, 40), 8: (60, 40)}
+        for orientation, shape in expected.items():
+            file = self.out_dir / f"{orientation}.jpg"
+            exif = piexif.dump({"0th": {piexif.ImageIFD.Orientation: orientation}})
+            Image.fromarray(arr).save(str(file), exif=exif, quality=100)
+
+            out, exif_dict = load_image_array(file)
+            qimage, _ = load_image(file)
+            self.assertEqual(out.shape[:2], shape)
+            self.assertNotIn(piexif.ImageIFD.Orientation, exif_dict["0th"])
+            # White corner at the same place as the QImage path
+            self.assertLess(np.abs(out.astype(np.int16) - toCvMat(qimage)).mean(), 2.)
+
+    def test_not_an_image(self):
+        file = self.out_dir / "not_an_image.jpg"
+        file.write_bytes(b"abc")
+        self.assertEqual(load_image_array(file), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
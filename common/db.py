@@ -1,16 +1,23 @@
 import json
 import logging
+import os
 import typing
+from ast import literal_eval
 from pathlib import Path
 
 import cv2
 import numpy as np
 
 from common.comment import CommentEntity, ImageUserComment, TagEntity
+from common.embedding_store import EmbeddingStore
 from common.face import face_recognition_model
+from common.face_cache import FaceDetectionCache
+from common.face_matcher import FaceMatcher
 from common.singleton import Singleton
 
 db_json_filename = 'dataset.json'
+db_sqlite_filename = 'dataset.sqlite'
+db_cache_filename = 'detections_cache.sqlite'
 db_img_foldername = 'images'
 
 
@@ -92,18 +99,26 @@ class TagDB(object):
 
 
 class FaceDetectionDBItem:
-    def __init__(self, name, filename, location, embedding, model):
+    def __init__(self, name, filename, location, embedding, model, store: EmbeddingStore = None):
         self.name = name
         self.filename = filename
         self.location = location  # (top, right, bottom, left) as int
-        self.embedding = embedding.tolist() if not isinstance(embedding, list) else embedding
         self.model = model
         self.hash = f"{name}_{filename}_{location}_{model}"
+        # Embedding as float32 array. If None, lazily loaded from the store on first access
+        self._embedding = np.asarray(embedding, dtype=np.float32) if embedding is not None else None
+        self._store = store
+
+    @property
+    def embedding(self):
+        if self._embedding is None and self._store is not None:
+            self._embedding = self._store.get_embedding(self.hash)
+        return self._embedding
 
     def to_dict(self):
         return {
             'filename': self.filename,
-            'embedding': self.embedding,
+            'embedding': self.embedding.tolist(),
             'location': f"{self.location}",
             'name': self.name,
             'model': self.model
@@ -111,7 +126,8 @@ class FaceDetectionDBItem:
 
     @staticmethod
     def from_dict(dic):
-        item = FaceDetectionDBItem(name=dic['name'], filename=dic['filename'], location=eval(dic['location']),
+        location = literal_eval(dic['location']) if isinstance(dic['location'], str) else dic['location']
+        item = FaceDetectionDBItem(name=dic['name'], filename=dic['filename'], location=location,
                                    model=dic['model'], embedding=dic['embedding'])
         return item
 
@@ -148,11 +164,18 @@ class FaceDetectionDB:
 
         # Database path containing embeddings
         assert db_folder and db_folder.is_dir()
+        # Legacy json file, only read once to migrate to the sqlite store
         self.json = db_folder / db_json_filename
+        self.sqlite = db_folder / db_sqlite_filename
         self.img_folder = db_folder / db_img_foldername
+        self.store: EmbeddingStore = None
 
         # Database {hash: FaceDetectionDBItem}
         self.db: typing.Dict[str, FaceDetectionDBItem] = {}
+        # Nearest-neighbour search over the embeddings, kept in sync with self.db
+        self.matcher = FaceMatcher(self, index_folder=db_folder)
+        # Detections already computed per file, consulted by face_recognition
+        self.cache = FaceDetectionCache(db_folder / db_cache_filename)
 
         self.load_db()
 
@@ -171,8 +194,14 @@ class FaceDetectionDB:
         return [item.embedding for item in self.db.values()]
 
     def get_embeddings(self, model='face_recognition'):
-        return ([np.array(item.embedding) for item in self.db.values() if model == item.model],
-                [item.name for item in self.db.values() if model == item.model])
+        _, names, matrix = self.store.get_embeddings(model)
+        return list(matrix), names
+
+    def get_embedding_matrix(self, model):
+        """
+        :return: hashes, names and (n, d) float32 matrix of all the embeddings of a recognition model
+        """
+        return self.store.get_embeddings(model)
 
     def load_patch(self, file: Path):
         # Patch
@@ -190,32 +219,72 @@ class FaceDetectionDB:
         user_comment = ImageUserComment([CommentEntity(f"{location}")])
         user_comment.save_comment(file)
 
+    def _migrate_json(self):
+        # One-shot migration from the json layout, into a temporary file moved in place once complete: an
+        # interrupted migration leaves no store, and is done again on the next load
+        tmp = self.sqlite.with_name(self.sqlite.name + '.migrating')
+        tmp.unlink(missing_ok=True)
+        try:
+            store = EmbeddingStore(tmp)
+            try:
+                store.import_json(self.json, FaceDetectionDBItem)
+            finally:
+                store.close()
+            os.replace(tmp, self.sqlite)
+        finally:
+            tmp.unlink(missing_ok=True)
+
     def load_db(self):
-        # If no content, create empty json file
-        if not self.json.exists():
-            # Make sure image dir does not exist
-            assert not self.img_folder.exists()
-            logging.warning("Dataset folder is empty, creating new structure")
-            self.save_db()
-            self.img_folder.mkdir(parents=False)
-            return False
+        if not self.sqlite.exists():
+            if self.json.exists():
+                self._migrate_json()
+                if not self.img_folder.exists():
+                    self.img_folder.mkdir(parents=False)
+            else:
+                # If no content, create empty structure
+                # Make sure image dir does not exist
+                assert not self.img_folder.exists()
+                logging.warning("Dataset folder is empty, creating new structure")
+                self.img_folder.mkdir(parents=False)
+                self.store = EmbeddingStore(self.sqlite)
+                return False
+        self.store = EmbeddingStore(self.sqlite)
 
-        # Opening JSON file
-        with open(self.json, 'r') as f:
-            _db = json.load(f)
-            for v in _db.values():
-                item = FaceDetectionDBItem.from_dict(v)
-                self.db[item.hash] = item
+        # Only the metadata is read, embeddings are loaded on demand
+        for hash_, name, filename, location, model in self.store.items():
+            item = FaceDetectionDBItem(name=name, filename=filename, location=location, embedding=None,
+                                       model=model, store=self.store)
+            item.hash = hash_
+            self.db[item.hash] = item
+        self.matcher.invalidate()
 
         return True
 
     def save_db(self):
+        self.store.commit()
+        self.matcher.save()
+
+    def close(self):
+        """
+        Persist the pending changes and close the store
+        """
+        if self.store is None:
+            return
+        self.save_db()
+        self.store.close()
+        self.store = None
+
+    def export_json(self, file: Path = None):
+        """
+        Export the whole db in the legacy json layout
+        """
+        file = file if file else self.json
         # Getting the json
         _json = {k: v.to_dict() for k, v in self.db.items()}
         # Serializing json
         json_object = json.dumps(_json, indent=4)
         # Write to file
-        with open(self.json, 'w') as f:
+        with open(file, 'w') as f:
             f.write(json_object)
 
     def get_entry(self, name, filename, model):
@@ -265,12 +334,14 @@ class FaceDetectionDB:
                                        (it.filename == item_remove.filename) and (it.name == item_remove.name)]
 
         self.db[item.hash] = item
+        self.store.put([item])
+        self.matcher.add_item(item)
         # Rename items
         for it in items_to_rename:
             it.name = item.name
-
-        # Save db
-        self.save_db()
+            self.matcher.rename_item(it)
+        if items_to_rename:
+            self.store.rename([it.hash for it in items_to_rename], item.name)
 
         # Delete old img and Copy original image to images folder, irrespective of
         # whether the item_remove patch was the same or not
@@ -293,4 +364,6 @@ class FaceDetectionDB:
         to_remove = [k for k, item in self.db.items() if item.name == name and item.filename in filenames]
         for k in to_remove:
             del self.db[k]
+        self.store.remove(to_remove)
+        self.matcher.remove_items(to_remove)
 
@@ -0,0 +1,114 @@
+import json
+import logging
+import sqlite3
+import threading
+from ast import literal_eval
+from pathlib import Path
+
+import numpy as np
+
+_schema = """
+CREATE TABLE IF NOT EXISTS faces (
+    hash TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    top INTEGER NOT NULL,
+    right INTEGER NOT NULL,
+    bottom INTEGER NOT NULL,
+    left INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    dim INTEGER NOT NULL,
+    embedding BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS faces_model ON faces(model);
+"""
+
+
+class EmbeddingStore(object):
+    """
+    SQLite storage of the face db. Embeddings are stored as float32 BLOBs next to the item metadata so that:
+    - inserting / renaming / removing an item only touches the related rows,
+    - the metadata can be listed without decoding any vector (embeddings are loaded lazily).
+    """
+
+    def __init__(self, file: Path):
+        self.file = file
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(str(file), check_same_thread=False)
+        self._con.executescript(_schema)
+        self._con.commit()
+
+    def close(self):
+        self._con.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._con.execute("SELECT COUNT(*) FROM faces").fetchone()[0]
+
+    def items(self):
+        """
+        :return: list of (hash, name, filename, location, model), without the embeddings
+        """
+        with self._lock:
+            rows = self._con.execute("SELECT hash, name, filename, top, right, bottom, left, model "
+                                     "FROM faces ORDER BY rowid").fetchall()
+        return [(row[0], row[1], row[2], tuple(row[3:7]), row[7]) for row in rows]
+
+    def get_embedding(self, hash_):
+        with self._lock:
+            row = self._con.execute("SELECT embedding FROM faces WHERE hash = ?", (hash_,)).fetchone()
+        return np.frombuffer(row[0], dtype=np.float32) if row else None
+
+    def get_embeddings(self, model):
+        """
+        All the embeddings of a recognition model in one query.
+        :return: list of hashes, list of names, (n, d) float32 matrix
+        """
+        with self._lock:
+            rows = self._con.execute("SELECT hash, name, embedding FROM faces WHERE model = ? ORDER BY rowid",
+                                     (model,)).fetchall()
+        if len(rows) == 0:
+            return [], [], np.empty((0, 0), dtype=np.float32)
+        matrix = np.frombuffer(b''.join(row[2] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+        return [row[0] for row in rows], [row[1] for row in rows], matrix
+
+    def put(self, items, commit=True):
+        rows = []
+        for item in items:
+            embedding = np.ascontiguousarray(item.embedding, dtype=np.float32)
+            rows.append((item.hash, item.name, item.filename, *[int(i) for i in item.location], item.model,
+                         len(embedding), embedding.tobytes()))
+        with self._lock:
+            self._con.executemany("INSERT OR REPLACE INTO faces VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            if commit:
+                self._con.commit()
+
+    def rename(self, hashes, name):
+        with self._lock:
+            self._con.executemany("UPDATE faces SET name = ? WHERE hash = ?", [(name, h) for h in hashes])
+            self._con.commit()
+
+    def remove(self, hashes):
+        with self._lock:
+            self._con.executemany("DELETE FROM faces WHERE hash = ?", [(h,) for h in hashes])
+            self._con.commit()
+
+    def commit(self):
+        with self._lock:
+            self._con.commit()
+
+    def import_json(self, json_file: Path, item_cls):
+        """
+        One-shot migration of a legacy dataset.json (embeddings as lists of floats) into the store.
+        The json file is left untouched.
+        """
+        with open(json_file, 'r') as f:
+            _db = json.load(f)
+        items = []
+        for v in _db.values():
+            v = dict(v)
+            v['location'] = literal_eval(v['location']) if isinstance(v['location'], str) else v['location']
+            items.append(item_cls.from_dict(v))
+        self.put(items)
+        logging.info(f"FaceDB: migrated {len(items)} items from {json_file} to {self.file}")
+        return items
@@ -0,0 +1,95 @@
+import json
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+import resources.test_db_faces as test_db_faces
+from common.db import FaceDetectionDB, FaceDetectionDBItem, db_json_filename, db_img_foldername, \
+    db_sqlite_filename, db_cache_filename
+from common.embedding_store import EmbeddingStore
+from common.face_matcher import FaceMatcher
+
+default_db_faces_folder = Path(test_db_faces.__file__).parent
+
+
+class EmbeddingStoreTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        shutil.copy2(default_db_faces_folder / db_json_filename, self.out_dir / db_json_filename)
+        shutil.copytree(default_db_faces_folder / db_img_foldername, self.out_dir / db_img_foldername)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.out_dir)
+
+    def test_migration_from_json(self):
+        with open(self.out_dir / db_json_filename, 'r') as f:
+            legacy = FaceDetectionDBItem.from_dict(next(iter(json.load(f).values())))
+
+        db = FaceDetectionDB(self.out_dir)
+        self.assertTrue(db.sqlite.is_file())
+        self.assertEqual(len(db.db), 1)
+        item = next(iter(db.db.values()))
+        self.assertEqual(item.name, legacy.name)
+        self.assertEqual(item.location, legacy.location)
+        # Lazy loading: the embedding is only decoded on access
+        self.assertIsNone(item._embedding)
+        np.testing.assert_allclose(item.embedding, legacy.embedding)
+
+        # Reopening uses the sqlite store
+        db.store.close()
+        db = FaceDetectionDB(self.out_dir)
+        self.assertEqual(list(db.db.keys()), [item.hash])
+
+    def test_migration_interrupted(self):
+        with mock.patch.object(EmbeddingStore, 'import_json', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                FaceDetectionDB(self.out_dir)
+        # Nothing left behind: migrated again on the next load
+        self.assertFalse((self.out_dir / db_sqlite_filename).exists())
+        self.assertEqual(sorted(file.name for file in self.out_dir.iterdir()),
+                         sorted([db_json_filename, db_img_foldername, db_cache_filename]))
+        db = FaceDetectionDB(self.out_dir)
+        self.assertEqual(len(db.db), 1)
+        db.store.close()
+
+    def test_index_saved_on_close(self):
+        db = FaceDetectionDB(self.out_dir)
+        item = next(iter(db.db.values()))
+        with mock.patch.object(FaceMatcher, 'save') as save:
+            db.remove_from_json(item.name, [item.filename])
+            self.assertEqual(save.call_count, 0)
+            db.close()
+            self.assertEqual(save.call_count, 1)
+            self.assertIsNone(db.store)
+            db.close()
+            self.assertEqual(save.call_count, 1)
+        db = FaceDetectionDB(self.out_dir)
+        self.assertEqual(len(db.db), 0)
+        db.close()
+
+    def test_put_rename_remove(self):
+        store = EmbeddingStore(self.out_dir / 'test.sqlite')
+        items = [FaceDetectionDBItem(name=f"p{i}", filename=f"{i}.jpg", location=(i, i + 10, i + 10, i),
+                                     embedding=np.full(8, i, dtype=np.float32), model='Dlib') for i in range(3)]
+        store.put(items)
+        self.assertEqual(len(store), 3)
+
+        hashes, names, matrix = store.get_embeddings('Dlib')
+        self.assertEqual(names, ['p0', 'p1', 'p2'])
+        self.assertEqual(matrix.shape, (3, 8))
+        self.assertEqual(matrix.dtype, np.float32)
+        self.assertEqual(store.get_embeddings('VGG-Face')[0], [])
+
+        store.rename([items[0].hash], 'renamed')
+        store.remove([items[1].hash])
+        self.assertEqual(store.get_embeddings('Dlib')[1], ['renamed', 'p2'])
+        store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,12 @@
 import datetime
+import io
 import json
+import logging
+import os
+import shutil
+import struct
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import piexif
@@ -18,12 +25,98 @@ user_comment_template = {
 # GPS -> Timezone
 TF = timezonefinder.TimezoneFinder()
 
+# Bytes read at once from the start of a JPEG: the APP0 / APP1 segments of most cameras fit in the first block
+exif_head_size = 64 * 1024
+
+
+def read_exif_segment(path: Path):
+    """
+    Read the EXIF APP1 segment of a JPEG without reading the image data: only the marker headers are parsed and
+    the segments before APP1 are skipped (usually a single read of exif_head_size bytes)
+    :return: APP1 segment (marker included), None if the JPEG has no EXIF
+    :raise piexif.InvalidImageDataError: not a JPEG
+    """
+    with open(path, 'rb') as f:
+        buf = f.read(exif_head_size)
+        if buf[:2] != b'\xff\xd8':
+            raise piexif.InvalidImageDataError(f"{path} is not a JPEG")
+        # File offset of buf, position of the current marker in buf
+        offset, pos = 0, 2
+        while True:
+            if pos + 4 > len(buf):
+                # Marker header after the block read: next block
+                offset += pos
+                f.seek(offset)
+                buf, pos = f.read(exif_head_size), 0
+                if len(buf) < 4:
+                    return None
+            if buf[pos] != 0xff:
+                logging.warning(f"Unexpected JPEG marker in {path} at {offset + pos}")
+                return None
+            marker = buf[pos + 1]
+            if marker == 0xff:
+                # Fill byte
+                pos += 1
+                continue
+            if marker in (0xd9, 0xda):
+                # End of image, start of scan: no metadata after
+                return None
+            end = pos + 2 + struct.unpack('>H', buf[pos + 2:pos + 4])[0]
+            if marker == 0xe1:
+                if end > len(buf):
+                    # The file position is at the end of buf
+                    buf = buf[pos:] + f.read(end - len(buf))
+                    offset, end, pos = offset + pos, end - pos, 0
+                if buf[pos + 4:pos + 10] == b'Exif\x00\x00':
+                    return buf[pos:end]
+            pos = end
+
+
+def empty_exif() -> dict:
+    """
+    Exif dict of a picture without exif, as returned by piexif.load
+    """
+    return {"0th": {}, "Exif": {}, "GPS": {}, "Interop": {}, "1st": {}, "thumbnail": None}
+
+
+def load_exif(path: Path) -> dict:
+    """
+    Same as piexif.load, but for the JPEGs only the header of the file is read (see read_exif_segment)
+    """
+    try:
+        segment = read_exif_segment(path)
+    except piexif.InvalidImageDataError:
+        # TIFF, WebP: left to piexif
+        return piexif.load(str(path))
+    if segment is None:
+        return empty_exif()
+    # Without the marker and length: piexif parses the data starting with the "Exif" header
+    return piexif.load(segment[4:])
+
+
+def _load_exif_or_none(path: Path):
+    try:
+        return load_exif(path)
+    except Exception as e:
+        logging.warning(f"Cannot read the exif of {path}: {e}")
+        return None
+
+
+def load_exifs(paths: list[Path], max_workers=None):
+    """
+    Exif of many pictures, headers read by a pool of threads
+    :return: generator of (path, exif or None if it cannot be read), in the order of paths
+    """
+    max_workers = max_workers if max_workers else max(1, min(4, os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from zip(paths, executor.map(_load_exif_or_none, paths))
+
 
 def get_exif(path: Path):
     assert path.is_file(), f"{path} does not exist or is not a file"
 
     try:
-        exif_dict = piexif.load(str(path))
+        exif_dict = load_exif(path)
         # See bug https://github.com/hMatoba/Piexif/issues/95
         try:
             del exif_dict['Exif'][piexif.ExifIFD.SceneType]
@@ -36,7 +129,10 @@ def get_exif(path: Path):
 
 
 def get_lng_lat(file):
-    exif = get_exif(file)
+    return get_lng_lat_from_exif(get_exif(file))
+
+
+def get_lng_lat_from_exif(exif):
     if exif is not None and \
             'GPS' in exif and \
             piexif.GPSIFD.GPSLongitude in exif['GPS'] and \
@@ -69,7 +165,31 @@ def set_user_comment(exif_dict, userdata):
 def save_exif(exif_dict, path: Path):
     assert path.is_file()
     exif_bytes = piexif.dump(exif_dict)
-    piexif.insert(exif_bytes, str(path))
+    insert_exif(exif_bytes, path)
+
+
+def insert_exif(exif_bytes: bytes, path: Path):
+    """
+    Replace the exif of a picture with a single rewrite, atomic: the new content is written to a temporary file
+    next to it, renamed over it once complete. An interrupted write leaves the original file untouched
+    """
+    data = io.BytesIO()
+    piexif.insert(exif_bytes, path.read_bytes(), data)
+    # Hidden, not a media extension: ignored by the listings of the directory
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix='.tmp', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data.getbuffer())
+            f.flush()
+            os.fsync(f.fileno())
+        shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
 
 
 def print_exif(exif):
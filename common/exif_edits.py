@@ -0,0 +1,217 @@
+import contextlib
+import copy
+import datetime
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable
+
+import piexif
+
+from common.comment import Entity, ImageUserComment, UserComment
+from common.exif import empty_exif, get_exif, save_exif, set_geotagging
+
+# Edit of an exif dict, in place
+ExifEdit = Callable[[dict], None]
+
+# {file: [lock, number of threads using it]} of the files being written
+_file_locks: dict[Path, list] = {}
+_file_locks_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _file_lock(file: Path):
+    # Held from the read of the exif to its rewrite: 2 writes of a file are serialized, whoever runs them
+    with _file_locks_lock:
+        entry = _file_locks.setdefault(file, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _file_locks_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _file_locks[file]
+
+
+def write_exif_edits(file: Path, edits: list[ExifEdit]) -> bool:
+    """
+    Apply edits, in order, to the exif of file read once, and write it back with a single rewrite of the file
+    (see common.exif.insert_exif). The file is not rewritten if the edits leave its exif unchanged.
+    The writes of a file are serialized (e.g. the MetadataWriter and an ExifMaintenanceJob): each one applies its
+    edits to the exif written by the previous one
+    :return: True if the file has been rewritten
+    """
+    with _file_lock(file):
+        exif_dict = get_exif(file)
+        if exif_dict is None:
+            exif_dict = empty_exif()
+        original = copy.deepcopy(exif_dict)
+        for edit in edits:
+            edit(exif_dict)
+        if exif_dict == original:
+            return False
+        save_exif(exif_dict, path=file)
+        return True
+
+
+def strip_thumbnail(exif_dict):
+    """
+    Remove the embedded thumbnail
+    """
+    exif_dict['thumbnail'] = None
+    exif_dict['1st'] = {}
+
+
+def strip_orientation(exif_dict):
+    """
+    Remove the orientation tag: for the pictures whose pixels are already upright (rotated by a tool which kept
+    the tag). The pixels are not rotated
+    """
+    exif_dict['0th'].pop(piexif.ImageIFD.Orientation, None)
+
+
+def add_entities(entities: list[Entity]) -> ExifEdit:
+    """
+    Edit adding entities to the user comment, keeping the ones already there. The entities already in the comment
+    (same type and name) are skipped: the exif is left unchanged if there is nothing new
+    """
+    def _add_entities(exif_dict):
+        user_comment = ImageUserComment.from_exif(exif_dict)
+        new_entities = [entity for entity in entities
+                        if not any(type(other) is type(entity) and other == entity for other in user_comment.entities)]
+        if len(new_entities) == 0:
+            return
+        for entity in new_entities:
+            user_comment.add_entity(entity)
+        user_comment.update_exif(exif_dict)
+    return _add_entities
+
+
+def shift_datetimes(delta: datetime.timedelta) -> ExifEdit:
+    """
+    Edit shifting the dates of the exif (date of the file, taken and digitized) by delta
+    """
+    def _shift_datetimes(exif_dict):
+        for ifd, tag in [('0th', piexif.ImageIFD.DateTime),
+                         ('Exif', piexif.ExifIFD.DateTimeOriginal),
+                         ('Exif', piexif.ExifIFD.DateTimeDigitized)]:
+            value = exif_dict.get(ifd, {}).get(tag, None)
+            if not value:
+                continue
+            try:
+                # A timezone may follow the date
+                t = datetime.datetime.strptime(value[:19].decode('ascii'), '%Y:%m:%d %H:%M:%S')
+            except (ValueError, UnicodeDecodeError):
+                logging.warning(f"Cannot shift the date {value}")
+                continue
+            exif_dict[ifd][tag] = (t + delta).strftime('%Y:%m:%d %H:%M:%S').encode('ascii') + value[19:]
+    return _shift_datetimes
+
+
+def parse_time_offset(text: str) -> datetime.timedelta:
+    """
+    Offset written [-]H[:MM[:SS]] (e.g. "-1:30" for minus 1 hour 30 min), or [-]D days H[:MM[:SS]]
+    :raise ValueError: wrong format
+    """
+    text = text.strip()
+    sign = -1 if text.startswith('-') else 1
+    text = text.lstrip('+-').strip()
+    days = 0
+    if 'day' in text:
+        days_text, text = text.split('day', 1)
+        days = int(days_text)
+        text = text.lstrip('s').strip() or '0'
+    parts = [int(part) for part in text.split(':')]
+    if not 1 <= len(parts) <= 3 or any(part < 0 for part in parts) or any(part >= 60 for part in parts[1:]):
+        raise ValueError(f"Wrong time offset: {text}")
+    hours, minutes, seconds = parts + [0] * (3 - len(parts))
+    return sign * datetime.timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds)
+
+
+class ExifEdits:
+    """
+    Pending exif edits of many files, gathered from all the views. The edits of a file are coalesced: they are
+    applied in order to its exif read once, and written with a single rewrite of the file.
+
+    An edit may have a key: a new edit with the same key replaces the pending one (e.g. only the last GPS position
+    set is written).
+    """
+
+    def __init__(self):
+        # {file: {key: edit}}, in the order of the edits
+        self._edits: dict[Path, dict[object, ExifEdit]] = {}
+
+    def __len__(self):
+        return len(self._edits)
+
+    def __contains__(self, file: Path):
+        return file in self._edits
+
+    @property
+    def files(self) -> list[Path]:
+        """
+        Files with pending edits, sorted
+        """
+        return sorted(self._edits)
+
+    def edit(self, file: Path, edit: ExifEdit, key=None):
+        edits = self._edits.setdefault(file, {})
+        if key is None:
+            key = object()
+        # Replaced edit moved last
+        edits.pop(key, None)
+        edits[key] = edit
+
+    def set_user_comment(self, file: Path, user_comment: UserComment):
+        self.edit(file, user_comment.update_exif, key='user_comment')
+
+    def add_entities(self, file: Path, entities: list[Entity]):
+        """
+        Add entities to the user comment of file as it is when written: the edits of other entities are kept
+        """
+        self.edit(file, add_entities(entities))
+
+    def set_lng_lat(self, file: Path, lng: float, lat: float):
+        self.edit(file, lambda exif_dict: set_geotagging(exif_dict, lng, lat), key='gps')
+
+    def set_datetime(self, file: Path, datetime_new: datetime.datetime):
+        def _set_datetime(exif_dict):
+            value = datetime.datetime.strftime(datetime_new, '%Y:%m:%d %H:%M:%S').encode('ascii')
+            exif_dict["0th"][piexif.ImageIFD.DateTime] = value
+            # Pictures without a date taken get this one
+            exif_dict["Exif"].setdefault(piexif.ExifIFD.DateTimeOriginal, value)
+        self.edit(file, _set_datetime, key='datetime')
+
+    def pop(self, files: list[Path] = None) -> dict[Path, list[ExifEdit]]:
+        """
+        Take the pending edits of files (all by default)
+        :return: {file: edits in order}
+        """
+        files = list(self._edits) if files is None else [file for file in files if file in self._edits]
+        return {file: list(self._edits.pop(file).values()) for file in files}
+
+    def flush(self, max_workers=None, progress: Callable[[int, int], None] = None) -> dict[Path, Exception]:
+        """
+        Write all the pending edits, files written concurrently by a pool of threads
+        :param progress: called with (number of files processed, total)
+        :return: {file: error} of the files that could not be written
+        """
+        edits = self.pop()
+        failed = {}
+        max_workers = max_workers if max_workers else max(1, min(4, os.cpu_count() or 1))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(write_exif_edits, file, file_edits): file for file, file_edits in edits.items()}
+            for i, future in enumerate(as_completed(futures)):
+                file = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.warning(f"Cannot write the exif of {file}: {e}")
+                    failed[file] = e
+                if progress is not None:
+                    progress(i + 1, len(futures))
+        return failed
@@ -0,0 +1,139 @@
+import datetime
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import piexif
+from PIL import Image
+
+import common.exif_edits
+import resources.test_pics as test_pics
+from common.comment import ImageUserComment, PersonEntity, TagEntity
+from common.exif import get_exif, get_lng_lat, save_exif
+from common.exif_edits import ExifEdits, write_exif_edits, strip_thumbnail, strip_orientation, add_entities, \
+    shift_datetimes, parse_time_offset
+from common.thumbnails_test import add_exif_thumbnail
+
+default_pics_folder = Path(test_pics.__file__).parent
+
+
+class ExifEditsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.files = []
+        for name in ['20210908_122743.jpg', 'lenna.jpg']:
+            shutil.copy(default_pics_folder / name, self.out_dir / name)
+            self.files.append(self.out_dir / name)
+        self.edits = ExifEdits()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.out_dir)
+
+    def test_coalesced(self):
+        file = self.files[1]
+        self.edits.add_entities(file, [TagEntity('beach')])
+        self.edits.set_lng_lat(file, 1., 2.)
+        self.edits.add_entities(file, [PersonEntity('John Doe', (0, 1, 1, 0))])
+        self.edits.set_lng_lat(file, 3., 4.)
+        self.edits.set_datetime(file, datetime.datetime(2020, 1, 2, 3, 4, 5))
+        self.assertEqual(self.edits.files, [file])
+
+        with mock.patch.object(common.exif_edits, 'save_exif', wraps=save_exif) as save:
+            self.assertEqual(self.edits.flush(), {})
+            # A single rewrite
+            self.assertEqual(save.call_count, 1)
+        self.assertEqual(len(self.edits), 0)
+
+        comment = ImageUserComment.load_from_file(file)
+        self.assertEqual([tag.name for tag in comment.tags], ['tag1', 'beach'])
+        self.assertEqual([person.name for person in comment.persons], ['lenna', 'John Doe'])
+        lng, lat = get_lng_lat(file)
+        self.assertAlmostEqual(lng, 3., places=4)
+        self.assertAlmostEqual(lat, 4., places=4)
+        exif_dict = get_exif(file)
+        self.assertEqual(exif_dict['0th'][piexif.ImageIFD.DateTime], b'2020:01:02 03:04:05')
+        self.assertEqual(exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal], b'2020:01:02 03:04:05')
+
+    def test_set_user_comment(self):
+        # The last comment set wins, the entities added after it are kept
+        self.edits.set_user_comment(self.files[0], ImageUserComment([TagEntity('a')]))
+        self.edits.set_user_comment(self.files[0], ImageUserComment([TagEntity('b')]))
+        self.edits.add_entities(self.files[0], [TagEntity('c')])
+        self.edits.flush()
+        comment = ImageUserComment.load_from_file(self.files[0])
+        self.assertEqual([tag.name for tag in comment.tags], ['b', 'c'])
+
+    def test_flush_many(self):
+        progress = []
+        not_existing = self.out_dir / 'not_existing.jpg'
+        for file in self.files + [not_existing]:
+            self.edits.add_entities(file, [TagEntity('beach')])
+        failed = self.edits.flush(max_workers=2, progress=lambda done, total: progress.append((done, total)))
+        self.assertEqual(list(failed.keys()), [not_existing])
+        self.assertEqual(progress[-1], (3, 3))
+        for file in self.files:
+            self.assertIn('beach', [tag.name for tag in ImageUserComment.load_from_file(file).tags])
+        # No temporary file left
+        self.assertEqual(sorted(self.out_dir.iterdir()), self.files)
+
+    def test_pop(self):
+        self.edits.set_lng_lat(self.files[0], 1., 2.)
+        self.edits.set_lng_lat(self.files[1], 1., 2.)
+        edits = self.edits.pop([self.files[1]])
+        self.assertEqual(list(edits.keys()), [self.files[1]])
+        self.assertEqual(self.edits.files, self.files[:1])
+
+
+class MaintenanceEditsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.file = self.out_dir / 'test.jpg'
+        shutil.copy(default_pics_folder / '20210908_122743.jpg', self.file)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.out_dir)
+
+    def test_strip_thumbnail(self):
+        add_exif_thumbnail(self.file, orientation=6)
+        self.assertTrue(write_exif_edits(self.file, [strip_thumbnail, strip_orientation]))
+        exif_dict = get_exif(self.file)
+        self.assertIsNone(exif_dict['thumbnail'])
+        self.assertNotIn(piexif.ImageIFD.Orientation, exif_dict['0th'])
+
+    def test_unchanged_not_rewritten(self):
+        data = self.file.read_bytes()
+        with mock.patch.object(common.exif_edits, 'save_exif', wraps=save_exif) as save:
+            self.assertFalse(write_exif_edits(self.file, [strip_thumbnail, strip_orientation]))
+            self.assertFalse(write_exif_edits(self.file, [add_entities([TagEntity('TAG1')])]))
+            self.assertEqual(save.call_count, 0)
+        self.assertEqual(self.file.read_bytes(), data)
+
+    def test_no_exif(self):
+        file = self.out_dir / 'no_exif.jpg'
+        Image.new('RGB', (16, 16)).save(file)
+        self.assertFalse(write_exif_edits(file, [strip_thumbnail]))
+        self.assertTrue(write_exif_edits(file, [add_entities([TagEntity('beach')])]))
+        self.assertEqual([tag.name for tag in ImageUserComment.load_from_file(file).tags], ['beach'])
+
+    def test_shift_datetimes(self):
+        self.assertTrue(write_exif_edits(self.file, [shift_datetimes(datetime.timedelta(hours=-13))]))
+        exif_dict = get_exif(self.file)
+        self.assertEqual(exif_dict['Exif'][piexif.ExifIFD.DateTimeOriginal], b'2021:09:07 23:27:43')
+
+    def test_parse_time_offset(self):
+        self.assertEqual(parse_time_offset('2'), datetime.timedelta(hours=2))
+        self.assertEqual(parse_time_offset('-1:30'), -datetime.timedelta(hours=1, minutes=30))
+        self.assertEqual(parse_time_offset('+0:00:15'), datetime.timedelta(seconds=15))
+        self.assertEqual(parse_time_offset('-1 day 2:00'), -datetime.timedelta(days=1, hours=2))
+        self.assertEqual(parse_time_offset('3 days'), datetime.timedelta(days=3))
+        for text in ['', '1:60', 'a', '1:2:3:4']:
+            with self.assertRaises(ValueError):
+                parse_time_offset(text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import piexif
+from PIL import Image
+
+import common.exif
+import resources.test_pics as test_pics
+from common.exif import get_exif, get_lng_lat, load_exif, load_exifs, read_exif_segment, save_exif
+
+default_pics_folder = Path(test_pics.__file__).parent
+
+
+def insert_segment(file: Path, segment: bytes):
+    # Insert a segment right after the SOI marker, before the APP1 segment
+    data = file.read_bytes()
+    file.write_bytes(data[:2] + segment + data[2:])
+
+
+class LoadExifTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.file = self.out_dir / 'test.jpg'
+        shutil.copy(default_pics_folder / '20210908_122743.jpg', self.file)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.out_dir)
+
+    def test_same_as_piexif(self):
+        for file in [self.file, default_pics_folder / 'lenna.jpg', default_pics_folder / 'to_rename.jpg']:
+            self.assertEqual(load_exif(file), piexif.load(str(file)))
+        self.assertEqual(get_lng_lat(self.file), common.exif.get_lng_lat_from_exif(piexif.load(str(self.file))))
+
+    def test_header_only(self):
+        reads = []
+        open_ = open
+
+        def open_spy(*args, **kwargs):
+            f = open_(*args, **kwargs)
+            read = f.read
+            f.read = lambda size=-1: reads.append(size) or read(size)
+            return f
+
+        with mock.patch.object(common.exif, 'open', open_spy, create=True):
+            segment = read_exif_segment(self.file)
+        self.assertEqual(segment[:2], b'\xff\xe1')
+        self.assertEqual(reads, [common.exif.exif_head_size])
+
+    def test_segments_after_first_block(self):
+        exif_dict = piexif.load(str(self.file))
+        # Comments before APP1, larger than the first block read: APP1 across 2 blocks
+        comment = b'\xff\xfe' + (65533).to_bytes(2, 'big') + b'x' * 65531
+        insert_segment(self.file, comment)
+        insert_segment(self.file, b'\xff\xfe\x00\x10' + b'y' * 14)
+        self.assertEqual(load_exif(self.file), exif_dict)
+        with mock.patch.object(common.exif, 'exif_head_size', 100):
+            self.assertEqual(load_exif(self.file), exif_dict)
+
+    def test_no_exif(self):
+        file = self.out_dir / 'no_exif.jpg'
+        Image.new('RGB', (16, 16)).save(file)
+        self.assertIsNone(read_exif_segment(file))
+        self.assertEqual(load_exif(file), piexif.load(str(file)))
+        self.assertEqual(get_lng_lat(file), (None, None))
+
+    def test_not_a_jpeg(self):
+        file = self.out_dir / 'test.png'
+        Image.new('RGB', (16, 16)).save(file)
+        with self.assertRaises(piexif.InvalidImageDataError):
+            read_exif_segment(file)
+        with self.assertRaises(piexif.InvalidImageDataError):
+            get_exif(file)
+
+    def test_bulk(self):
+        files = [self.file, default_pics_folder / 'lenna.jpg', self.out_dir / 'not_existing.jpg']
+        results = list(load_exifs(files, max_workers=2))
+        self.assertEqual([file for file, _ in results], files)
+        self.assertEqual(results[0][1], load_exif(self.file))
+        self.assertIsNone(results[2][1])
+
+
+class SaveExifTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.file = self.out_dir / 'test.jpg'
+        shutil.copy(default_pics_folder / '20210908_122743.jpg', self.file)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.out_dir)
+
+    def test_save(self):
+        exif_dict = load_exif(self.file)
+        exif_dict['0th'][piexif.ImageIFD.Artist] = b'artist'
+        save_exif(exif_dict, self.file)
+        self.assertEqual(load_exif(self.file)['0th'][piexif.ImageIFD.Artist], b'artist')
+        # Same image data, no temporary file left
+        with Image.open(self.file) as img, Image.open(default_pics_folder / '20210908_122743.jpg') as img_src:
+            self.assertEqual(img.tobytes(), img_src.tobytes())
+        self.assertEqual(list(self.out_dir.iterdir()), [self.file])
+
+    def test_interrupted(self):
+        data = self.file.read_bytes()
+        exif_dict = load_exif(self.file)
+        exif_dict['0th'][piexif.ImageIFD.Artist] = b'artist'
+        with mock.patch.object(common.exif.os, 'replace', side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                save_exif(exif_dict, self.file)
+        # Original untouched
+        self.assertEqual(self.file.read_bytes(), data)
+        self.assertEqual(list(self.out_dir.iterdir()), [self.file])
+
+
+if __name__ == '__main__':
+    unittest.main()
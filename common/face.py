@@ -1,17 +1,21 @@
 import logging
 import os
+import threading
+import time
 import warnings
 from pathlib import Path
 
 import cv2
 import numpy as np
 import tensorflow as tf
+from deepface import DeepFace
 from deepface.DeepFace import build_model
 from deepface.commons import functions
 from deepface.detectors import FaceDetector
 
 from common.comment import PersonEntity
-from common.cv import image_resize, load_image, toCvMat
+from common.cv import image_resize, load_image_array
+from common.singleton import Singleton
 
 warnings.filterwarnings("ignore")
 
@@ -25,6 +29,102 @@ detection_backend = ['retinaface']
 # face_recognition_model = ['Dlib', 'VGG-Face', 'Facenet', 'OpenFace', 'DeepFace', 'ArcFace']
 face_recognition_model = ['Dlib', 'VGG-Face']
 unknown_tag = "unknown"
+# Max size (longest side, in px) of the image given to the detector. -1: full resolution
+detection_sizes = [-1, 640, 1024, 1600, 2048]
+
+
+class ModelRegistry(metaclass=Singleton):
+    """
+    Process-wide cache of the deepface detection backends and recognition models.
+
+    Models are built once on first use. acquire / release maintain a reference count so that a model
+    nobody uses anymore can be dropped, and preload builds models in a background thread so that the
+    first detection does not pay the construction cost.
+    """
+    detector = 'detector'
+    recognition = 'recognition'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {(kind, name): model}
+        self._models = {}
+        # {(kind, name): number of acquire not yet released}
+        self._ref_counts = {}
+        # {(kind, name): lock}, so that the same model is never built twice concurrently
+        self._build_locks = {}
+
+    @staticmethod
+    def _build(kind, name):
+        if kind == ModelRegistry.detector:
+            return FaceDetector.build_model(name)
+        return build_model(name)
+
+    def is_loaded(self, kind, name):
+        return (kind, name) in self._models
+
+    def get(self, kind, name):
+        key = (kind, name)
+        with self._lock:
+            if key in self._models:
+                return self._models[key]
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+
+        with build_lock:
+            # Might have been built by another thread while waiting
+            if key not in self._models:
+                t0 = time.time()
+                model = self._build(kind, name)
+                with self._lock:
+                    self._models[key] = model
+                logging.info(f"Model {name} ({kind}) built in {time.time() - t0:.1f}s")
+        return self._models[key]
+
+    def get_detector(self, name):
+        return self.get(ModelRegistry.detector, name)
+
+    def get_recognition_model(self, name):
+        return self.get(ModelRegistry.recognition, name)
+
+    def acquire(self, kind, name):
+        model = self.get(kind, name)
+        with self._lock:
+            self._ref_counts[(kind, name)] = self._ref_counts.get((kind, name), 0) + 1
+        return model
+
+    def release(self, kind, name):
+        key = (kind, name)
+        with self._lock:
+            if key not in self._ref_counts:
+                return
+            self._ref_counts[key] -= 1
+            if self._ref_counts[key] > 0:
+                return
+            del self._ref_counts[key]
+            self._models.pop(key, None)
+        # deepface keeps its own singletons, drop them too so that the memory can be reclaimed
+        cache = getattr(FaceDetector, 'face_detector_obj', None) if kind == ModelRegistry.detector else \
+            getattr(DeepFace, 'model_obj', None)
+        if isinstance(cache, dict):
+            cache.pop(name, None)
+        logging.info(f"Model {name} ({kind}) released")
+
+    def warm_up(self, detection_models=(), recognition_models=()):
+        """
+        Build (and acquire) the given models
+        """
+        for name in detection_models:
+            self.acquire(ModelRegistry.detector, name)
+        for name in recognition_models:
+            self.acquire(ModelRegistry.recognition, name)
+
+    def preload(self, detection_models=(), recognition_models=()) -> threading.Thread:
+        """
+        Warm up the given models in a background thread
+        """
+        thread = threading.Thread(target=self.warm_up, args=(list(detection_models), list(recognition_models)),
+                                  daemon=True)
+        thread.start()
+        return thread
 
 
 class DetectionResult(PersonEntity):
@@ -38,7 +138,7 @@ class DetectionResult(PersonEntity):
 
 def face_locations(img, detection_model='opencv', align=True):
     img = img[:, :, ::-1]  # rgb to bgr
-    face_detector = FaceDetector.build_model(detection_model)
+    face_detector = ModelRegistry().get_detector(detection_model)
     obj = FaceDetector.detect_faces(face_detector, detection_model, img, align)
     if len(obj) > 0:
         # (top, right, bottom, left)
@@ -58,53 +158,95 @@ def face_locations(img, detection_model='opencv', align=True):
     return imgs, regions
 
 
-def face_encodings(imgs, recognition_model='VGG-Face', align=True, normalization='base'):
+def _preprocess_patch(img, target_size):
+    """
+    Resize a face patch (RGB) to the model input size, keeping the aspect ratio and padding with black pixels.
+    :return: (h, w, 3) float32 array in [0, 1], or None if the patch is empty
+    """
+    img = img[:, :, ::-1]  # rgb to bgr
+    if img.shape[0] == 0 or img.shape[1] == 0:
+        return None
+
+    factor_0 = target_size[0] / img.shape[0]
+    factor_1 = target_size[1] / img.shape[1]
+    factor = min(factor_0, factor_1)
+
+    dsize = (int(img.shape[1] * factor), int(img.shape[0] * factor))
+    img = cv2.resize(img, dsize)
+
+    # Then pad the other side to the target size by adding black pixels
+    diff_0 = target_size[0] - img.shape[0]
+    diff_1 = target_size[1] - img.shape[1]
+    # Put the base image in the middle of the padded image
+    img = np.pad(img, ((diff_0 // 2, diff_0 - diff_0 // 2), (diff_1 // 2, diff_1 - diff_1 // 2), (0, 0)),
+                 'constant')
+    # double check: if target image is not still the same size with target.
+    if img.shape[0:2] != target_size:
+        img = cv2.resize(img, target_size)
+    # normalizing the image pixels
+    return img.astype(np.float32) / 255.  # normalize input in [0, 1]
+
+
+def face_encodings(imgs, recognition_model='VGG-Face', align=True, normalization='base', batch_size=32,
+                   timings=None):
     """
     This function represents facial images as vectors.
     Parameters:
-        img: numpy array (RGB)
+        imgs: list of numpy array (RGB)
         recognition_model (string): VGG-Face, Facenet, OpenFace, DeepFace, DeepID, Dlib, ArcFace.
-        model: Built deepface model. A face recognition model is built every call of verify function. You can pass pre-built face recognition model optionally if you will call verify function several times. Consider to pass model if you are going to call represent function in a for loop.
-            model = DeepFace.build_model('VGG-Face')
-        enforce_detection (boolean): If any face could not be detected in an image, then verify function will return exception. Set this to False not to have this exception. This might be convenient for low resolution images.
-        detector_backend (string): set face detector backend as retinaface, mtcnn, opencv, ssd or dlib
         normalization (string): normalize the input image before feeding to model
+        batch_size (int): max number of patches given to the model in a single inference call
+        timings (list): if given, one (number of patches, seconds) tuple is appended per inference call
     Returns:
-        Represent function returns a multidimensional vector. The number of dimensions is changing based on the reference model. E.g. FaceNet returns 128 dimensional vector; VGG-Face returns 2622 dimensional vector.
+        Represent function returns a multidimensional vector per non-empty patch, in input order. The number of
+        dimensions is changing based on the reference model. E.g. FaceNet returns 128 dimensional vector;
+        VGG-Face returns 2622 dimensional vector.
     """
+    return face_encodings_batch([imgs], recognition_model=recognition_model, align=align,
+                                normalization=normalization, batch_size=batch_size, timings=timings)[0]
 
+
+def face_encodings_batch(imgs_per_image, recognition_model='VGG-Face', align=True, normalization='base',
+                         batch_size=32, timings=None):
+    """
+    Same as face_encodings, for the patches of several images at once: all the patches are stacked in
+    batches of at most batch_size, whatever the image they come from.
+    :param imgs_per_image: list (one per image) of list of patches
+    :return: list (one per image) of list of embeddings
+    """
     # Build model and determine its specific shape
-    model = build_model(recognition_model)
+    model = ModelRegistry().get_recognition_model(recognition_model)
     target_size = functions.find_target_size(recognition_model)
+    # Some models (e.g. the Dlib wrapper) only handle one image per call
+    if not isinstance(model, tf.keras.Model):
+        batch_size = 1
+
+    # Flatten the patches, keeping track of the image they belong to
+    pixels = []
+    owners = []
+    for i, imgs in enumerate(imgs_per_image):
+        for img in imgs:
+            img_pixels = _preprocess_patch(img, target_size)
+            if img_pixels is not None:
+                pixels.append(img_pixels)
+                owners.append(i)
 
-    # For each detection, compute embedding
     embeddings = []
-    for img in imgs:
-        img = img[:, :, ::-1]  # rgb to bgr
-        if img.shape[0] > 0 and img.shape[1] > 0:
-            factor_0 = target_size[0] / img.shape[0]
-            factor_1 = target_size[1] / img.shape[1]
-            factor = min(factor_0, factor_1)
-
-            dsize = (int(img.shape[1] * factor), int(img.shape[0] * factor))
-            img = cv2.resize(img, dsize)
-
-            # Then pad the other side to the target size by adding black pixels
-            diff_0 = target_size[0] - img.shape[0]
-            diff_1 = target_size[1] - img.shape[1]
-            # Put the base image in the middle of the padded image
-            img = np.pad(img, ((diff_0 // 2, diff_0 - diff_0 // 2), (diff_1 // 2, diff_1 - diff_1 // 2), (0, 0)),
-                         'constant')
-            # double check: if target image is not still the same size with target.
-            if img.shape[0:2] != target_size:
-                img = cv2.resize(img, target_size)
-            # normalizing the image pixels
-            img_pixels = np.expand_dims(img, axis=0)
-            img_pixels = img_pixels.astype(np.float32) / 255.  # normalize input in [0, 1]
-            # represent
-            embedding = model.predict(img_pixels)[0]
-            embeddings.append(embedding)
-    return embeddings
+    for start in range(0, len(pixels), max(1, batch_size)):
+        batch = np.stack(pixels[start:start + max(1, batch_size)])
+        t0 = time.perf_counter()
+        if isinstance(model, tf.keras.Model):
+            out = model.predict_on_batch(batch)
+        else:
+            out = model.predict(batch)
+        if timings is not None:
+            timings.append((len(batch), time.perf_counter() - t0))
+        embeddings.extend(np.asarray(out))
+
+    out = [[] for _ in imgs_per_image]
+    for i, embedding in zip(owners, embeddings):
+        out[i].append(embedding)
+    return out
 
 
 def face_distance(face_encodings, face_to_compare):
@@ -134,45 +276,89 @@ def compare_faces(known_face_encodings, face_encoding_to_check, tolerance=0.6):
     return list(face_distance(known_face_encodings, face_encoding_to_check) <= tolerance)
 
 
-def face_recognition(path: Path, detection_model, recognition_model, db, max_size=-1):
-    qimage, _ = load_image(path)
-
-    detections = []
-
-    frame_orig = toCvMat(qimage)
-    # Get and reduce img
-    if max_size > -1:
-        if frame_orig.shape[0] > frame_orig.shape[1]:
-            frame = image_resize(frame_orig, height=800)
-        else:
-            frame = image_resize(frame_orig, width=800)
-        r = qimage.height() / frame.shape[0]
+def _detection_frame(frame, max_size):
+    """
+    Frame given to the detector: frame reduced so that its longest side is max_size (if larger)
+    :return: reduced frame, ratio full resolution / reduced
+    """
+    h, w = frame.shape[:2]
+    if max_size is None or max_size <= 0 or max(h, w) <= max_size:
+        return frame, 1.
+    if h > w:
+        reduced = image_resize(frame, height=max_size)
     else:
-        frame = frame_orig
-        r = 1.
+        reduced = image_resize(frame, width=max_size)
+    return reduced, h / reduced.shape[0]
 
-    patches, locations_scaled = face_locations(frame, detection_model=detection_model)
-    encodings = face_encodings(imgs=patches, recognition_model=recognition_model)
-    known_encodings, known_names = db.get_embeddings(model=recognition_model)
 
-    for (top, right, bottom, left), embedding in zip(locations_scaled, encodings):
-        (top, right, bottom, left) = (int(top * r), int(right * r), int(bottom * r), int(left * r))
-        patch = frame_orig[top:bottom, left:right]
-        # imgs.append(frame_orig[top:bottom, left:right])
-        # locations.append((top, right, bottom, left))
+def _aligned_patches(frame, locations, detection_model, margin=0.25):
+    """
+    Full resolution patches of the faces detected on a reduced frame, aligned like the ones of a full resolution
+    detection: the detector is run again on the full resolution crop of every face (enlarged by margin), which
+    is much smaller than the frame. The face of the crop closest to the location is kept, the plain crop if the
+    detector finds none.
+    """
+    h, w = frame.shape[:2]
+    patches = []
+    for top, right, bottom, left in locations:
+        dy, dx = int((bottom - top) * margin), int((right - left) * margin)
+        y0, x0 = max(0, top - dy), max(0, left - dx)
+        crop = frame[y0:min(h, bottom + dy), x0:min(w, right + dx)]
+        imgs, regions = face_locations(crop, detection_model=detection_model)
+        if len(imgs) == 0:
+            patches.append(frame[top:bottom, left:right])
+            continue
+        center = np.array([top + bottom - 2 * y0, left + right - 2 * x0]) / 2.
+        dist = [np.linalg.norm(np.array([t + b, l + r]) / 2. - center) for t, r, b, l in regions]
+        patches.append(imgs[int(np.argmin(dist))])
+    return patches
+
+
+def face_recognition(path: Path, detection_model, recognition_model, db, max_size=-1, tolerance=0.6, batch_size=32,
+                     cache=None):
+    """
+    Detect and recognize the faces of an image.
+    The detector runs on the image reduced to max_size (longest side, -1 for full resolution), the embeddings
+    are computed on the full resolution patches, aligned by the detector.
+    The detections are looked up in / stored to the cache (by default the one of the db) to skip the inference
+    when the file has already been processed with the same models.
+    """
+    if cache is None and db is not None:
+        cache = db.cache
 
-        # See if the face is a match for the known face(s)
-        matches = compare_faces(known_encodings, embedding)
-        name = unknown_tag
+    frame_orig, _ = load_image_array(path)
+    if frame_orig is None:
+        return []
 
-        # If a match was found in known_face_encodings, select the on with the lowest distance
-        if True in matches:
-            macthed_known_encodings = np.array(known_encodings)[matches]
-            _names = np.array(known_names)[matches]
-            _dist = face_distance(macthed_known_encodings, embedding)
-            _index = np.argmin(_dist)
-            name = _names[_index]
+    detections = []
 
+    cached = cache.get(path, detection_model, recognition_model, max_size) if cache is not None else None
+    if cached is not None:
+        locations, encodings = cached
+    else:
+        # Detection on the reduced image, boxes mapped back to the full resolution
+        frame, r = _detection_frame(frame_orig, max_size)
+        patches, locations_scaled = face_locations(frame, detection_model=detection_model)
+        h, w = frame_orig.shape[:2]
+        locations = [(max(0, int(top * r)), min(w, int(right * r)), min(h, int(bottom * r)), max(0, int(left * r)))
+                     for (top, right, bottom, left) in locations_scaled]
+        if r != 1.:
+            # Embeddings from the full resolution patches, aligned as in a full resolution detection
+            locations = [(top, right, bottom, left) for (top, right, bottom, left) in locations
+                         if bottom > top and right > left]
+            patches = _aligned_patches(frame_orig, locations, detection_model)
+        encodings = face_encodings(imgs=patches, recognition_model=recognition_model, batch_size=batch_size)
+        if cache is not None:
+            cache.put(path, detection_model, recognition_model, max_size, locations, encodings)
+
+    # All the faces of the image are matched against the db in one go (names left unknown without db)
+    if db is not None:
+        names = db.matcher.best_names(encodings, model=recognition_model, tolerance=tolerance, default=unknown_tag)
+    else:
+        names = [unknown_tag] * len(encodings)
+
+    for (top, right, bottom, left), embedding, name in zip(locations, encodings, names):
+        patch = frame_orig[top:bottom, left:right]
         detections.append(DetectionResult(file=path, embedding=embedding, patch=patch,
                                           location=(top, right, bottom, left), name=name))
 
@@ -0,0 +1,74 @@
+from pathlib import Path
+
+import numpy as np
+
+from common.sqlite_cache import SQLiteLRUCache
+
+_schema = """
+CREATE TABLE IF NOT EXISTS detections (
+    path TEXT NOT NULL,
+    detection_model TEXT NOT NULL,
+    recognition_model TEXT NOT NULL,
+    max_size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    dim INTEGER NOT NULL,
+    locations BLOB NOT NULL,
+    embeddings BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (path, detection_model, recognition_model, max_size)
+);
+DROP INDEX IF EXISTS detections_last_used;
+-- Covers the size of the cache and the eviction order, without reading the blobs
+CREATE INDEX IF NOT EXISTS detections_lru ON detections(last_used, nbytes);
+"""
+
+
+class FaceDetectionCache(SQLiteLRUCache):
+    """
+    On-disk cache of the face detections of a file: face locations (full resolution) + embeddings.
+
+    Entries are keyed by (path, detection model, recognition model, detection max size) and are only valid
+    for the mtime / size of the file when they were computed. Names are not cached: they depend on the db
+    and are matched at each call.
+    The cache is bounded in size, the least recently used entries are evicted first (see SQLiteLRUCache). The
+    worker processes of a job fill the same file.
+    """
+    table = 'detections'
+    key_columns = ('path', 'detection_model', 'recognition_model', 'max_size')
+    schema = _schema
+
+    def __init__(self, file: Path, max_bytes=256 * 1024 * 1024):
+        super(FaceDetectionCache, self).__init__(file, max_bytes)
+
+    def get(self, path: Path, detection_model, recognition_model, max_size=-1):
+        """
+        :return: (list of locations (top, right, bottom, left), list of embeddings) or None if not cached / stale
+        """
+        try:
+            stat = self._stat(path)
+        except OSError:
+            return None
+        row = self._lookup((str(path), detection_model, recognition_model, max_size), stat,
+                           "n, dim, locations, embeddings")
+        if row is None:
+            return None
+        n, dim = row[0], row[1]
+        locations = np.frombuffer(row[2], dtype=np.int32).reshape(n, 4)
+        embeddings = np.frombuffer(row[3], dtype=np.float32).reshape(n, dim)
+        return [tuple(int(i) for i in location) for location in locations], list(embeddings)
+
+    def put(self, path: Path, detection_model, recognition_model, max_size, locations, embeddings):
+        try:
+            stat = self._stat(path)
+        except OSError:
+            return
+        locations = np.asarray(locations, dtype=np.int32).reshape(-1, 4)
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        embeddings = embeddings.reshape(len(locations), -1) if len(locations) > 0 else np.empty((0, 0), np.float32)
+        blob_locations, blob_embeddings = locations.tobytes(), embeddings.tobytes()
+        self._insert((str(path), detection_model, recognition_model, max_size), stat,
+                     (len(locations), embeddings.shape[1], blob_locations, blob_embeddings),
+                     len(blob_locations) + len(blob_embeddings))
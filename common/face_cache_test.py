@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from common.face_cache import FaceDetectionCache
+
+
+class FaceDetectionCacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.files = []
+        for i in range(5):
+            file = self.out_dir / f"{i}.jpg"
+            file.write_bytes(bytes(100 + i))
+            self.files.append(file)
+        self.cache = FaceDetectionCache(self.out_dir / 'cache.sqlite')
+
+    def tearDown(self) -> None:
+        self.cache.close()
+        shutil.rmtree(self.out_dir)
+
+    def test_put_get(self):
+        locations = [(1, 20, 30, 2), (5, 60, 70, 6)]
+        embeddings = [np.arange(8, dtype=np.float32), np.ones(8, dtype=np.float32)]
+        self.assertIsNone(self.cache.get(self.files[0], 'retinaface', 'Dlib'))
+        self.cache.put(self.files[0], 'retinaface', 'Dlib', -1, locations, embeddings)
+
+        cached_locations, cached_embeddings = self.cache.get(self.files[0], 'retinaface', 'Dlib')
+        self.assertEqual(cached_locations, locations)
+        np.testing.assert_array_equal(cached_embeddings, embeddings)
+        # Other models / resolution are not cached
+        self.assertIsNone(self.cache.get(self.files[0], 'retinaface', 'VGG-Face'))
+        self.assertIsNone(self.cache.get(self.files[0], 'retinaface', 'Dlib', max_size=800))
+
+        # No face is cached as well
+        self.cache.put(self.files[1], 'retinaface', 'Dlib', -1, [], [])
+        self.assertEqual(self.cache.get(self.files[1], 'retinaface', 'Dlib'), ([], []))
+
+    def test_stale_entry(self):
+        self.cache.put(self.files[0], 'retinaface', 'Dlib', -1, [(1, 2, 3, 4)], [np.ones(4)])
+        stat = self.files[0].stat()
+        os.utime(self.files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(self.cache.get(self.files[0], 'retinaface', 'Dlib'))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.nbytes, 0)
+
+    def test_eviction(self):
+        # Each entry is 16 + 64 * 4 bytes
+        self.cache.max_bytes = 3 * (16 + 64 * 4)
+        for file in self.files[:3]:
+            self.cache.put(file, 'retinaface', 'Dlib', -1, [(1, 2, 3, 4)], [np.ones(64)])
+        # Refresh the first one, the second one is the least recently used
+        self.cache.get(self.files[0], 'retinaface', 'Dlib')
+        self.cache.put(self.files[3], 'retinaface', 'Dlib', -1, [(1, 2, 3, 4)], [np.ones(64)])
+
+        self.assertLessEqual(self.cache.nbytes, self.cache.max_bytes)
+        self.assertIsNotNone(self.cache.get(self.files[0], 'retinaface', 'Dlib'))
+        self.assertIsNone(self.cache.get(self.files[1], 'retinaface', 'Dlib'))
+        self.assertIsNotNone(self.cache.get(self.files[3], 'retinaface', 'Dlib'))
+
+    def test_eviction_shared(self):
+        # Caches of 2 workers on the same file: the entries of the other one count
+        other = FaceDetectionCache(self.out_dir / 'cache.sqlite')
+        self.addCleanup(other.close)
+        for cache in [self.cache, other]:
+            cache.max_bytes = 3 * (16 + 64 * 4)
+        for i, file in enumerate(self.files):
+            (self.cache if i % 2 == 0 else other).put(file, 'retinaface', 'Dlib', -1, [(1, 2, 3, 4)], [np.ones(64)])
+        self.assertLessEqual(len(self.cache), 3)
+        self.assertLessEqual(other.nbytes, other.max_bytes)
+        self.assertIsNotNone(self.cache.get(self.files[4], 'retinaface', 'Dlib'))
+
+
+if __name__ == '__main__':
+    unittest.main()
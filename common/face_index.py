@@ -0,0 +1,178 @@
+import logging
+from pathlib import Path
+
+import numpy as np
+
+
+def kmeans(data, n_clusters, n_iter=10, seed=0):
+    """
+    Plain Lloyd k-means initialized on random points, enough to train the coarse quantizer
+    :return: (n_clusters, d) float32 centroids
+    """
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    n_clusters = min(n_clusters, len(data))
+    centroids = data[rng.choice(len(data), size=n_clusters, replace=False)].copy()
+    sq_data = np.einsum('ij,ij->i', data, data)
+    for _ in range(n_iter):
+        assign = _nearest(data, sq_data, centroids)
+        counts = np.bincount(assign, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, data)
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+        # Empty clusters are re-seeded on random points
+        n_empty = int((~non_empty).sum())
+        if n_empty:
+            centroids[~non_empty] = data[rng.choice(len(data), size=n_empty, replace=False)]
+    return centroids
+
+
+def _nearest(data, sq_data, centroids):
+    sq = sq_data[:, None] + np.einsum('ij,ij->i', centroids, centroids)[None, :] - 2. * (data @ centroids.T)
+    return np.argmin(sq, axis=1)
+
+
+class IVFIndex(object):
+    """
+    Inverted file index over the rows of a FaceMatcher matrix (see face_matcher._ModelMatrix).
+
+    The embeddings are partitioned in n_lists clusters by k-means. A query is only compared to the rows of
+    its n_probe closest clusters, so the search cost is ~ n * n_probe / n_lists instead of n.
+    Only the centroids and the cluster of every row are persisted. Every list only holds row numbers, the
+    vectors are read from the matrix at search time (no copy of the matrix), and the lists are updated in place
+    when rows are added or removed.
+    """
+
+    def __init__(self, centroids):
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.sq_centroids = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        # Cluster of every row of the matrix
+        self.row_list = np.empty(0, dtype=np.int32)
+        # Size of the matrix when the quantizer was trained
+        self.trained_size = 0
+        # Rows of every cluster, built lazily from row_list then updated in place
+        self._lists: list[np.ndarray] = None
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @staticmethod
+    def default_n_lists(n):
+        return max(1, int(np.sqrt(n)))
+
+    @classmethod
+    def train(cls, mat, n_lists=None, n_iter=10, seed=0, max_train_size=50000):
+        data = mat.matrix
+        n_lists = n_lists if n_lists else cls.default_n_lists(len(data))
+        if len(data) > max_train_size:
+            data = data[np.random.default_rng(seed).choice(len(data), size=max_train_size, replace=False)]
+        index = cls(kmeans(data, n_lists, n_iter=n_iter, seed=seed))
+        index.trained_size = mat.size
+        index.assign_all(mat)
+        return index
+
+    def assign(self, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.centroids.shape[1])
+        return _nearest(embeddings, np.einsum('ij,ij->i', embeddings, embeddings), self.centroids).astype(np.int32)
+
+    def assign_all(self, mat, known: dict = None):
+        """
+        Set the cluster of every row of mat. Rows whose hash is in known ({hash: cluster}) keep their cluster
+        """
+        row_list = np.full(mat.size, -1, dtype=np.int32)
+        if known:
+            for row, hash_ in enumerate(mat.hashes):
+                row_list[row] = known.get(hash_, -1)
+        missing = np.flatnonzero(row_list < 0)
+        if len(missing):
+            row_list[missing] = self.assign(mat.matrix[missing])
+        self.row_list = row_list
+        self._lists = None
+
+    def on_append(self, mat, row):
+        """
+        Row of mat added or updated: only its list(s) change
+        """
+        if row >= len(self.row_list):
+            self.row_list = np.concatenate([self.row_list, np.full(row + 1 - len(self.row_list), -1, np.int32)])
+        old, new = self.row_list[row], self.assign(mat.data[row])[0]
+        self.row_list[row] = new
+        if self._lists is not None and old != new:
+            if old >= 0:
+                self._lists[old] = self._lists[old][self._lists[old] != row]
+            self._lists[new] = np.append(self._lists[new], row)
+
+    def on_remove(self, keep):
+        """
+        Rows of mat compacted, keep: previous rows of the remaining rows. The row numbers of the lists are
+        renumbered, no vector is copied
+        """
+        if self._lists is not None:
+            new_rows = np.full(len(self.row_list), -1, dtype=np.int64)
+            new_rows[keep] = np.arange(len(keep))
+            for i, rows in enumerate(self._lists):
+                rows = new_rows[rows]
+                self._lists[i] = rows[rows >= 0]
+        self.row_list = self.row_list[keep]
+
+    def _get_lists(self):
+        if self._lists is None:
+            order = np.argsort(self.row_list, kind='stable')
+            bounds = np.searchsorted(self.row_list[order], np.arange(self.n_lists + 1))
+            self._lists = [order[bounds[i]:bounds[i + 1]].copy() for i in range(self.n_lists)]
+        return self._lists
+
+    def search(self, mat, embeddings, k=1, n_probe=8):
+        """
+        :return: for every embedding, (rows, distances) of its up to k approximate nearest rows of mat
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, mat.dim)
+        lists = self._get_lists()
+        n_probe = min(n_probe, self.n_lists)
+
+        sq_queries = np.einsum('ij,ij->i', embeddings, embeddings)
+        sq = sq_queries[:, None] + self.sq_centroids[None, :] - 2. * (embeddings @ self.centroids.T)
+        probes = np.argpartition(sq, n_probe - 1, axis=1)[:, :n_probe] if n_probe < self.n_lists \
+            else np.broadcast_to(np.arange(self.n_lists), sq.shape)
+
+        results = []
+        for query, sq_query, probe in zip(embeddings, sq_queries, probes):
+            rows = np.concatenate([lists[i] for i in probe])
+            if len(rows) == 0:
+                results.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+                continue
+            # Only the vectors of the probed lists are read
+            dist = mat.sq_norms[rows] - 2. * (mat.data[rows] @ query) + sq_query
+            kk = min(k, len(rows))
+            best = np.argpartition(dist, kk - 1)[:kk] if kk < len(rows) else np.arange(len(rows))
+            best = best[np.argsort(dist[best])]
+            results.append((rows[best], np.sqrt(np.maximum(dist[best], 0.))))
+        return results
+
+    def needs_training(self, size):
+        # Lists get too long when the db has grown a lot since the quantizer was trained
+        return size > 4 * max(self.trained_size, 1)
+
+    def save(self, file: Path, hashes):
+        np.savez(file, centroids=self.centroids, row_list=self.row_list,
+                 hashes=np.array(hashes, dtype=str), trained_size=self.trained_size)
+
+    @classmethod
+    def load(cls, file: Path, mat):
+        """
+        Load an index and bring it in sync with mat: new rows are assigned, removed rows are dropped
+        """
+        try:
+            with np.load(file) as data:
+                index = cls(data['centroids'])
+                index.trained_size = int(data['trained_size'])
+                known = dict(zip(data['hashes'].tolist(), data['row_list'].tolist()))
+        except (OSError, KeyError, ValueError) as e:
+            logging.warning(f"IVFIndex: cannot load {file}: {e}")
+            return None
+        if index.centroids.ndim != 2 or index.centroids.shape[1] != mat.dim:
+            return None
+        index.assign_all(mat, known)
+        return index
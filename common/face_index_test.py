@@ -0,0 +1,121 @@
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from common.face_index import IVFIndex
+from common.face_matcher import FaceMatcher, _ModelMatrix
+
+
+class _Item:
+    def __init__(self, hash_, name, model, embedding):
+        self.hash = hash_
+        self.name = name
+        self.model = model
+        self.embedding = embedding
+
+
+class _DB:
+    def __init__(self, items):
+        self.db = {item.hash: item for item in items}
+
+    def get_embedding_matrix(self, model):
+        items = [item for item in self.db.values() if item.model == model]
+        return [item.hash for item in items], [item.name for item in items], \
+            np.array([item.embedding for item in items], dtype=np.float32)
+
+
+class IVFIndexTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(40, 16)).astype(np.float32)
+        labels = np.repeat(np.arange(40), 25)
+        data = centers[labels] + 0.1 * rng.normal(size=(len(labels), 16)).astype(np.float32)
+        self.items = [_Item(f"{i}", f"person{label}", 'Dlib', embedding)
+                      for i, (label, embedding) in enumerate(zip(labels, data))]
+        self.queries = centers[:10] + 0.1 * rng.normal(size=(10, 16)).astype(np.float32)
+        self.mat = _ModelMatrix([item.hash for item in self.items], [item.name for item in self.items], data)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.out_dir)
+
+    def test_all_lists_is_exact(self):
+        index = IVFIndex.train(self.mat)
+        dist = np.linalg.norm(self.mat.matrix[None] - self.queries[:, None], axis=2)
+        for (rows, d), expected in zip(index.search(self.mat, self.queries, k=3, n_probe=index.n_lists), dist):
+            np.testing.assert_array_equal(rows, np.argsort(expected)[:3])
+            np.testing.assert_allclose(d, np.sort(expected)[:3], rtol=1e-4)
+
+    def test_recall(self):
+        index = IVFIndex.train(self.mat)
+        results = index.search(self.mat, self.queries, k=1, n_probe=2)
+        self.assertEqual([self.mat.names[rows[0]] for rows, _ in results], [f"person{i}" for i in range(10)])
+
+    def test_save_load_sync(self):
+        index = IVFIndex.train(self.mat)
+        file = self.out_dir / 'index.npz'
+        index.save(file, self.mat.hashes)
+
+        # Db changed since saved
+        keep = self.mat.remove([self.items[0].hash])
+        index.on_remove(keep)
+        self.mat.append('new', 'new_person', self.queries[0])
+        loaded = IVFIndex.load(file, self.mat)
+        np.testing.assert_array_equal(loaded.centroids, index.centroids)
+        self.assertEqual(len(loaded.row_list), self.mat.size)
+        np.testing.assert_array_equal(loaded.row_list[:-1], index.row_list)
+
+    def test_incremental_lists(self):
+        index = IVFIndex.train(self.mat)
+        index.search(self.mat, self.queries, k=1)
+        lists = list(index._lists)
+        # New row: only its list is replaced
+        self.mat.append('new', 'new_person', self.queries[0])
+        index.on_append(self.mat, self.mat.size - 1)
+        new_list = index.row_list[-1]
+        self.assertEqual([i for i in range(index.n_lists) if index._lists[i] is not lists[i]], [new_list])
+        # Updated row moved to another list, rows removed
+        self.mat.append(self.items[1].hash, 'person0', self.queries[5])
+        index.on_append(self.mat, 1)
+        index.on_remove(self.mat.remove([self.items[0].hash, self.items[500].hash]))
+
+        # Same lists as rebuilt from the clusters of the rows
+        rebuilt = IVFIndex(index.centroids)
+        rebuilt.row_list = index.row_list
+        for rows, expected in zip(index._lists, rebuilt._get_lists()):
+            np.testing.assert_array_equal(np.sort(rows), expected)
+        dist = np.linalg.norm(self.mat.matrix[None] - self.queries[:, None], axis=2)
+        for (rows, _), expected in zip(index.search(self.mat, self.queries, k=3, n_probe=index.n_lists), dist):
+            np.testing.assert_array_equal(rows, np.argsort(expected)[:3])
+
+    def test_matcher_with_index(self):
+        db = _DB(self.items)
+        matcher = FaceMatcher(db, index_folder=self.out_dir, ann_min_size=100)
+        self.assertEqual(matcher.best_names(self.queries, 'Dlib'), [f"person{i}" for i in range(10)])
+        # Trained by the query, only persisted by save()
+        self.assertFalse((self.out_dir / 'index_Dlib.npz').exists())
+
+        # Incremental add / remove
+        item = _Item('new', 'new_person', 'Dlib', self.queries[0])
+        db.db[item.hash] = item
+        matcher.add_item(item)
+        name, dist = matcher.match(self.queries[:1], 'Dlib')[0][0]
+        self.assertEqual(name, 'new_person')
+        self.assertAlmostEqual(dist, 0., places=2)
+        matcher.remove_items([item.hash])
+        self.assertEqual(matcher.best_names(self.queries[:1], 'Dlib'), ['person0'])
+        self.assertFalse((self.out_dir / 'index_Dlib.npz').exists())
+        matcher.save()
+        self.assertTrue((self.out_dir / 'index_Dlib.npz').is_file())
+
+        # Reloaded from disk
+        matcher = FaceMatcher(_DB(self.items), index_folder=self.out_dir, ann_min_size=100)
+        self.assertEqual(matcher.best_names(self.queries, 'Dlib'), [f"person{i}" for i in range(10)])
+
+
+if __name__ == '__main__':
+    unittest.main()
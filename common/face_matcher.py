@@ -0,0 +1,375 @@
+import logging
+import typing
+from pathlib import Path
+
+import numpy as np
+
+from common.face_index import IVFIndex
+
+
+class _ModelMatrix(object):
+    """
+    Contiguous float32 embedding matrix of a single recognition model.
+    Rows are appended in place (amortized O(1)) and removed by compaction.
+    """
+
+    def __init__(self, hashes, names, matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        self.dim = matrix.shape[1]
+        self.size = matrix.shape[0]
+        self.data = np.empty((max(16, 2 * self.size), self.dim), dtype=np.float32)
+        self.data[:self.size] = matrix
+        # Squared norms of the rows, kept to compute distances with one matrix product
+        self.sq_norms = np.empty(self.data.shape[0], dtype=np.float32)
+        self.sq_norms[:self.size] = np.einsum('ij,ij->i', matrix, matrix)
+        self.names: list[str] = list(names)
+        self.hashes: list[str] = list(hashes)
+        # {hash: row}
+        self.rows: typing.Dict[str, int] = {h: i for i, h in enumerate(self.hashes)}
+
+    @property
+    def matrix(self):
+        return self.data[:self.size]
+
+    def append(self, hash_, name, embedding):
+        if hash_ in self.rows:
+            row = self.rows[hash_]
+            self.names[row] = name
+        else:
+            if self.size == self.data.shape[0]:
+                self.data = np.concatenate([self.data, np.empty_like(self.data)])
+                self.sq_norms = np.concatenate([self.sq_norms, np.empty_like(self.sq_norms)])
+            row = self.size
+            self.size += 1
+            self.rows[hash_] = row
+            self.names.append(name)
+            self.hashes.append(hash_)
+        self.data[row] = embedding
+        self.sq_norms[row] = np.dot(self.data[row], self.data[row])
+
+    def remove(self, hashes):
+        """
+        :return: previous rows of the rows kept, None if nothing removed
+        """
+        to_remove = {self.rows[h] for h in hashes if h in self.rows}
+        if not to_remove:
+            return None
+        keep = np.array([i for i in range(self.size) if i not in to_remove], dtype=np.int64)
+        n = len(keep)
+        self.data[:n] = self.data[keep]
+        self.sq_norms[:n] = self.sq_norms[keep]
+        self.names = [self.names[i] for i in keep]
+        self.hashes = [self.hashes[i] for i in keep]
+        self.rows = {h: i for i, h in enumerate(self.hashes)}
+        self.size = n
+        return keep
+
+    def rename(self, hash_, name):
+        if hash_ in self.rows:
+            self.names[self.rows[hash_]] = name
+
+
+class _Centroids(object):
+    """
+    Centroid of the embeddings of every name of a recognition model.
+    Sums and counts are kept so that inserting / removing / renaming a sample is O(d).
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+        # {name: row}
+        self.rows: typing.Dict[str, int] = {}
+        self.names: list[str] = []
+        self.sums = np.empty((0, dim), dtype=np.float64)
+        self.counts = np.empty(0, dtype=np.int64)
+        # Centroids matrix and squared norms, rebuilt lazily after any change
+        self._matrix = None
+        self._sq_norms = None
+        self._valid_names = []
+
+    @classmethod
+    def from_matrix(cls, mat: _ModelMatrix):
+        centroids = cls(mat.dim)
+        for name, embedding in zip(mat.names, mat.matrix):
+            centroids.add(name, embedding)
+        return centroids
+
+    @property
+    def size(self):
+        return int((self.counts > 0).sum())
+
+    def add(self, name, embedding):
+        row = self.rows.get(name, None)
+        if row is None:
+            row = len(self.names)
+            self.rows[name] = row
+            self.names.append(name)
+            self.sums = np.concatenate([self.sums, np.zeros((1, self.dim))])
+            self.counts = np.concatenate([self.counts, [0]])
+        self.sums[row] += embedding
+        self.counts[row] += 1
+        self._matrix = None
+
+    def remove(self, name, embedding):
+        row = self.rows.get(name, None)
+        if row is None:
+            return
+        self.sums[row] -= embedding
+        self.counts[row] -= 1
+        if self.counts[row] <= 0:
+            # Avoid accumulating rounding errors on an identity that comes back
+            self.sums[row] = 0.
+            self.counts[row] = 0
+        self._matrix = None
+
+    def get(self):
+        """
+        :return: (k, d) centroids, their squared norms and names. Names without sample are skipped
+        """
+        if self._matrix is None:
+            valid = np.flatnonzero(self.counts > 0)
+            self._matrix = (self.sums[valid] / self.counts[valid, None]).astype(np.float32)
+            self._sq_norms = np.einsum('ij,ij->i', self._matrix, self._matrix)
+            self._valid_names = [self.names[i] for i in valid]
+        return self._matrix, self._sq_norms, self._valid_names
+
+
+def _distances(embeddings, matrix, sq_norms):
+    # ||a - b||^2 = ||a||^2 + ||b||^2 - 2 a.b
+    sq = np.einsum('ij,ij->i', embeddings, embeddings)[:, None] + sq_norms[None, :]
+    sq -= 2. * (embeddings @ matrix.T)
+    np.maximum(sq, 0., out=sq)
+    return np.sqrt(sq)
+
+
+def _top_k(dist, names, k):
+    """
+    :return: for every row of dist (m, n), list of up to k (name, distance) sorted by increasing distance
+    """
+    n = dist.shape[1]
+    if n == 0:
+        return [[] for _ in range(dist.shape[0])]
+
+    k = min(k, n)
+    if k < n:
+        idx = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(n), (dist.shape[0], n))
+    idx_dist = np.take_along_axis(dist, idx, axis=1)
+    order = np.argsort(idx_dist, axis=1)
+    idx = np.take_along_axis(idx, order, axis=1)
+    idx_dist = np.take_along_axis(idx_dist, order, axis=1)
+    return [[(names[j], float(d)) for j, d in zip(row_idx, row_dist)]
+            for row_idx, row_dist in zip(idx, idx_dist)]
+
+
+class FaceMatcher(object):
+    """
+    Nearest-neighbour matcher over the embeddings stored in a FaceDetectionDB.
+
+    One contiguous float32 matrix is built per recognition model on first query, then kept in sync
+    with the db through add_item / rename_item / remove_items instead of being rebuilt.
+    Models with at least ann_min_size embeddings are searched through an IVF index (approximate), persisted
+    in index_folder if given.
+
+    Two matching modes:
+    - mode_samples: every embedding is compared to all the known samples,
+    - mode_centroids: every embedding is compared to the centroid of each name, O(names) instead of O(samples).
+      When the two closest centroids are within ambiguity_margin of each other, the embedding falls back to
+      the search over the samples (no fallback if ambiguity_margin is None).
+    """
+    mode_samples = 'samples'
+    mode_centroids = 'centroids'
+    modes = [mode_samples, mode_centroids]
+
+    def __init__(self, db=None, index_folder: Path = None, ann_min_size=5000, n_probe=8, mode=mode_samples,
+                 ambiguity_margin=0.05):
+        assert mode in self.modes, "matching mode not recognized"
+        self._db = db
+        # {model: _ModelMatrix}
+        self._matrices: typing.Dict[str, _ModelMatrix] = {}
+        # Matching mode
+        self.mode = mode
+        self.ambiguity_margin = ambiguity_margin
+        # {model: _Centroids}, built on first query in centroids mode
+        self._centroids: typing.Dict[str, _Centroids] = {}
+        # Approximate search
+        self.index_folder = index_folder
+        self.ann_min_size = ann_min_size
+        self.n_probe = n_probe
+        # {model: IVFIndex}
+        self._indexes: typing.Dict[str, IVFIndex] = {}
+        # Models whose index changed since last save
+        self._dirty: set[str] = set()
+
+    def _get(self, model) -> typing.Optional[_ModelMatrix]:
+        if model not in self._matrices:
+            if self._db is None:
+                return None
+            hashes, names, matrix = self._db.get_embedding_matrix(model)
+            if len(hashes) == 0:
+                return None
+            self._matrices[model] = _ModelMatrix(hashes, names, matrix)
+        return self._matrices[model]
+
+    def _index_file(self, model):
+        return self.index_folder / f"index_{model}.npz" if self.index_folder else None
+
+    def _get_index(self, model, mat: _ModelMatrix) -> typing.Optional[IVFIndex]:
+        if mat.size < self.ann_min_size:
+            return None
+        index = self._indexes.get(model, None)
+        if index is None:
+            file = self._index_file(model)
+            index = IVFIndex.load(file, mat) if file and file.exists() else None
+            if index is not None and index.needs_training(mat.size):
+                index = None
+        elif index.needs_training(mat.size):
+            index = None
+        if index is None:
+            logging.info(f"FaceMatcher: training index of {model} ({mat.size} embeddings)")
+            index = IVFIndex.train(mat)
+            self._dirty.add(model)
+        self._indexes[model] = index
+        return index
+
+    def save(self):
+        """
+        Persist the indexes changed since last save. Never done by the queries: called by the owner of the db,
+        once per batch of changes and when closing
+        """
+        for model in list(self._dirty):
+            file = self._index_file(model)
+            index, mat = self._indexes.get(model, None), self._matrices.get(model, None)
+            if file and index is not None and mat is not None:
+                index.save(file, mat.hashes)
+            self._dirty.discard(model)
+
+    def invalidate(self, model=None):
+        """
+        Drop the cached matrix of model (all of them if None). It will be rebuilt on next query.
+        """
+        if model is None:
+            self._matrices = {}
+            self._indexes = {}
+            self._centroids = {}
+        else:
+            self._matrices.pop(model, None)
+            self._indexes.pop(model, None)
+            self._centroids.pop(model, None)
+
+    def _get_centroids(self, model) -> typing.Optional[_Centroids]:
+        if model not in self._centroids:
+            mat = self._get(model)
+            if mat is None:
+                return None
+            self._centroids[model] = _Centroids.from_matrix(mat)
+        return self._centroids[model]
+
+    def add_item(self, item):
+        mat = self._matrices.get(item.model, None)
+        # Not built yet: it will contain the item when built
+        if mat is None:
+            return
+        if len(item.embedding) != mat.dim:
+            self.invalidate(item.model)
+            return
+        centroids = self._centroids.get(item.model, None)
+        if centroids is not None:
+            if item.hash in mat.rows:
+                row = mat.rows[item.hash]
+                centroids.remove(mat.names[row], mat.data[row])
+            centroids.add(item.name, np.asarray(item.embedding, dtype=np.float32))
+        mat.append(item.hash, item.name, item.embedding)
+        index = self._indexes.get(item.model, None)
+        if index is not None:
+            index.on_append(mat, mat.rows[item.hash])
+            self._dirty.add(item.model)
+
+    def rename_item(self, item):
+        mat = self._matrices.get(item.model, None)
+        if mat is not None:
+            centroids = self._centroids.get(item.model, None)
+            if centroids is not None and item.hash in mat.rows:
+                row = mat.rows[item.hash]
+                centroids.remove(mat.names[row], mat.data[row])
+                centroids.add(item.name, mat.data[row])
+            mat.rename(item.hash, item.name)
+
+    def remove_items(self, hashes):
+        for model, mat in self._matrices.items():
+            centroids = self._centroids.get(model, None)
+            if centroids is not None:
+                for hash_ in hashes:
+                    if hash_ in mat.rows:
+                        row = mat.rows[hash_]
+                        centroids.remove(mat.names[row], mat.data[row])
+            keep = mat.remove(hashes)
+            index = self._indexes.get(model, None)
+            if keep is not None and index is not None:
+                index.on_remove(keep)
+                self._dirty.add(model)
+
+    def size(self, model):
+        mat = self._get(model)
+        return mat.size if mat else 0
+
+    def distances(self, embeddings, model):
+        """
+        Euclidean distances between the embeddings (m, d) and all the known embeddings of model (n, d)
+        :return: (m, n) float32 array, list of the n known names
+        """
+        mat = self._get(model)
+        if mat is None or mat.size == 0:
+            return np.empty((len(embeddings), 0), dtype=np.float32), []
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, mat.dim)
+        return _distances(embeddings, mat.matrix, mat.sq_norms[:mat.size]), mat.names
+
+    def match(self, embeddings, model, k=1):
+        """
+        Find the k nearest known faces of every embedding in a single matrix operation.
+
+        :param embeddings: list or (m, d) array of embeddings, e.g. all the faces of an image or of a batch
+        :param model: recognition model the embeddings have been computed with
+        :param k: number of neighbours to return (in centroids mode, names)
+        :return: for every embedding, list of up to k (name, distance) sorted by increasing distance
+        """
+        if len(embeddings) == 0:
+            return []
+        if self.mode == self.mode_centroids:
+            return self._match_centroids(embeddings, model, k)
+        return self._match_samples(embeddings, model, k)
+
+    def _match_samples(self, embeddings, model, k):
+        mat = self._get(model)
+        index = self._get_index(model, mat) if mat is not None else None
+        if index is not None:
+            return [[(mat.names[j], float(d)) for j, d in zip(rows, dist)]
+                    for rows, dist in index.search(mat, embeddings, k=k, n_probe=self.n_probe)]
+
+        dist, names = self.distances(embeddings, model)
+        return _top_k(dist, names, k)
+
+    def _match_centroids(self, embeddings, model, k):
+        centroids = self._get_centroids(model)
+        if centroids is None:
+            return [[] for _ in range(len(embeddings))]
+        matrix, sq_norms, names = centroids.get()
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, centroids.dim)
+        results = _top_k(_distances(embeddings, matrix, sq_norms), names, max(k, 2))
+
+        # Ambiguous: the two closest identities are almost as close, search all the samples
+        if self.ambiguity_margin is not None:
+            ambiguous = [i for i, res in enumerate(results)
+                         if len(res) > 1 and res[1][1] - res[0][1] < self.ambiguity_margin]
+            if ambiguous:
+                for i, res in zip(ambiguous, self._match_samples(embeddings[ambiguous], model, k)):
+                    results[i] = res
+        return [res[:k] for res in results]
+
+    def best_names(self, embeddings, model, tolerance=0.6, default=None):
+        """
+        Name of the closest known face for each embedding, or default if none is within tolerance.
+        """
+        return [matches[0][0] if matches and matches[0][1] <= tolerance else default
+                for matches in self.match(embeddings, model, k=1)]
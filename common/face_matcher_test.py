@@ -0,0 +1,116 @@
+import unittest
+
+import numpy as np
+
+from common.face_matcher import FaceMatcher
+
+
+class _Item:
+    def __init__(self, name, model, embedding):
+        self.name = name
+        self.model = model
+        self.embedding = embedding.tolist()
+        self.hash = f"{name}_{model}_{id(self)}"
+
+
+class _DB:
+    def __init__(self, items):
+        self.db = {item.hash: item for item in items}
+
+    def get_embedding_matrix(self, model):
+        items = [item for item in self.db.values() if item.model == model]
+        return [item.hash for item in items], [item.name for item in items], \
+            np.array([item.embedding for item in items], dtype=np.float32)
+
+
+class FaceMatcherTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        rng = np.random.default_rng(0)
+        self.items = [_Item(f"person{i % 7}", 'Dlib', rng.normal(size=128)) for i in range(50)]
+        self.items += [_Item(f"person{i}", 'VGG-Face', rng.normal(size=64)) for i in range(5)]
+        self.db = _DB(self.items)
+        self.matcher = FaceMatcher(self.db)
+        self.queries = rng.normal(size=(4, 128))
+
+    def _brute_force(self, query, model):
+        items = [item for item in self.db.db.values() if item.model == model]
+        dist = np.linalg.norm(np.array([item.embedding for item in items]) - query, axis=1)
+        order = np.argsort(dist)
+        return [(items[i].name, dist[i]) for i in order]
+
+    def test_match_same_as_brute_force(self):
+        results = self.matcher.match(self.queries, model='Dlib', k=3)
+        self.assertEqual(len(results), len(self.queries))
+        for query, result in zip(self.queries, results):
+            expected = self._brute_force(query, 'Dlib')[:3]
+            self.assertEqual([name for name, _ in result], [name for name, _ in expected])
+            np.testing.assert_allclose([d for _, d in result], [d for _, d in expected], rtol=1e-4)
+
+    def test_best_names_tolerance(self):
+        query = np.array(self.items[3].embedding) + 0.01
+        self.assertEqual(self.matcher.best_names([query], model='Dlib'), [self.items[3].name])
+        self.assertEqual(self.matcher.best_names([query + 10.], model='Dlib', default='unknown'), ['unknown'])
+
+    def test_unknown_model(self):
+        self.assertEqual(self.matcher.match(self.queries, model='ArcFace'), [[]] * len(self.queries))
+        self.assertEqual(self.matcher.match([], model='Dlib'), [])
+
+    def test_incremental_update(self):
+        self.matcher.match(self.queries, model='Dlib')
+        # Add
+        item = _Item("new_person", 'Dlib', self.queries[0])
+        self.db.db[item.hash] = item
+        self.matcher.add_item(item)
+        self.assertEqual(self.matcher.size('Dlib'), 51)
+        self.assertEqual(self.matcher.match(self.queries[:1], model='Dlib')[0][0][0], "new_person")
+        # Rename
+        item.name = "renamed"
+        self.matcher.rename_item(item)
+        self.assertEqual(self.matcher.match(self.queries[:1], model='Dlib')[0][0][0], "renamed")
+        # Remove
+        del self.db.db[item.hash]
+        self.matcher.remove_items([item.hash])
+        self.assertEqual(self.matcher.size('Dlib'), 50)
+        self.assertEqual(self.matcher.match(self.queries[:1], model='Dlib')[0][0][0],
+                         self._brute_force(self.queries[0], 'Dlib')[0][0])
+
+    def _centroid(self, name, model='Dlib'):
+        return np.mean([item.embedding for item in self.db.db.values() if item.name == name and item.model == model],
+                       axis=0)
+
+    def test_centroids_mode(self):
+        matcher = FaceMatcher(self.db, mode=FaceMatcher.mode_centroids, ambiguity_margin=None)
+        names = sorted({item.name for item in self.items if item.model == 'Dlib'})
+        for query, result in zip(self.queries, matcher.match(self.queries, model='Dlib', k=2)):
+            dist = [np.linalg.norm(self._centroid(name) - query) for name in names]
+            order = np.argsort(dist)[:2]
+            self.assertEqual([name for name, _ in result], [names[i] for i in order])
+            np.testing.assert_allclose([d for _, d in result], np.array(dist)[order], rtol=1e-4)
+
+        # Incremental add / rename / remove keep the centroids up to date
+        item = _Item("person0", 'Dlib', self.queries[0] * 3.)
+        self.db.db[item.hash] = item
+        matcher.add_item(item)
+        matcher.match(self.queries[:1], model='Dlib')
+        centroids = matcher._centroids['Dlib']
+        np.testing.assert_allclose(centroids.get()[0][centroids.get()[2].index("person0")],
+                                   self._centroid("person0"), rtol=1e-4, atol=1e-5)
+        item.name = "renamed"
+        matcher.rename_item(item)
+        np.testing.assert_allclose(centroids.get()[0][centroids.get()[2].index("renamed")], item.embedding,
+                                   rtol=1e-4)
+        del self.db.db[item.hash]
+        matcher.remove_items([item.hash])
+        self.assertNotIn("renamed", centroids.get()[2])
+        np.testing.assert_allclose(centroids.get()[0][centroids.get()[2].index("person0")],
+                                   self._centroid("person0"), rtol=1e-4, atol=1e-5)
+
+    def test_centroids_ambiguous_fallback(self):
+        # Infinite margin: every query is ambiguous, same results as the samples mode
+        matcher = FaceMatcher(self.db, mode=FaceMatcher.mode_centroids, ambiguity_margin=np.inf)
+        self.assertEqual(matcher.match(self.queries, model='Dlib', k=3), self.matcher.match(self.queries, 'Dlib', k=3))
+
+
+if __name__ == '__main__':
+    unittest.main()
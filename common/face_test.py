@@ -0,0 +1,283 @@
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import tensorflow as tf
+
+import common.face as face
+from common.face import ModelRegistry, _aligned_patches, _detection_frame
+from common.singleton import Singleton
+
+
+class DetectionFrameTest(unittest.TestCase):
+
+    def test_reduced(self):
+        frame = np.zeros((3000, 4000, 3), dtype=np.uint8)
+        reduced, r = _detection_frame(frame, 1600)
+        self.assertEqual(reduced.shape, (1200, 1600, 3))
+        self.assertAlmostEqual(r, 2.5)
+
+        reduced, r = _detection_frame(frame.transpose(1, 0, 2), 1600)
+        self.assertEqual(reduced.shape, (1600, 1200, 3))
+        self.assertAlmostEqual(r, 2.5)
+
+    def test_full_resolution(self):
+        frame = np.zeros((300, 400, 3), dtype=np.uint8)
+        for max_size in [-1, 0, 400, 1600]:
+            reduced, r = _detection_frame(frame, max_size)
+            self.assertIs(reduced, frame)
+            self.assertEqual(r, 1.)
+
+
+def _fake_face_locations(faces):
+    """
+    Detector finding the given (top, right, bottom, left) faces of the full frame in any crop of it. The
+    "aligned" patch of a face is filled with its index
+    """
+    def face_locations(img, detection_model='opencv', align=True):
+        y0, x0 = img.meta
+        imgs, regions = [], []
+        for i, (top, right, bottom, left) in enumerate(faces):
+            top, right, bottom, left = top - y0, right - x0, bottom - y0, left - x0
+            if top >= 0 and left >= 0 and bottom <= img.shape[0] and right <= img.shape[1]:
+                imgs.append(np.full((bottom - top, right - left, 3), i, dtype=np.uint8))
+                regions.append((top, right, bottom, left))
+        return imgs, regions
+    return face_locations
+
+
+class _Frame(np.ndarray):
+    """
+    Frame whose crops know their offset (meta: (y, x)) in the full frame
+    """
+    def __getitem__(self, item):
+        out = super().__getitem__(item)
+        if isinstance(item, tuple) and len(item) == 2 and all(isinstance(sl, slice) for sl in item):
+            out.meta = (self.meta[0] + (item[0].start or 0), self.meta[1] + (item[1].start or 0))
+        return out
+
+
+def _frame(h, w):
+    frame = np.zeros((h, w, 3), dtype=np.uint8).view(_Frame)
+    frame.meta = (0, 0)
+    return frame
+
+
+class AlignedPatchesTest(unittest.TestCase):
+
+    def test_closest_face_of_the_crop(self):
+        faces = [(120, 345, 160, 305), (100, 300, 300, 100), (1000, 1300, 1400, 1000)]
+        frame = _frame(2000, 2000)
+        with mock.patch.object(face, 'face_locations', side_effect=_fake_face_locations(faces)) as locations:
+            patches = _aligned_patches(frame, faces, 'retinaface')
+        # The neighbour of a face is in its enlarged crop, but the face itself is kept
+        self.assertEqual([int(patch[0, 0, 0]) for patch in patches], [0, 1, 2])
+        # Detector run on the full resolution crops only
+        self.assertEqual([call.args[0].shape[:2] for call in locations.call_args_list],
+                         [(60, 60), (300, 300), (600, 450)])
+
+    def test_no_face_in_crop(self):
+        frame = _frame(1000, 1000)
+        with mock.patch.object(face, 'face_locations', side_effect=_fake_face_locations([])):
+            patches = _aligned_patches(frame, [(100, 300, 300, 100)], 'retinaface')
+        self.assertEqual(patches[0].shape, (200, 200, 3))
+
+    def test_face_recognition_reduced(self):
+        faces = [(400, 1200, 1200, 400)]
+        frame = _frame(2000, 3000)
+        fake = _fake_face_locations([(200, 600, 600, 200)])
+
+        def face_locations(img, detection_model='opencv', align=True):
+            # Detection on the reduced frame, then on the full resolution crop
+            if img.shape[:2] == (1000, 1500):
+                img = img.view(_Frame)
+                img.meta = (0, 0)
+                return fake(img)
+            return _fake_face_locations(faces)(img)
+
+        with mock.patch.object(face, 'load_image_array', return_value=(frame, None)), \
+                mock.patch.object(face, 'face_locations', side_effect=face_locations), \
+                mock.patch.object(face, 'face_encodings', return_value=[np.zeros(4)]) as encodings:
+            detections = face.face_recognition(Path('img.jpg'), 'retinaface', 'Dlib', db=None, max_size=1500)
+        self.assertEqual([d.location for d in detections], faces)
+        # The aligned full resolution patch is embedded
+        patches = encodings.call_args.kwargs['imgs']
+        self.assertEqual(patches[0].shape, (800, 800, 3))
+        self.assertTrue(np.all(patches[0] == 0))
+
+
+class ModelRegistryTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        # Fresh registry, the process-wide one is restored after the test
+        self.registry_orig = Singleton._instances.pop(ModelRegistry, None)
+        self.registry = ModelRegistry()
+
+        def build(kind, name):
+            time.sleep(0.05)
+            return object()
+        patcher = mock.patch.object(ModelRegistry, '_build', side_effect=build)
+        self.build = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self) -> None:
+        Singleton._instances.pop(ModelRegistry, None)
+        if self.registry_orig is not None:
+            Singleton._instances[ModelRegistry] = self.registry_orig
+
+    def test_built_once(self):
+        model = self.registry.get_recognition_model('Dlib')
+        # Same model for every caller
+        self.assertIs(ModelRegistry(), self.registry)
+        self.assertIs(ModelRegistry().get_recognition_model('Dlib'), model)
+        self.assertIsNot(self.registry.get_detector('Dlib'), model)
+        self.assertEqual(self.build.call_args_list, [mock.call(ModelRegistry.recognition, 'Dlib'),
+                                                     mock.call(ModelRegistry.detector, 'Dlib')])
+
+    def test_built_once_concurrently(self):
+        models = []
+        threads = [threading.Thread(target=lambda: models.append(self.registry.get_detector('retinaface')))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.build.call_count, 1)
+        self.assertTrue(all(model is models[0] for model in models))
+
+    def test_acquire_release(self):
+        kind = ModelRegistry.recognition
+        model = self.registry.acquire(kind, 'VGG-Face')
+        self.assertIs(self.registry.acquire(kind, 'VGG-Face'), model)
+        self.assertEqual(self.build.call_count, 1)
+
+        deepface_cache = {'VGG-Face': model, 'Dlib': object()}
+        with mock.patch.object(face.DeepFace, 'model_obj', deepface_cache, create=True):
+            # Still used by the other caller
+            self.registry.release(kind, 'VGG-Face')
+            self.assertTrue(self.registry.is_loaded(kind, 'VGG-Face'))
+            self.assertIn('VGG-Face', deepface_cache)
+            # Last release: dropped, with the deepface singleton
+            self.registry.release(kind, 'VGG-Face')
+            self.assertFalse(self.registry.is_loaded(kind, 'VGG-Face'))
+            self.assertEqual(list(deepface_cache.keys()), ['Dlib'])
+            # Not acquired anymore: no-op
+            self.registry.release(kind, 'VGG-Face')
+
+        # Built again on next use
+        self.assertIsNot(self.registry.acquire(kind, 'VGG-Face'), model)
+        self.assertEqual(self.build.call_count, 2)
+
+    def test_release_detector(self):
+        model = self.registry.acquire(ModelRegistry.detector, 'retinaface')
+        deepface_cache = {'retinaface': model}
+        with mock.patch.object(face.FaceDetector, 'face_detector_obj', deepface_cache, create=True):
+            self.registry.release(ModelRegistry.detector, 'retinaface')
+        self.assertFalse(self.registry.is_loaded(ModelRegistry.detector, 'retinaface'))
+        self.assertEqual(deepface_cache, {})
+
+    def test_get_does_not_acquire(self):
+        self.registry.get_detector('retinaface')
+        self.registry.release(ModelRegistry.detector, 'retinaface')
+        self.assertTrue(self.registry.is_loaded(ModelRegistry.detector, 'retinaface'))
+
+    def test_preload(self):
+        thread = self.registry.preload(detection_models=['retinaface'], recognition_models=['Dlib', 'VGG-Face'])
+        thread.join()
+        for kind, name in [(ModelRegistry.detector, 'retinaface'), (ModelRegistry.recognition, 'Dlib'),
+                           (ModelRegistry.recognition, 'VGG-Face')]:
+            self.assertTrue(self.registry.is_loaded(kind, name))
+        self.assertEqual(self.build.call_count, 3)
+        # Not built again by the first detection
+        self.registry.get_detector('retinaface')
+        self.assertEqual(self.build.call_count, 3)
+        # Preloaded models are acquired: freed on their release
+        self.registry.release(ModelRegistry.recognition, 'Dlib')
+        self.assertFalse(self.registry.is_loaded(ModelRegistry.recognition, 'Dlib'))
+
+
+class _FakeKerasModel(tf.keras.Model):
+    """
+    Records the shape of the batches it receives. Embedding: the value of the first pixel of the patch
+    """
+    def __init__(self):
+        super().__init__()
+        self.batch_shapes = []
+
+    def predict_on_batch(self, x):
+        self.batch_shapes.append(x.shape)
+        return np.round(x[:, 0, 0, :1] * 255.)
+
+
+class _FakeModel:
+    """
+    Model without batch support (like the Dlib wrapper)
+    """
+    def __init__(self):
+        self.batch_shapes = []
+
+    def predict(self, x):
+        self.batch_shapes.append(x.shape)
+        return np.round(x[:, 0, 0, :1] * 255.)
+
+
+def _patches(*values):
+    return [np.full((40, 40, 3), value, dtype=np.uint8) for value in values]
+
+
+class FaceEncodingsBatchTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.model = _FakeKerasModel()
+        patcher = mock.patch.object(ModelRegistry, 'get_recognition_model', side_effect=lambda name: self.model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.target_size = face.functions.find_target_size('VGG-Face')
+
+    def _values(self, out):
+        return [[int(embedding[0]) for embedding in embeddings] for embeddings in out]
+
+    def test_input_order(self):
+        out = face.face_encodings_batch([_patches(1, 2), _patches(3), _patches(4, 5, 6)], batch_size=4)
+        self.assertEqual(self._values(out), [[1, 2], [3], [4, 5, 6]])
+
+    def test_no_patch(self):
+        out = face.face_encodings_batch([[], _patches(1), [], [np.zeros((0, 10, 3), dtype=np.uint8)],
+                                         _patches(2)])
+        self.assertEqual(self._values(out), [[], [1], [], [], [2]])
+        self.assertEqual(self.model.batch_shapes, [(2, *self.target_size, 3)])
+        # Nothing to embed: no inference
+        self.model.batch_shapes = []
+        self.assertEqual(face.face_encodings_batch([[], []]), [[], []])
+        self.assertEqual(self.model.batch_shapes, [])
+
+    def test_split(self):
+        # Batches across the images, split at batch_size
+        out = face.face_encodings_batch([_patches(1, 2, 3), _patches(4, 5, 6, 7)], batch_size=3)
+        self.assertEqual(self._values(out), [[1, 2, 3], [4, 5, 6, 7]])
+        self.assertEqual([shape[0] for shape in self.model.batch_shapes], [3, 3, 1])
+
+    def test_model_without_batch(self):
+        self.model = _FakeModel()
+        out = face.face_encodings_batch([_patches(1, 2), _patches(3)], recognition_model='Dlib', batch_size=32)
+        self.assertEqual(self._values(out), [[1, 2], [3]])
+        self.assertEqual([shape[0] for shape in self.model.batch_shapes], [1, 1, 1])
+
+    def test_timings(self):
+        timings = []
+        face.face_encodings_batch([_patches(1, 2, 3), _patches(4, 5)], batch_size=2, timings=timings)
+        # One (number of patches, seconds) per inference call
+        self.assertEqual([n for n, _ in timings], [2, 2, 1])
+        self.assertTrue(all(t >= 0. for _, t in timings))
+        # face_encodings: the patches of a single image
+        timings = []
+        out = face.face_encodings(_patches(1, 2, 3), batch_size=2, timings=timings)
+        self.assertEqual([int(embedding[0]) for embedding in out], [1, 2, 3])
+        self.assertEqual([n for n, _ in timings], [2, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,382 @@
+import datetime
+import json
+import logging
+import shlex
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable
+
+import piexif
+import piexif.helper
+from PIL import Image
+
+from common import exif
+from common.comment import PersonEntity, TagEntity
+from common.constants import FILE_EXTENSION_PHOTO_JPG
+
+# Version of the schema, an older index is dropped and built again from the files
+_schema_version = 1
+_schema = """
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    dirpath TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    datetime_original TEXT,
+    lng REAL,
+    lat REAL,
+    orientation INTEGER,
+    width INTEGER,
+    height INTEGER,
+    user_comment TEXT,
+    tags TEXT NOT NULL,
+    persons TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS media_dirpath ON media(dirpath);
+-- Inverted index of the tags / persons (lower case names) of the user comments
+CREATE TABLE IF NOT EXISTS entities (
+    type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    media_id INTEGER NOT NULL,
+    PRIMARY KEY (type, name, media_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entities_name ON entities(name, media_id);
+CREATE INDEX IF NOT EXISTS entities_media ON entities(media_id);
+"""
+
+_columns = "path, mtime_ns, size, datetime_original, lng, lat, orientation, width, height, user_comment"
+_columns_write = "path, dirpath, mtime_ns, size, datetime_original, lng, lat, orientation, width, height, " \
+                 "user_comment, tags, persons"
+
+
+class MediaMetadata(object):
+    """
+    Metadata of a media file used by the views: capture date, GPS coords, orientation, dimensions and the
+    user comment (list of entities dicts, see common.comment) with the names of its tags / persons.
+    Fields not available for the file are None.
+    """
+
+    def __init__(self, path: Path, mtime_ns: int, size: int, datetime_original: datetime.datetime = None,
+                 lng: float = None, lat: float = None, orientation: int = None, width: int = None,
+                 height: int = None, user_comment: list = None):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.datetime_original = datetime_original
+        self.lng = lng
+        self.lat = lat
+        self.orientation = orientation
+        self.width = width
+        self.height = height
+        self.user_comment = user_comment
+
+    @property
+    def tags(self) -> list[str]:
+        return [i['name'] for i in self.user_comment or [] if i.get('type', None) == TagEntity.type()]
+
+    @property
+    def persons(self) -> list[str]:
+        return [i['name'] for i in self.user_comment or [] if i.get('type', None) == PersonEntity.type()]
+
+    def to_row(self):
+        return (str(self.path), str(self.path.parent), self.mtime_ns, self.size,
+                self.datetime_original.isoformat() if self.datetime_original else None, self.lng, self.lat,
+                self.orientation, self.width, self.height,
+                json.dumps(self.user_comment) if self.user_comment is not None else None,
+                json.dumps(self.tags), json.dumps(self.persons))
+
+    @staticmethod
+    def from_row(row):
+        return MediaMetadata(path=Path(row[0]), mtime_ns=row[1], size=row[2],
+                             datetime_original=datetime.datetime.fromisoformat(row[3]) if row[3] else None,
+                             lng=row[4], lat=row[5], orientation=row[6], width=row[7], height=row[8],
+                             user_comment=json.loads(row[9]) if row[9] is not None else None)
+
+
+def _read_user_comment(exif_dict):
+    if piexif.ExifIFD.UserComment not in exif_dict.get('Exif', {}):
+        return None
+    try:
+        user_comment = json.loads(piexif.helper.UserComment.load(exif_dict['Exif'][piexif.ExifIFD.UserComment]))
+    except Exception:
+        return None
+    # Only the list of entities format is handled by common.comment
+    return user_comment if isinstance(user_comment, list) else None
+
+
+def read_metadata(path: Path) -> MediaMetadata:
+    """
+    Read the metadata of a media file (exif of the jpgs, only the stat of the other files)
+    :raise OSError: file cannot be read
+    """
+    stat = path.stat()
+    metadata = MediaMetadata(path=path, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+    if path.suffix not in FILE_EXTENSION_PHOTO_JPG:
+        return metadata
+
+    # Header only
+    with Image.open(path) as img:
+        metadata.width, metadata.height = img.size
+    try:
+        exif_dict = exif.load_exif(path)
+    except Exception as e:
+        logging.warning(f"Cannot read the exif of {path}: {e}")
+        return metadata
+    try:
+        metadata.datetime_original = exif.get_datetime(exif_dict)
+    except Exception:
+        pass
+    try:
+        metadata.lng, metadata.lat = exif.get_lng_lat_from_exif(exif_dict)
+    except Exception:
+        pass
+    metadata.orientation = exif_dict.get('0th', {}).get(piexif.ImageIFD.Orientation, None)
+    metadata.user_comment = _read_user_comment(exif_dict)
+    return metadata
+
+
+def parse_search_query(text: str) -> tuple[list[str], list[str], list[str]]:
+    """
+    Parse a search query: 'tag:beach person:"John Doe" holidays'. Words without prefix match a tag or a person
+    :return: tags, persons, names
+    """
+    try:
+        words = shlex.split(text)
+    except ValueError:
+        # Unbalanced quotes
+        words = text.split()
+    tags, persons, names = [], [], []
+    for word in words:
+        prefix, sep, name = word.partition(':')
+        if sep and prefix.lower() == TagEntity.type() and name:
+            tags.append(name)
+        elif sep and prefix.lower() == PersonEntity.type() and name:
+            persons.append(name)
+        else:
+            names.append(word)
+    return tags, persons, names
+
+
+def load_metadata(files: Iterable[Path], index: 'MetadataIndex' = None) -> dict[Path, MediaMetadata]:
+    """
+    Metadata of files, through the index if any
+    :return: {file: metadata}, files that cannot be read are skipped
+    """
+    if index is not None:
+        return index.load_many(files)
+    out = {}
+    for file in files:
+        try:
+            out[file] = read_metadata(file)
+        except OSError as e:
+            logging.warning(f"Cannot read {file}: {e}")
+    return out
+
+
+class MetadataIndex(object):
+    """
+    Local sqlite index of the metadata of the media files, so that the views query it instead of parsing the
+    exif of each file.
+
+    Entries are keyed by path and only valid for the mtime / size of the file when they were read: the
+    freshness is checked against a stat of the file, or the listing of its directory when given. The index
+    is filled in the background by a MetadataScanner, and kept up to date with the changes of the current
+    directory seen by the controller.
+    The tags / persons of the user comments are kept in an inverted index (name -> media ids): a search over
+    the whole library is a few index lookups, without opening any file.
+    """
+
+    def __init__(self, file: Path):
+        self.file = file
+        self._lock = threading.Lock()
+        # Can be shared with worker threads, wait for the other writers
+        self._con = sqlite3.connect(str(file), check_same_thread=False, timeout=30)
+        # The files are the reference: losing the last entries on a crash is fine
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        if self._con.execute("PRAGMA user_version").fetchone()[0] != _schema_version:
+            self._con.executescript("DROP TABLE IF EXISTS media; DROP TABLE IF EXISTS entities;")
+            self._con.execute(f"PRAGMA user_version = {_schema_version}")
+        self._con.executescript(_schema)
+        self._con.commit()
+
+    def close(self):
+        self._con.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._con.execute("SELECT COUNT(*) FROM media").fetchone()[0]
+
+    @staticmethod
+    def _stat(path: Path):
+        stat = path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def _query_dir(self, dirpath: Path) -> dict[Path, MediaMetadata]:
+        with self._lock:
+            rows = self._con.execute(f"SELECT {_columns} FROM media WHERE dirpath = ?", (str(dirpath),)).fetchall()
+        return {Path(row[0]): row for row in rows}
+
+    def get(self, path: Path) -> MediaMetadata:
+        """
+        :return: metadata of path, None if not indexed / stale
+        """
+        return self.get_many([path]).get(path, None)
+
+    def get_many(self, files: Iterable[Path], snapshot: dict[Path, tuple[int, int]] = None) \
+            -> dict[Path, MediaMetadata]:
+        """
+        Metadata of the files indexed and up to date: a single query per directory
+        :param snapshot: {file: (mtime_ns, size)} listing of the files, they are stat if None
+        :return: {file: metadata}
+        """
+        by_dir = {}
+        for file in files:
+            by_dir.setdefault(file.parent, []).append(file)
+        out = {}
+        for dirpath, dir_files in by_dir.items():
+            rows = self._query_dir(dirpath) if len(dir_files) > 1 else self._query_file(dir_files[0])
+            for file in dir_files:
+                row = rows.get(file, None)
+                if row is None:
+                    continue
+                try:
+                    stat = snapshot[file] if snapshot is not None and file in snapshot else self._stat(file)
+                except OSError:
+                    continue
+                if (row[1], row[2]) == stat:
+                    out[file] = MediaMetadata.from_row(row)
+        return out
+
+    def _query_file(self, path: Path):
+        with self._lock:
+            row = self._con.execute(f"SELECT {_columns} FROM media WHERE path = ?", (str(path),)).fetchone()
+        return {path: row} if row is not None else {}
+
+    def stale(self, snapshot: dict[Path, tuple[int, int]]) -> list[Path]:
+        """
+        :param snapshot: {file: (mtime_ns, size)} listing of files of a directory
+        :return: files of the snapshot not indexed or changed since
+        """
+        rows = {}
+        for dirpath in {file.parent for file in snapshot}:
+            rows.update(self._query_dir(dirpath))
+        return [file for file, stat in snapshot.items() if file not in rows or (rows[file][1], rows[file][2]) != stat]
+
+    def load(self, path: Path) -> MediaMetadata:
+        """
+        :return: metadata of path, read from the file and indexed if not up to date
+        :raise OSError: file cannot be read
+        """
+        metadata = self.get(path)
+        if metadata is None:
+            metadata = read_metadata(path)
+            self.put_many([metadata])
+        return metadata
+
+    def load_many(self, files: Iterable[Path]) -> dict[Path, MediaMetadata]:
+        """
+        :return: {file: metadata} of files, the ones not up to date are read and indexed
+        """
+        files = list(files)
+        out = self.get_many(files)
+        read = load_metadata([file for file in files if file not in out])
+        self.put_many(read.values())
+        out.update(read)
+        return out
+
+    def update(self, path: Path) -> MediaMetadata:
+        """
+        Read path again and index it, e.g. after its user comment has been saved
+        :raise OSError: file cannot be read
+        """
+        metadata = read_metadata(path)
+        self.put_many([metadata])
+        return metadata
+
+    def put_many(self, metadata_list: Iterable[MediaMetadata]):
+        with self._lock:
+            for metadata in metadata_list:
+                row = metadata.to_row()
+                old = self._con.execute("SELECT id FROM media WHERE path = ?", (row[0],)).fetchone()
+                if old is None:
+                    media_id = self._con.execute(f"INSERT INTO media ({_columns_write}) "
+                                                 f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row).lastrowid
+                else:
+                    # Same id: the entries of the inverted index are replaced
+                    media_id = old[0]
+                    self._con.execute(f"UPDATE media SET ({_columns_write}) = (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                                      f"WHERE id = ?", (*row, media_id))
+                    self._con.execute("DELETE FROM entities WHERE media_id = ?", (media_id,))
+                entities = {(TagEntity.type(), name.lower()) for name in metadata.tags}
+                entities.update((PersonEntity.type(), name.lower()) for name in metadata.persons)
+                self._con.executemany("INSERT INTO entities VALUES (?, ?, ?)",
+                                      [(type_, name, media_id) for type_, name in entities])
+            self._con.commit()
+
+    def _delete(self, path: Path):
+        self._con.execute("DELETE FROM entities WHERE media_id IN (SELECT id FROM media WHERE path = ?)", (str(path),))
+        self._con.execute("DELETE FROM media WHERE path = ?", (str(path),))
+
+    def remove(self, files: Iterable[Path]):
+        with self._lock:
+            for file in files:
+                self._delete(file)
+            self._con.commit()
+
+    def rename(self, renames: Iterable[tuple[Path, Path]]):
+        """
+        Move the entries of the renamed files (old path, new path): a rename keeps the mtime / size
+        """
+        with self._lock:
+            for old, new in renames:
+                self._delete(new)
+                self._con.execute("UPDATE media SET path = ?, dirpath = ? WHERE path = ?",
+                                  (str(new), str(new.parent), str(old)))
+            self._con.commit()
+
+    def clear(self):
+        with self._lock:
+            self._con.execute("DELETE FROM entities")
+            self._con.execute("DELETE FROM media")
+            self._con.commit()
+
+    def search(self, tags: Iterable[str] = (), persons: Iterable[str] = (), names: Iterable[str] = (),
+               limit: int = None) -> list[Path]:
+        """
+        Files having all the tags, all the persons and, for each of the names, a tag or a person of that name
+        (case insensitive)
+        :param limit: max number of files returned, all of them if None
+        :return: sorted files
+        """
+        clauses, params = [], []
+        for type_, values in ((TagEntity.type(), tags), (PersonEntity.type(), persons)):
+            for name in values:
+                clauses.append("SELECT media_id FROM entities WHERE type = ? AND name = ?")
+                params += [type_, name.lower()]
+        for name in names:
+            clauses.append("SELECT media_id FROM entities WHERE name = ?")
+            params.append(name.lower())
+        if len(clauses) == 0:
+            return []
+        query = f"SELECT path FROM media WHERE id IN ({' INTERSECT '.join(clauses)}) ORDER BY path"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [Path(row[0]) for row in self._con.execute(query, params).fetchall()]
+
+    def names(self, type_: str = None) -> dict[str, int]:
+        """
+        :param type_: TagEntity.type(), PersonEntity.type() or None for both
+        :return: {lower case name: number of files}
+        """
+        query = "SELECT name, COUNT(DISTINCT media_id) FROM entities"
+        params = ()
+        if type_ is not None:
+            query += " WHERE type = ?"
+            params = (type_,)
+        with self._lock:
+            return dict(self._con.execute(query + " GROUP BY name ORDER BY name", params).fetchall())
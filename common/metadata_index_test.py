@@ -0,0 +1,123 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import common.metadata_index
+import resources.test_pics as test_pics
+from common.comment import ImageUserComment, PersonEntity, TagEntity
+from common.metadata_index import MetadataIndex, read_metadata, load_metadata, parse_search_query
+
+default_pics_folder = Path(test_pics.__file__).parent
+
+
+class ReadMetadataTest(unittest.TestCase):
+
+    def test_read(self):
+        metadata = read_metadata(default_pics_folder / '20210908_122743.jpg')
+        self.assertEqual(metadata.datetime_original, datetime.datetime(2021, 9, 8, 12, 27, 43))
+        self.assertAlmostEqual(metadata.lng, 103.8447, places=4)
+        self.assertAlmostEqual(metadata.lat, 1.2814, places=4)
+        self.assertEqual((metadata.width, metadata.height), (4000, 3000))
+        self.assertEqual(metadata.tags, ['tag1'])
+
+        metadata = read_metadata(default_pics_folder / 'lenna.jpg')
+        self.assertIsNone(metadata.datetime_original)
+        self.assertIsNone(metadata.lng)
+        self.assertEqual(metadata.persons, ['lenna'])
+
+    def test_not_existing(self):
+        with self.assertRaises(OSError):
+            read_metadata(default_pics_folder / 'not_existing.jpg')
+        self.assertEqual(load_metadata([default_pics_folder / 'not_existing.jpg']), {})
+
+
+class MetadataIndexTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.files = []
+        for name in ['20210908_122743.jpg', 'lenna.jpg']:
+            shutil.copy(default_pics_folder / name, self.out_dir / name)
+            self.files.append(self.out_dir / name)
+        self.index = MetadataIndex(self.out_dir / 'metadata.sqlite')
+
+    def tearDown(self) -> None:
+        self.index.close()
+        shutil.rmtree(self.out_dir)
+
+    def test_load_indexed(self):
+        with mock.patch.object(common.metadata_index, 'read_metadata', wraps=read_metadata) as read:
+            metadata = load_metadata(self.files, self.index)
+            self.assertEqual(read.call_count, 2)
+            # Served by the index
+            indexed = self.index.load_many(self.files)
+            self.assertEqual(read.call_count, 2)
+        self.assertEqual(len(self.index), 2)
+        for file in self.files:
+            self.assertEqual(indexed[file].to_row(), metadata[file].to_row())
+
+    def test_stale(self):
+        self.index.load_many(self.files)
+        snapshot = {file: (file.stat().st_mtime_ns, file.stat().st_size) for file in self.files}
+        self.assertEqual(self.index.stale(snapshot), [])
+        stat = self.files[0].stat()
+        os.utime(self.files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(self.index.get(self.files[0]))
+        self.assertEqual(list(self.index.get_many(self.files).keys()), self.files[1:])
+        snapshot[self.files[0]] = (stat.st_mtime_ns + 10 ** 9, stat.st_size)
+        snapshot[self.out_dir / 'new.jpg'] = (0, 0)
+        self.assertEqual(self.index.stale(snapshot), [self.files[0], self.out_dir / 'new.jpg'])
+
+    def test_rename_remove(self):
+        self.index.load_many(self.files)
+        new_file = self.out_dir / 'renamed.jpg'
+        self.files[0].rename(new_file)
+        self.index.rename([(self.files[0], new_file)])
+        self.assertIsNone(self.index.get(self.files[0]))
+        self.assertEqual(self.index.get(new_file).tags, ['tag1'])
+
+        self.index.remove([new_file])
+        self.assertIsNone(self.index.get(new_file))
+        self.assertEqual(len(self.index), 1)
+
+    def test_search(self):
+        self.index.load_many(self.files)
+        # Both files have tag1, only lenna has the person lenna
+        self.assertEqual(self.index.search(tags=['TAG1']), self.files)
+        self.assertEqual(self.index.search(tags=['tag1'], persons=['lenna']), self.files[1:])
+        self.assertEqual(self.index.search(names=['lenna']), self.files[1:])
+        self.assertEqual(self.index.search(tags=['lenna']), [])
+        self.assertEqual(self.index.search(tags=['tag1'], limit=1), self.files[:1])
+        self.assertEqual(self.index.search(), [])
+        self.assertEqual(self.index.names(), {'lenna': 1, 'tag1': 2})
+        self.assertEqual(self.index.names(PersonEntity.type()), {'lenna': 1})
+
+    def test_search_after_save_comment(self):
+        self.index.load_many(self.files)
+        comment = ImageUserComment.load_from_file(self.files[0])
+        comment.add_entity(TagEntity('Beach'))
+        comment.add_entity(PersonEntity('John Doe', (0, 1, 1, 0)))
+        comment.save_comment(self.files[0], index=self.index)
+        self.assertEqual(self.index.search(tags=['beach'], persons=['john doe']), self.files[:1])
+
+        # Entries of the inverted index follow the renames / removals
+        new_file = self.out_dir / 'renamed.jpg'
+        self.files[0].rename(new_file)
+        self.index.rename([(self.files[0], new_file)])
+        self.assertEqual(self.index.search(tags=['beach']), [new_file])
+        self.index.remove([new_file])
+        self.assertEqual(self.index.search(tags=['beach']), [])
+        self.assertEqual(self.index.names(TagEntity.type()), {'tag1': 1})
+
+    def test_parse_search_query(self):
+        self.assertEqual(parse_search_query('tag:beach person:"John Doe" holidays'),
+                         (['beach'], ['John Doe'], ['holidays']))
+        self.assertEqual(parse_search_query('Person:"John'), ([], ['"John'], []))
+
+
+if __name__ == '__main__':
+    unittest.main()
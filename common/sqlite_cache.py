@@ -0,0 +1,140 @@
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class SQLiteLRUCache(object):
+    """
+    Base of the on-disk caches of data computed from files, stored in a single sqlite pack file.
+
+    Subclasses define the schema of the table, whose columns are: the key columns (path of the file first),
+    mtime_ns and size of the file, the cached values, nbytes (size of the values) and last_used.
+    Entries are only valid for the mtime / size of the file when they were computed.
+    The cache is bounded in size, the least recently used entries are evicted first. The size is counted again
+    at every insertion, as the file can be filled by several processes.
+    The last use of the entries read is kept in memory and written by batches (at the next insertion, every
+    touch_batch_size reads and on close), so that a read does not take the write lock of the file.
+    """
+    table: str = None
+    key_columns: tuple = ()
+    schema: str = None
+    # Max number of entries read whose last use is not written yet
+    touch_batch_size = 256
+    # Write-ahead log: the readers do not wait for the writers. Losing the last entries on a crash is fine for a
+    # cache, no fsync at every commit
+    wal = False
+
+    def __init__(self, file: Path, max_bytes):
+        self.file = file
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Can be shared with worker threads / processes, wait for the other writers
+        self._con = sqlite3.connect(str(file), check_same_thread=False, timeout=30)
+        if self.wal:
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.executescript(self.schema)
+        self._con.commit()
+        self._where = " AND ".join(f"{column} = ?" for column in self.key_columns)
+        # {key: last use} of the entries read since the last write
+        self._touched = {}
+        self._nbytes = self._sum_nbytes()
+
+    def close(self):
+        with self._lock:
+            if self._touched:
+                self._write_touched()
+                self._con.commit()
+        self._con.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._con.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    @property
+    def nbytes(self):
+        """
+        Size of the entries, as of the last write
+        """
+        return self._nbytes
+
+    @staticmethod
+    def _stat(path: Path):
+        stat = path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def clear(self):
+        with self._lock:
+            self._con.execute(f"DELETE FROM {self.table}")
+            self._con.commit()
+            self._touched.clear()
+            self._nbytes = 0
+
+    def _lookup(self, key: tuple, stat, columns: str):
+        """
+        :return: values of columns of the entry key, None if not cached / stale
+        """
+        with self._lock:
+            row = self._con.execute(f"SELECT mtime_ns, size, {columns} FROM {self.table} WHERE {self._where}",
+                                    key).fetchone()
+            if row is None:
+                return None
+            if (row[0], row[1]) != stat:
+                # File changed since
+                self._touched.pop(key, None)
+                self._delete(key)
+                self._con.commit()
+                return None
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_batch_size:
+                self._write_touched()
+                self._con.commit()
+        return row[2:]
+
+    def _insert(self, key: tuple, stat, values: tuple, nbytes: int):
+        """
+        Store the entry key, evicting the least recently used ones if the cache is full
+        """
+        with self._lock:
+            # Write lock taken first: the entries of the other processes are all counted before evicting
+            self._con.execute("BEGIN IMMEDIATE")
+            self._touched.pop(key, None)
+            self._delete(key)
+            placeholders = ", ".join("?" * (len(key) + len(values) + 4))
+            self._con.execute(f"INSERT INTO {self.table} VALUES ({placeholders})",
+                              (*key, *stat, *values, nbytes, time.time()))
+            # Eviction order up to date
+            self._write_touched()
+            self._nbytes = self._sum_nbytes()
+            if self._nbytes > self.max_bytes:
+                self._evict()
+            self._con.commit()
+
+    def _sum_nbytes(self):
+        return self._con.execute(f"SELECT COALESCE(SUM(nbytes), 0) FROM {self.table}").fetchone()[0]
+
+    def _write_touched(self):
+        self._con.executemany(f"UPDATE {self.table} SET last_used = ? WHERE {self._where}",
+                              [(t, *key) for key, t in self._touched.items()])
+        self._touched.clear()
+
+    def _delete(self, key):
+        row = self._con.execute(f"SELECT nbytes FROM {self.table} WHERE {self._where}", key).fetchone()
+        if row is not None:
+            self._con.execute(f"DELETE FROM {self.table} WHERE {self._where}", key)
+            self._nbytes -= row[0]
+
+    def _evict(self):
+        # Drop the least recently used entries down to 90% of the limit
+        target = 0.9 * self.max_bytes
+        rows = self._con.execute(f"SELECT rowid, nbytes FROM {self.table} ORDER BY last_used").fetchall()
+        rowids = []
+        for rowid, nbytes in rows:
+            if self._nbytes <= target:
+                break
+            rowids.append((rowid,))
+            self._nbytes -= nbytes
+        self._con.executemany(f"DELETE FROM {self.table} WHERE rowid = ?", rowids)
+        logging.info(f"{type(self).__name__}: evicted {len(rowids)} entries")
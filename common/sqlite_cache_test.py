@@ -0,0 +1,111 @@
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from common.sqlite_cache import SQLiteLRUCache
+
+
+class _Cache(SQLiteLRUCache):
+    table = 'entries'
+    key_columns = ('path', 'name')
+    schema = """
+    CREATE TABLE IF NOT EXISTS entries (
+        path TEXT NOT NULL,
+        name TEXT NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        nbytes INTEGER NOT NULL,
+        last_used REAL NOT NULL,
+        PRIMARY KEY (path, name)
+    );
+    CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_used, nbytes);
+    """
+
+    def get(self, path: Path, name):
+        row = self._lookup((str(path), name), self._stat(path), "data")
+        return None if row is None else row[0]
+
+    def put(self, path: Path, name, data: bytes):
+        self._insert((str(path), name), self._stat(path), (data,), len(data))
+
+
+class SQLiteLRUCacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.file = self.out_dir / 'a.jpg'
+        self.file.write_bytes(bytes(10))
+        self.cache = _Cache(self.out_dir / 'cache.sqlite', max_bytes=300)
+
+    def tearDown(self) -> None:
+        self.cache.close()
+        shutil.rmtree(self.out_dir)
+
+    def _last_used(self, age=False):
+        # Read by another connection: only what is written
+        con = sqlite3.connect(str(self.cache.file))
+        try:
+            if age:
+                con.execute("UPDATE entries SET last_used = 0")
+                con.commit()
+            return dict(con.execute("SELECT name, last_used FROM entries").fetchall())
+        finally:
+            con.close()
+
+    def test_touch_written_lazily(self):
+        self.cache.put(self.file, 'a', bytes(100))
+        written = self._last_used(age=True)
+        self.assertEqual(self.cache.get(self.file, 'a'), bytes(100))
+        # A hit does not write
+        self.assertEqual(self._last_used(), written)
+        self.assertEqual(len(self.cache._touched), 1)
+        # Written with the next insertion
+        self.cache.put(self.file, 'b', bytes(100))
+        self.assertGreater(self._last_used()['a'], written['a'])
+        self.assertEqual(self.cache._touched, {})
+
+    def test_touch_batch(self):
+        self.cache.touch_batch_size = 3
+        for name in 'abc':
+            self.cache.put(self.file, name, bytes(10))
+        written = self._last_used(age=True)
+        # Entries read, whatever the number of hits
+        for name in 'aab':
+            self.cache.get(self.file, name)
+        self.assertEqual(self._last_used(), written)
+        self.cache.get(self.file, 'c')
+        self.assertTrue(all(t > 0 for t in self._last_used().values()))
+
+    def test_touch_written_on_close(self):
+        self.cache.put(self.file, 'a', bytes(10))
+        written = self._last_used(age=True)
+        self.cache.get(self.file, 'a')
+        self.cache.close()
+        self.assertGreater(self._last_used()['a'], written['a'])
+        self.cache = _Cache(self.out_dir / 'cache.sqlite', max_bytes=300)
+
+    def test_eviction_order(self):
+        for name in 'abc':
+            self.cache.put(self.file, name, bytes(100))
+        # Hit not written yet, still counted by the eviction
+        self.cache.get(self.file, 'a')
+        self.cache.put(self.file, 'd', bytes(100))
+        # Down to 90% of the limit
+        self.assertEqual(self.cache.nbytes, 200)
+        self.assertIsNotNone(self.cache.get(self.file, 'a'))
+        self.assertIsNone(self.cache.get(self.file, 'b'))
+        self.assertIsNone(self.cache.get(self.file, 'c'))
+
+    def test_stale(self):
+        self.cache.put(self.file, 'a', bytes(100))
+        self.cache.get(self.file, 'a')
+        self.file.write_bytes(bytes(20))
+        self.assertIsNone(self.cache.get(self.file, 'a'))
+        self.assertEqual((len(self.cache), self.cache.nbytes, self.cache._touched), (0, 0, {}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,255 @@
+import logging
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import cv2
+import numpy as np
+import piexif
+from PIL import Image
+from moviepy.config import FFMPEG_BINARY
+
+from common.constants import FILE_EXTENSION_PHOTO, FILE_EXTENSION_VIDEO
+from common.cv import load_image_array, apply_orientation
+from common.sqlite_cache import SQLiteLRUCache
+
+
+def fit_size(arr: np.ndarray, size: int) -> np.ndarray:
+    """
+    Reduce an image so that its longest side is at most size
+    """
+    h, w = arr.shape[:2]
+    if max(h, w) <= size:
+        return arr
+    # Integer factor first (fast path of INTER_AREA, the border lost is < k pixels), then the remaining
+    # factor < 2 with a linear interpolation: much faster than INTER_AREA with any factor
+    k = max(h, w) // size
+    if k >= 2:
+        arr = cv2.resize(arr[:h // k * k, :w // k * k], (w // k, h // k), interpolation=cv2.INTER_AREA)
+        h, w = arr.shape[:2]
+        if max(h, w) <= size:
+            return arr
+    scale = size / max(h, w)
+    return cv2.resize(arr, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_LINEAR)
+
+
+def load_thumbnail(path: Path, size: int) -> np.ndarray:
+    """
+    Thumbnail of a photo or a video (poster frame) as a RGB uint8 array whose longest side is at most size
+    :return: array, None if the file cannot be read
+    """
+    if path.suffix in FILE_EXTENSION_PHOTO:
+        arr, _ = load_image_array(path, max_size=size)
+    elif path.suffix in FILE_EXTENSION_VIDEO:
+        arr = load_poster_frame(path, size)
+    else:
+        arr = None
+    if arr is None:
+        return None
+    return np.ascontiguousarray(fit_size(arr, size))
+
+
+# Time of the poster frame of the videos (s), after the fade in / black frames of the beginning
+poster_timestamp = 1.
+
+
+def _ffmpeg_frame(path: Path, size: int, timestamp: float, timeout):
+    # Input seeking (nearest keyframe, no decoding of the frames before), the frame is scaled and rotated by
+    # ffmpeg and piped as a bmp
+    cmd = [FFMPEG_BINARY, '-v', 'error', '-nostdin', '-ss', f"{timestamp:.3f}", '-i', str(path),
+           '-frames:v', '1', '-an', '-sn',
+           '-vf', f"scale='min(iw,{size})':'min(ih,{size})':force_original_aspect_ratio=decrease",
+           '-c:v', 'bmp', '-f', 'image2pipe', '-']
+    # No console window on Windows
+    creationflags = 0x08000000 if os.name == 'nt' else 0
+    try:
+        # The process is killed on timeout
+        proc = subprocess.run(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              timeout=timeout, creationflags=creationflags)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logging.warning(f"Cannot read a frame of {path}: {e}")
+        return None
+    if proc.returncode != 0 or len(proc.stdout) == 0:
+        if proc.stderr:
+            logging.debug(f"Cannot read a frame of {path} at {timestamp} s: {proc.stderr.decode(errors='ignore')}")
+        return None
+    bgr = cv2.imdecode(np.frombuffer(proc.stdout, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return None if bgr is None else cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+
+def load_poster_frame(path: Path, size: int, timestamp=poster_timestamp, timeout=30.) -> np.ndarray:
+    """
+    Poster frame of a video, decoded and scaled by a single short-lived ffmpeg process (no probing of the file)
+    :param timestamp: time of the frame (s). The first frame is used for the videos shorter than that
+    :return: RGB uint8 array whose longest side is at most size, None if the file cannot be read
+    """
+    arr = _ffmpeg_frame(path, size, timestamp, timeout)
+    if arr is None and timestamp > 0:
+        arr = _ffmpeg_frame(path, size, 0., timeout)
+    return arr
+
+
+def load_poster_frames(paths: list[Path], size: int, timestamp=poster_timestamp, timeout=30., max_workers=None):
+    """
+    Poster frames of many videos, extracted by concurrent ffmpeg processes
+    :return: generator of (path, array or None), in the order of completion
+    """
+    max_workers = max_workers if max_workers else max(1, min(4, os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(load_poster_frame, path, size, timestamp, timeout): path for path in paths}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def load_exif_thumbnail(path: Path) -> np.ndarray:
+    """
+    Thumbnail embedded in the exif of a picture (usually 160x120) as a RGB uint8 array, rotated according to
+    the orientation tag. Only the header of the file is read, the main image is not decoded.
+    :return: array, None if there is no embedded thumbnail
+    """
+    if path.suffix not in FILE_EXTENSION_PHOTO:
+        return None
+    try:
+        with Image.open(str(path)) as img:
+            exif = img.info.get('exif', None)
+        if not exif:
+            return None
+        exif_dict = piexif.load(exif)
+        data = exif_dict.get('thumbnail', None)
+        if not data:
+            return None
+        bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except Exception:
+        return None
+    if bgr is None:
+        return None
+    orientation = exif_dict.get("0th", {}).get(piexif.ImageIFD.Orientation, 1)
+    return np.ascontiguousarray(apply_orientation(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB), orientation))
+
+
+def get_thumbnail(path: Path, size: int, cache: 'ThumbnailCache' = None) -> np.ndarray:
+    """
+    load_thumbnail going through the on-disk cache if any
+    """
+    return cache.load(path, size) if cache is not None else load_thumbnail(path, size)
+
+
+_schema = """
+CREATE TABLE IF NOT EXISTS thumbnails (
+    path TEXT NOT NULL,
+    tier INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (path, tier)
+);
+DROP INDEX IF EXISTS thumbnails_last_used;
+-- Covers the size of the cache and the eviction order, without reading the blobs
+CREATE INDEX IF NOT EXISTS thumbnails_lru ON thumbnails(last_used, nbytes);
+"""
+
+
+class ThumbnailCache(SQLiteLRUCache):
+    """
+    On-disk cache of the thumbnails of the media files, shared by the views, stored as JPEGs in a single
+    sqlite pack file.
+
+    Thumbnails are stored in a few size tiers: a request is served by the smallest tier >= the requested size,
+    and a missing tier is derived from a larger cached one before decoding the media file again. A tier is
+    always filled at its own size (or the size of the media if smaller), whatever the size requested.
+    Entries are keyed by path and only valid for the mtime / size of the file when they were computed
+    (rotating a picture rewrites its orientation tag, hence the file).
+    The cache is bounded in size, the least recently used entries are evicted first (see SQLiteLRUCache).
+    """
+    table = 'thumbnails'
+    key_columns = ('path', 'tier')
+    schema = _schema
+    wal = True
+    tiers = (128, 256, 512, 1024)
+
+    def __init__(self, file: Path, max_bytes=512 * 1024 * 1024, quality=90):
+        super(ThumbnailCache, self).__init__(file, max_bytes)
+        self.quality = quality
+
+    def tier(self, size):
+        """
+        :return: tier storing the thumbnails of the requested size, None if larger than all the tiers
+        """
+        for tier in self.tiers:
+            if size <= tier:
+                return tier
+        return None
+
+    def get(self, path: Path, size: int) -> np.ndarray:
+        """
+        :return: RGB array whose longest side is at most size, None if not cached / stale
+        """
+        tier = self.tier(size)
+        if tier is None:
+            return None
+        try:
+            stat = self._stat(path)
+        except OSError:
+            return None
+        arr = self._get(path, tier, stat)
+        return None if arr is None else fit_size(arr, size)
+
+    def put(self, path: Path, arr: np.ndarray):
+        """
+        Store arr (RGB array) as the thumbnail of path for every tier it is large enough for
+        """
+        try:
+            stat = self._stat(path)
+        except OSError:
+            return
+        for tier in self.tiers:
+            self._put(path, tier, stat, np.ascontiguousarray(fit_size(arr, tier)))
+            if tier >= max(arr.shape[:2]):
+                break
+
+    def load(self, path: Path, size: int) -> np.ndarray:
+        """
+        Thumbnail of path (see load_thumbnail) from the cache, produced and cached if needed
+        :return: RGB array whose longest side is at most size, None if the file cannot be read
+        """
+        tier = self.tier(size)
+        if tier is None:
+            return load_thumbnail(path, size)
+        try:
+            stat = self._stat(path)
+        except OSError:
+            return None
+
+        arr = self._get(path, tier, stat)
+        if arr is None:
+            # Derived from a larger tier
+            for larger in self.tiers[self.tiers.index(tier) + 1:]:
+                arr = self._get(path, larger, stat)
+                if arr is not None:
+                    arr = np.ascontiguousarray(fit_size(arr, tier))
+                    self._put(path, tier, stat, arr)
+                    break
+        if arr is None:
+            # Decoded at the tier size: the other sizes served by the tier are not smaller than stored
+            arr = load_thumbnail(path, tier)
+            if arr is None:
+                return None
+            self._put(path, tier, stat, arr)
+        return np.ascontiguousarray(fit_size(arr, size))
+
+    def _get(self, path: Path, tier, stat):
+        row = self._lookup((str(path), tier), stat, "data")
+        if row is None:
+            return None
+        bgr = cv2.imdecode(np.frombuffer(row[0], dtype=np.uint8), cv2.IMREAD_COLOR)
+        return None if bgr is None else cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+    def _put(self, path: Path, tier, stat, arr: np.ndarray):
+        ok, data = cv2.imencode('.jpg', cv2.cvtColor(arr, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            return
+        data = data.tobytes()
+        self._insert((str(path), tier), stat, (data,), len(data))
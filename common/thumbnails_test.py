@@ -0,0 +1,136 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import piexif
+from PIL import Image
+
+import common.thumbnails
+import resources.test_clips as test_clips
+import resources.test_pics as test_pics
+from common.thumbnails import ThumbnailCache, load_thumbnail, load_exif_thumbnail, load_poster_frame, \
+    load_poster_frames
+
+default_pics_folder = Path(test_pics.__file__).parent
+default_clips_folder = Path(test_clips.__file__).parent
+
+
+def add_exif_thumbnail(file: Path, orientation=1):
+    with Image.open(file) as img:
+        img.thumbnail((160, 160))
+        o = io.BytesIO()
+        img.save(o, 'jpeg')
+    exif_dict = {"0th": {piexif.ImageIFD.Orientation: orientation}, "1st": {}, "thumbnail": o.getvalue()}
+    piexif.insert(piexif.dump(exif_dict), str(file))
+
+
+class ExifThumbnailTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.file = self.out_dir / 'test.jpg'
+        shutil.copy(default_pics_folder / '20210908_122743.jpg', self.file)
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.out_dir)
+
+    def test_no_thumbnail(self):
+        self.assertIsNone(load_exif_thumbnail(self.file))
+
+    def test_orientation(self):
+        add_exif_thumbnail(self.file)
+        self.assertEqual(load_exif_thumbnail(self.file).shape, (120, 160, 3))
+        # Rotated 90 degrees
+        add_exif_thumbnail(self.file, orientation=6)
+        self.assertEqual(load_exif_thumbnail(self.file).shape, (160, 120, 3))
+
+
+class PosterFrameTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.clips = sorted(default_clips_folder.glob('*.mp4'))
+
+    def test_poster_frame(self):
+        arr = load_poster_frame(self.clips[0], 200)
+        self.assertEqual(arr.dtype, np.uint8)
+        self.assertEqual(max(arr.shape[:2]), 200)
+        # Video shorter than the timestamp: first frame
+        self.assertEqual(load_poster_frame(self.clips[0], 200, timestamp=3600.).shape, arr.shape)
+        self.assertEqual(load_thumbnail(self.clips[0], 200).shape, arr.shape)
+
+    def test_not_a_video(self):
+        self.assertIsNone(load_poster_frame(default_pics_folder / '__init__.py', 200))
+        self.assertIsNone(load_poster_frame(default_clips_folder / 'not_existing.mp4', 200))
+
+    def test_batch(self):
+        files = self.clips + [default_clips_folder / 'not_existing.mp4']
+        results = dict(load_poster_frames(files, 100, max_workers=2))
+        self.assertEqual(set(results.keys()), set(files))
+        self.assertIsNone(results[files[-1]])
+        for file in self.clips:
+            self.assertEqual(max(results[file].shape[:2]), 100)
+
+
+class ThumbnailCacheTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.file = self.out_dir / 'lenna.jpg'
+        shutil.copy(default_pics_folder / 'lenna.jpg', self.file)
+        self.cache = ThumbnailCache(self.out_dir / 'thumbnails.sqlite')
+
+    def tearDown(self) -> None:
+        self.cache.close()
+        shutil.rmtree(self.out_dir)
+
+    def test_load_cached(self):
+        with mock.patch.object(common.thumbnails, 'load_thumbnail', wraps=load_thumbnail) as load:
+            arr = self.cache.load(self.file, 200)
+            self.assertEqual(max(arr.shape[:2]), 200)
+            # Served by the 256 tier, then smaller tiers derived from it
+            self.assertEqual(self.cache.load(self.file, 250).shape, self.cache.get(self.file, 250).shape)
+            self.assertIsNotNone(self.cache.load(self.file, 100))
+            self.assertEqual(load.call_count, 1)
+        self.assertEqual(len(self.cache), 2)
+        # Same content, up to the jpeg compression
+        self.assertLess(np.abs(self.cache.get(self.file, 200).astype(int) - arr).mean(), 5.)
+
+    def test_load_tier_size(self):
+        # First request smaller than the tier: the tier is still filled at its size
+        self.assertEqual(max(self.cache.load(self.file, 150).shape[:2]), 150)
+        self.assertEqual(max(self.cache.get(self.file, 256).shape[:2]), 256)
+        with mock.patch.object(common.thumbnails, 'load_thumbnail', wraps=load_thumbnail) as load:
+            self.assertEqual(max(self.cache.load(self.file, 250).shape[:2]), 250)
+            self.assertEqual(load.call_count, 0)
+
+    def test_stale(self):
+        self.cache.load(self.file, 200)
+        stat = self.file.stat()
+        os.utime(self.file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(self.cache.get(self.file, 200))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_no_tier(self):
+        self.assertIsNone(self.cache.tier(4000))
+        self.assertIsNotNone(self.cache.load(self.file, 4000))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_eviction(self):
+        self.cache.load(self.file, 1000)
+        nbytes = self.cache.nbytes
+        self.assertGreater(nbytes, 0)
+        self.cache.max_bytes = nbytes
+        # 2 entries (256 and 1024) do not fit anymore: the least recently used is dropped
+        self.cache.load(self.file, 200)
+        self.assertEqual(len(self.cache), 1)
+        self.assertIsNotNone(self.cache.get(self.file, 200))
+        self.assertLessEqual(self.cache.nbytes, self.cache.max_bytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
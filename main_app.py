@@ -11,6 +11,8 @@ import resources.test_db_tags as test_db_tags
 from mvc.controllers.main import MainController
 from mvc.models.main import MainModel
 from common.db import TagDB
+from common.metadata_index import MetadataIndex
+from common.thumbnails import ThumbnailCache
 from mvc.views.mainview.view import MediaManagementView
 
 default_db_tags_folder = Path(test_db_tags.__file__).parent
@@ -42,7 +44,12 @@ def main():
     # MVC
     db_tags_path = Path(args.db_tags) if args.db_tags else Path(config['DB_TAGS_FOLDER'])
     db_tags = TagDB(dirpath=db_tags_path)
-    model = MainModel(db_tags=db_tags)
+    thumbnails = None
+    if config.get('THUMBNAILS_CACHE', None):
+        thumbnails = ThumbnailCache(Path(config['THUMBNAILS_CACHE']),
+                                    max_bytes=config.get('THUMBNAILS_CACHE_MAX_MB', 512) * 1024 * 1024)
+    metadata = MetadataIndex(Path(config['METADATA_INDEX'])) if config.get('METADATA_INDEX', None) else None
+    model = MainModel(db_tags=db_tags, thumbnails=thumbnails, metadata=metadata)
     main_controller = MainController(model)
 
     # App setup
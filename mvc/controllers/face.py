@@ -1,5 +1,6 @@
 import common.face as api
 from common.face import detection_backend, face_recognition_model
+from mvc.controllers.face_jobs import FaceDetectionJob
 from mvc.models.face import FaceDetectionModel
 
 
@@ -17,12 +18,22 @@ class FaceDetectionController:
         assert model in face_recognition_model, "recognition model not recognized"
         self._model.recognition_model = model
 
+    def set_detection_max_size(self, max_size: int):
+        self._model.detection_max_size = max_size
+
     def set_detection_results(self, results: list):
         self._model.detection_results = results
 
     def set_selected_result(self, idx):
         self._model.set_selection(idx)
 
+    def preload_models(self):
+        """
+        Build the selected detection / recognition models in the background
+        """
+        return api.ModelRegistry().preload(detection_models=[self._model.detection_model],
+                                           recognition_models=[self._model.recognition_model])
+
     def detect_faces(self, files):
         detections = []
 
@@ -30,8 +41,40 @@ class FaceDetectionController:
             temp = api.face_recognition(path=file,
                                         detection_model=self._model.detection_model,
                                         recognition_model=self._model.recognition_model,
-                                        db=self._model.db)
+                                        db=self._model.db,
+                                        max_size=self._model.detection_max_size)
             detections += temp
 
         # Update model
         self.set_detection_results(detections)
+
+    def create_detection_job(self, files, use_processes=True, parent=None) -> FaceDetectionJob:
+        """
+        Job detecting the faces of files in the background with the selected models. Start it with job.start()
+        """
+        return FaceDetectionJob(files=files, db=self._model.db,
+                                detection_model=self._model.detection_model,
+                                recognition_model=self._model.recognition_model,
+                                max_size=self._model.detection_max_size,
+                                max_workers=self._model.workers if use_processes else 1,
+                                use_processes=use_processes, parent=parent)
+
+    def detect_faces_async(self, files, parent=None) -> FaceDetectionJob:
+        """
+        Same as detect_faces without blocking the GUI: the results are set on the model when the job is over.
+        The job runs in a thread of this process to reuse the models already loaded.
+        """
+        job = self.create_detection_job(files, use_processes=False, parent=parent)
+        detections = []
+
+        def _on_results_ready(file, results):
+            detections.extend(results)
+
+        def _on_finished(cancelled):
+            if not cancelled:
+                self.set_detection_results(detections)
+
+        job.results_ready.connect(_on_results_ready)
+        job.finished.connect(_on_finished)
+        job.start()
+        return job
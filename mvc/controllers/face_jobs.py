@@ -0,0 +1,162 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+from pathlib import Path
+
+from PyQt5.QtCore import QObject, pyqtSignal, QTimer
+
+import common.face as api
+from common.face_cache import FaceDetectionCache
+
+# Detection cache of the worker
+_worker_cache: FaceDetectionCache = None
+
+
+def _init_worker(cache_file):
+    # Models are built by the registry once per worker, on the first file not found in the cache
+    global _worker_cache
+    if cache_file is not None and (_worker_cache is None or _worker_cache.file != cache_file):
+        _worker_cache = FaceDetectionCache(cache_file)
+
+
+def _detect_file(file: Path, detection_model, recognition_model, max_size):
+    # Names are resolved by the job against the current db, workers only detect and encode
+    return api.face_recognition(path=file, detection_model=detection_model, recognition_model=recognition_model,
+                                db=None, max_size=max_size, cache=_worker_cache)
+
+
+class FaceDetectionJob(QObject):
+    """
+    Run face detection + recognition over a list of files in a pool of workers.
+
+    Results are streamed back file by file through results_ready, in the GUI thread. Names are matched
+    against the db when the results arrive, so that entries added to the db during the job are used.
+    The job can be cancelled, and resumed later on the files that were not processed.
+    """
+    # Detection results of one file
+    results_ready = pyqtSignal(Path, list)
+    # Number of processed files, total number of files, estimated remaining time in seconds (-1 if unknown)
+    progress = pyqtSignal(int, int, float)
+    # Emitted when all the files have been processed (False) or the job has been cancelled (True)
+    finished = pyqtSignal(bool)
+
+    def __init__(self, files: list[Path], db, detection_model, recognition_model, max_size=-1,
+                 max_workers=None, use_processes=True, parent=None):
+        super(FaceDetectionJob, self).__init__(parent)
+        self.files = list(files)
+        self.db = db
+        self.detection_model = detection_model
+        self.recognition_model = recognition_model
+        self.max_size = max_size
+        self.max_workers = max_workers if max_workers else max(1, (os.cpu_count() or 2) // 2)
+        self.use_processes = use_processes
+
+        # Files already processed, kept for resuming
+        self.done: set[Path] = set()
+        # Files that could not be processed
+        self.failed: dict[Path, str] = {}
+
+        self._executor = None
+        self._futures: list[tuple[Path, Future]] = []
+        self._t_start = 0.
+        self._n_done_at_start = 0
+        self._timer = QTimer(self, interval=50)
+        self._timer.timeout.connect(self._on_timeout_collect)
+
+    @property
+    def is_running(self):
+        return self._executor is not None
+
+    @property
+    def remaining_files(self):
+        return [file for file in self.files if file not in self.done]
+
+    def start(self):
+        """
+        Start (or resume) the job on the files not processed yet
+        """
+        if self.is_running:
+            return
+        files = self.remaining_files
+        if len(files) == 0:
+            self.finished.emit(False)
+            return
+
+        if self.use_processes:
+            # TF is not fork-safe: spawn fresh interpreters
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=_init_worker, initargs=(self._cache_file(),))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                initializer=_init_worker, initargs=(self._cache_file(),))
+        self._futures = [(file, self._executor.submit(_detect_file, file, self.detection_model,
+                                                      self.recognition_model, self.max_size))
+                         for file in files]
+        self._t_start = time.time()
+        self._n_done_at_start = len(self.done)
+        self.progress.emit(len(self.done), len(self.files), -1.)
+        self._timer.start()
+
+    def _cache_file(self):
+        cache = getattr(self.db, 'cache', None)
+        return cache.file if cache is not None else None
+
+    def resume(self):
+        self.start()
+
+    def cancel(self):
+        """
+        Stop the job. Files being processed are dropped, the job can be resumed with start / resume
+        """
+        if not self.is_running:
+            return
+        self._stop()
+        logging.info(f"Face detection cancelled after {len(self.done)}/{len(self.files)} files")
+        self.finished.emit(True)
+
+    def _stop(self):
+        self._timer.stop()
+        for _, future in self._futures:
+            future.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._futures = []
+
+    def _on_timeout_collect(self):
+        pending = []
+        for file, future in self._futures:
+            if not future.done():
+                pending.append((file, future))
+                continue
+            try:
+                results = future.result()
+            except Exception as e:
+                logging.warning(f"Face detection failed for {file}: {e}")
+                self.failed[file] = str(e)
+                results = []
+
+            if len(results) > 0:
+                names = self.db.matcher.best_names([result.embedding for result in results],
+                                                   model=self.recognition_model, default=api.unknown_tag)
+                for result, name in zip(results, names):
+                    result.name = name
+            self.done.add(file)
+            self.results_ready.emit(file, results)
+
+        if len(pending) == len(self._futures):
+            return
+        self._futures = pending
+        self.progress.emit(len(self.done), len(self.files), self._eta())
+
+        if len(self._futures) == 0:
+            self._stop()
+            self.finished.emit(False)
+
+    def _eta(self):
+        n = len(self.done) - self._n_done_at_start
+        if n <= 0:
+            return -1.
+        return (time.time() - self._t_start) / n * len(self._futures)
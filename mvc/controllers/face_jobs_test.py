@@ -0,0 +1,100 @@
+import sys
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from PyQt5.QtCore import QEventLoop, QTimer
+from PyQt5.QtWidgets import QApplication
+
+import mvc.controllers.face_jobs as face_jobs
+from common.face import DetectionResult, unknown_tag
+from common.face_matcher import FaceMatcher
+from mvc.controllers.face_jobs import FaceDetectionJob
+
+app = QApplication.instance() or QApplication(sys.argv)
+
+
+class _DB:
+    """Db with a single known face"""
+
+    def __init__(self):
+        self.known = np.ones(4, dtype=np.float32)
+        self.matcher = FaceMatcher(self)
+
+    def get_embedding_matrix(self, model):
+        return ['h'], ['known'], self.known[None]
+
+
+def _fake_detect_file(file, detection_model, recognition_model, max_size):
+    # Files named known* contain the known face
+    embedding = np.ones(4, dtype=np.float32) if file.name.startswith('known') else np.zeros(4, dtype=np.float32)
+    return [DetectionResult(file=file, embedding=embedding, patch=None, location=(0, 1, 1, 0), name=unknown_tag)]
+
+
+def _run(job, timeout=5000):
+    loop = QEventLoop()
+    job.finished.connect(lambda _: loop.quit())
+    QTimer.singleShot(timeout, loop.quit)
+    job.start()
+    loop.exec_()
+
+
+@mock.patch.object(face_jobs, '_init_worker', lambda *args: None)
+class FaceDetectionJobTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.files = [Path(f"known_{i}.jpg") if i % 3 == 0 else Path(f"other_{i}.jpg") for i in range(10)]
+
+    def _job(self):
+        return FaceDetectionJob(files=self.files, db=_DB(), detection_model='retinaface', recognition_model='Dlib',
+                                max_workers=2, use_processes=False)
+
+    @mock.patch.object(face_jobs, '_detect_file', _fake_detect_file)
+    def test_results_streamed_and_matched(self):
+        job = self._job()
+        received, progress, finished = {}, [], []
+        job.results_ready.connect(lambda file, results: received.__setitem__(file, results))
+        job.progress.connect(lambda done, total, eta: progress.append((done, total)))
+        job.finished.connect(finished.append)
+        _run(job)
+
+        self.assertEqual(finished, [False])
+        self.assertEqual(set(received.keys()), set(self.files))
+        for file, results in received.items():
+            expected = 'known' if file.name.startswith('known') else unknown_tag
+            self.assertEqual([result.name for result in results], [expected])
+        self.assertEqual(progress[-1], (len(self.files), len(self.files)))
+
+    def test_cancel_and_resume(self):
+        gate = threading.Event()
+
+        def _blocking_detect_file(*args):
+            gate.wait(5)
+            return _fake_detect_file(*args)
+
+        job = self._job()
+        finished = []
+        job.finished.connect(finished.append)
+        with mock.patch.object(face_jobs, '_detect_file', _blocking_detect_file):
+            job.start()
+            job.cancel()
+            gate.set()
+        self.assertEqual(finished, [True])
+        self.assertFalse(job.is_running)
+        self.assertEqual(len(job.remaining_files), len(self.files))
+
+        # Resume processes the remaining files only
+        job.done.update(self.files[:4])
+        processed = []
+        job.results_ready.connect(lambda file, results: processed.append(file))
+        with mock.patch.object(face_jobs, '_detect_file', _fake_detect_file):
+            _run(job)
+        self.assertEqual(finished, [True, False])
+        self.assertEqual(sorted(processed), sorted(self.files[4:]))
+        self.assertEqual(job.remaining_files, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
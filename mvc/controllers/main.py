@@ -1,15 +1,58 @@
+import os
 from pathlib import Path
 
-from PyQt5.QtCore import QFileSystemWatcher
+from PyQt5.QtCore import QFileSystemWatcher, QTimer
 from send2trash import send2trash
 
 import common.comment
 from common.comment import TagEntity, UserComment
 from common.constants import FILE_EXTENSION_MEDIA, FILE_EXTENSION_PHOTO_JPG
+from common.exif_edits import ExifEdits
+from mvc.controllers.metadata_jobs import ExifMaintenanceJob, MetadataScanner, MetadataWriter
 from mvc.models.main import MainModel
 
 
+def scan_dir(dirpath: Path) -> dict[Path, tuple[int, int]]:
+    """
+    Media files of dirpath, listed with os.scandir
+    :return: {file: (mtime_ns, size)}
+    """
+    snapshot = {}
+    with os.scandir(dirpath) as it:
+        for entry in it:
+            if os.path.splitext(entry.name)[1] not in FILE_EXTENSION_MEDIA:
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            snapshot[dirpath / entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+def find_renames(removed: set[Path], added: set[Path], old_snapshot: dict, new_snapshot: dict) \
+        -> list[tuple[Path, Path]]:
+    """
+    Pair the removed and added files of 2 listings having the same (mtime_ns, size): a rename keeps both
+    :return: sorted list of (old path, new path)
+    """
+    removed_by_stat = {}
+    for file in sorted(removed):
+        removed_by_stat.setdefault(old_snapshot[file], []).append(file)
+    renamed = []
+    for file in sorted(added):
+        olds = removed_by_stat.get(new_snapshot[file], None)
+        if olds:
+            renamed.append((olds.pop(0), file))
+    return sorted(renamed)
+
+
 class MainController:
+    # Delay (ms) to gather the watcher events of a directory before listing it again
+    debounce_ms = 300
+
     def __init__(self, model: MainModel):
         super(self.__class__, self).__init__()
         # init
@@ -17,6 +60,14 @@ class MainController:
         # Watcher to the current file and folder.
         # The watched has to be properly initialized by setting the parent window
         self._watcher: QFileSystemWatcher = None
+        self._dir_timer: QTimer = None
+        # Last listing of the current dir: {file: (mtime_ns, size)}
+        self._snapshot: dict[Path, tuple[int, int]] = {}
+        # Background indexing of the metadata of the current dir, if the model has an index
+        self._scanner: MetadataScanner = None
+        # Exif edits of all the views, written in the background by the writer
+        self._exif_edits = ExifEdits()
+        self._writer: MetadataWriter = None
 
     def set_parent(self, window):
         """
@@ -25,6 +76,72 @@ class MainController:
         self._watcher = QFileSystemWatcher(window)
         self._watcher.fileChanged.connect(self.on_watcher_file_changed)
         self._watcher.directoryChanged.connect(self.on_watcher_dir_changed)
+        # Copying / deleting many files triggers many events: the dir is listed once they are over
+        self._dir_timer = QTimer(window)
+        self._dir_timer.setSingleShot(True)
+        self._dir_timer.setInterval(self.debounce_ms)
+        self._dir_timer.timeout.connect(self.refresh_dirpath)
+        if self._model.metadata is not None and self._scanner is None:
+            self._scanner = MetadataScanner(self._model.metadata)
+            self._scanner.indexed.connect(self._model.set_metadata_updated)
+        if self._writer is None:
+            self._writer = MetadataWriter(self._exif_edits, index=self._model.metadata)
+            self._writer.written.connect(self._model.set_metadata_updated)
+
+    @property
+    def exif_edits(self) -> ExifEdits:
+        """
+        Pending exif edits, written by flush_exif_edits
+        """
+        return self._exif_edits
+
+    @property
+    def metadata_writer(self) -> MetadataWriter:
+        return self._writer
+
+    def flush_exif_edits(self):
+        """
+        Write the pending exif edits, in the background once the parent is set
+        """
+        if self._writer is not None:
+            self._writer.flush()
+            return
+        files = self._exif_edits.files
+        failed = self._exif_edits.flush()
+        written = [file for file in files if file not in failed]
+        if self._model.metadata is not None:
+            for file in written:
+                self._model.metadata.update(file)
+        if len(written) > 0:
+            self._model.set_metadata_updated(written)
+
+    def create_exif_job(self, files: list[Path], edits: list, parent=None) -> ExifMaintenanceJob:
+        """
+        Job applying edits to the exif of files (see common.exif_edits), to be started. Their pending edits are
+        written first. The edits made while the job runs are written by the MetadataWriter, after or before the
+        job writes the file, never at the same time (see write_exif_edits)
+        """
+        if self._writer is not None:
+            self._writer.sync(files)
+        elif any(file in self._exif_edits for file in files):
+            self.flush_exif_edits()
+        job = ExifMaintenanceJob(files, edits, index=self._model.metadata, parent=parent)
+        job.written.connect(self._model.set_metadata_updated)
+        return job
+
+    def shutdown(self):
+        """
+        Write the pending exif edits and stop the background jobs. The edits flushed afterwards are written
+        synchronously
+        """
+        if self._scanner is not None:
+            self._scanner.shutdown()
+            self._scanner = None
+        if self._writer is not None:
+            self._writer.shutdown()
+            self._writer = None
+        else:
+            self.flush_exif_edits()
 
     def update_dirpath(self, event):
         dirpath = None
@@ -37,44 +154,81 @@ class MainController:
         if dirpath is None or not dirpath.is_dir():
             return
 
-        # List content of the folder
-        files = sorted([file for file in dirpath.glob('*')])
-
         if dirpath != self._model.dirpath:  # Actual change of dirpath
-            dirpath_old = self._model.dirpath
-            self._model.files = files
-            if dirpath_old != dirpath:
-                self._watcher.removePaths(self._watcher.directories())
-                self._watcher.addPath(str(dirpath))
+            self._snapshot = scan_dir(dirpath)
+            self._model.set_dir_files(dirpath, self._snapshot.keys())
+            self._watcher.removePaths(self._watcher.directories())
+            self._watcher.addPath(str(dirpath))
+            self._scan_metadata()
         else:  # Update of the content
-            _model_files_set = set(self._model.files)
-            _files_set = set(files)
-
-            #
-            new_files = _files_set.difference(_model_files_set)
-            deleted_files = _model_files_set.difference(_files_set)
-
-            # We have new files or renamed file(s)
-            # TODO: Give more granularity to this and handle the addition of files event
-            if len(new_files) > 0:
-                self._model.add_files_to_list(new_files)
-
-            # Files have been deleted
-            if len(deleted_files) > 0:
-                # Current media in the list of deleted files. Go to the next available file to open
-                if self._model._media_path in deleted_files and len(files) > 0:
-                    idx = self._model.files.index(self._model.media_path)
-                    # Select a file in the old list as we don't know how to "insert" new files into the current list
-                    while self._model.files[idx] in deleted_files:
-                        idx = (idx + 1) % len(self._model.files)
-                        if idx == 0:
-                            break
-
-                    # Select the first media in the current list that is still
-                    path = self._model.files[idx] if self._model.files[idx] in files else files[0]
-                    self.set_media_path(path)
-
-                self._model.remove_files_from_list(deleted_files)
+            self.refresh_dirpath()
+
+    def refresh_dirpath(self):
+        """
+        List the current dir again and apply the differences with the last listing to the model
+        """
+        dirpath = self._model.dirpath
+        if dirpath is None or not dirpath.is_dir():
+            return
+        snapshot = scan_dir(dirpath)
+        added = {file for file in snapshot if file not in self._snapshot}
+        removed = {file for file in self._snapshot if file not in snapshot}
+        modified = [file for file, stat in snapshot.items() if file in self._snapshot and self._snapshot[file] != stat]
+        renamed = find_renames(removed, added, self._snapshot, snapshot)
+        self._snapshot = snapshot
+
+        if self._model.metadata is not None:
+            self._model.metadata.remove(removed.difference(old for old, _ in renamed))
+            self._model.metadata.rename(renamed)
+
+        if len(renamed) > 0:
+            self._model.rename_files_in_list(renamed)
+            removed.difference_update(old for old, _ in renamed)
+            added.difference_update(new for _, new in renamed)
+            new_path = dict(renamed).get(self._model.media_path, None)
+            if new_path is not None:
+                self.set_media_path(new_path)
+        if len(removed) > 0:
+            self._model.remove_files_from_list(removed)
+            # Current media deleted: go to the next file still available
+            files = self._model.files
+            if self._model.media_path in removed and len(files) > 0:
+                self.set_media_path(files[files.bisect_left(self._model.media_path) % len(files)])
+        if len(added) > 0:
+            self._model.add_files_to_list(added)
+        if len(modified) > 0:
+            self._model.set_files_modified(modified)
+        if len(added) > 0 or len(modified) > 0:
+            self._scan_metadata()
+
+    def crawl_library(self, roots: list[Path]):
+        """
+        Index in the background the metadata of the media files of the trees of roots
+        """
+        if self._scanner is not None and len(roots) > 0:
+            self._scanner.crawl(roots)
+
+    def _scan_metadata(self):
+        # Files of the current dir not indexed yet or changed since
+        if self._scanner is not None:
+            self._scanner.request(self._model.metadata.stale(self._snapshot))
+
+    def load_media_comment(self, path: Path) -> UserComment:
+        """
+        User comment of a jpg, from the metadata index if any
+        """
+        # Its edits not written yet first
+        if self._writer is not None:
+            self._writer.sync([path])
+        elif path in self._exif_edits:
+            self.flush_exif_edits()
+        if self._model.metadata is None:
+            return common.comment.ImageUserComment.load_from_file(path)
+        try:
+            metadata = self._model.metadata.load(path)
+            return common.comment.ImageUserComment.from_dict(metadata.user_comment or [])
+        except Exception:
+            return common.comment.ImageUserComment()
 
     def set_media_path(self, path: Path):
         if not path.is_file() or self._model.media_path == path:
@@ -88,7 +242,7 @@ class MainController:
 
         # Load the comments
         if path.suffix in FILE_EXTENSION_PHOTO_JPG:
-            self._model.media_comment = common.comment.ImageUserComment.load_from_file(path)
+            self._model.media_comment = self.load_media_comment(path)
 
     def set_db_tags_path(self, dirpath):
         self._model.set_db_tags_path(dirpath=dirpath)
@@ -100,9 +254,11 @@ class MainController:
         self._model.media_comment = comment
 
     def save_media_comment(self):
-        self._model.media_comment.save_comment(self._model.media_path)
+        self._exif_edits.set_user_comment(self._model.media_path, self._model.media_comment)
+        self.flush_exif_edits()
 
     def _next_media(self, incr=1, extension=FILE_EXTENSION_MEDIA):
+        # Sorted index of the files: O(log n) lookup
         idx0 = idx = self._model.files.index(self._model.media_path)
         while True:
             idx = (idx + incr) % len(self._model.files)
@@ -130,11 +286,11 @@ class MainController:
         path = Path(path)
         if not path.is_file():
             return
-        if str(path) not in self._watcher.files():  # Current file renamed ?
+        if str(path) not in self._watcher.files():  # Current file renamed or replaced (atomic rewrite) ?
             # We remove all the files that we're watching. Normally one only
             self._watcher.removePaths(self._watcher.files())
             self._watcher.addPath(str(path))
-        else:
+        if path == self._model.media_path:
             self._model.update_selected_file_content()
 
     def on_watcher_dir_changed(self, path=None):
@@ -142,11 +298,10 @@ class MainController:
         # Called  when the directory at a specified path is modified (e.g., when a file is added or deleted) or
         # removed from disk
         path = Path(path)
-        if not path.is_dir():
+        if not path.is_dir() or path != self._model.dirpath:
             return
-        # Content has been changed.
-        self.update_dirpath(path)
-        # TODO: Update this to handle properly the content that has changed
-        if path not in self._watcher.directories():
+        # Content has been changed: listed again once the events are over
+        self._dir_timer.start()
+        if str(path) not in self._watcher.directories():
             self._watcher.removePaths(self._watcher.directories())
             self._watcher.addPath(str(path))
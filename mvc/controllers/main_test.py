@@ -1,14 +1,25 @@
+import os
+import shutil
+import sys
+import tempfile
 import unittest
 from pathlib import Path
 
-from common.comment import UserComment
+from PyQt5.QtCore import QEventLoop, QTimer
+from PyQt5.QtWidgets import QApplication, QWidget
+
+from common.comment import TagEntity, UserComment
 from common.db import TagDBItem
+from common.metadata_index import MetadataIndex
 from mvc.controllers.main import MainController
 from mvc.models.main import MainModel
-from resources import test_controller, test_db_tags
+from resources import test_controller, test_db_tags, test_pics
 
 default_pics_folder = Path(test_controller.__file__).parent
 default_db_tags_folder = Path(test_db_tags.__file__).parent
+default_test_pics_folder = Path(test_pics.__file__).parent
+
+app = QApplication.instance() or QApplication(sys.argv)
 
 
 class MainControllerTest(unittest.TestCase):
@@ -128,3 +139,144 @@ class MainControllerTest(unittest.TestCase):
 
         # Assert that the next media is the second file in the model's files list
         self.assertEqual(model.media_path, default_pics_folder / "pic1.jpg")
+
+
+class RefreshDirpathTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.files = []
+        for name in ['a.jpg', 'b.jpg', 'c.jpg']:
+            shutil.copy(default_test_pics_folder / 'lenna.jpg', self.out_dir / name)
+            self.files.append(self.out_dir / name)
+        (self.out_dir / 'notes.txt').write_text('not a media')
+        self.window = QWidget()
+        self.model = MainModel()
+        self.controller = MainController(self.model)
+        self.controller.set_parent(self.window)
+        self.controller.update_dirpath(self.out_dir)
+        self.controller.set_media_path(self.files[1])
+        self.events = []
+        for name in ['files_added', 'files_removed', 'files_renamed', 'files_modified',
+                     'selected_dir_content_changed']:
+            getattr(self.model, name).connect(lambda arg, name=name: self.events.append((name, arg)))
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.out_dir)
+
+    def test_listing(self):
+        self.assertEqual(self.model.files, self.files)
+
+    def test_diff(self):
+        new_file = self.out_dir / 'd.jpg'
+        shutil.copy(self.files[0], new_file)
+        self.files[1].unlink()
+        stat = self.files[2].stat()
+        os.utime(self.files[2], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.controller.refresh_dirpath()
+
+        # Only the differences, no full listing
+        self.assertEqual(self.events, [('files_removed', [self.files[1]]), ('files_added', [new_file]),
+                                       ('files_modified', [self.files[2]])])
+        self.assertEqual(self.model.files, [self.files[0], self.files[2], new_file])
+        # Current media removed: next one selected
+        self.assertEqual(self.model.media_path, self.files[2])
+
+        # Nothing changed
+        self.events.clear()
+        self.controller.refresh_dirpath()
+        self.assertEqual(self.events, [])
+
+    def test_rename(self):
+        new_file = self.out_dir / 'e.jpg'
+        self.files[1].rename(new_file)
+        self.controller.refresh_dirpath()
+
+        self.assertEqual(self.events, [('files_renamed', [(self.files[1], new_file)])])
+        self.assertEqual(self.model.files, [self.files[0], self.files[2], new_file])
+        self.assertEqual(self.model.index_of(new_file), 2)
+        self.assertEqual(self.model.index_of(self.files[1]), -1)
+        # Current media renamed: still selected
+        self.assertEqual(self.model.media_path, new_file)
+
+    def test_next_media(self):
+        self.controller.select_next_media()
+        self.assertEqual(self.model.media_path, self.files[2])
+        self.controller.select_next_media()
+        self.assertEqual(self.model.media_path, self.files[0])
+        self.controller.select_prev_media()
+        self.assertEqual(self.model.media_path, self.files[2])
+
+
+class MetadataIndexControllerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.dirpath = self.out_dir / 'pics'
+        shutil.copytree(default_test_pics_folder, self.dirpath, ignore=shutil.ignore_patterns('*.py', '__*'))
+        self.index = MetadataIndex(self.out_dir / 'metadata.sqlite')
+        self.window = QWidget()
+        self.model = MainModel(metadata=self.index)
+        self.controller = MainController(self.model)
+        self.controller.set_parent(self.window)
+
+    def tearDown(self) -> None:
+        self.controller.shutdown()
+        self.index.close()
+        shutil.rmtree(self.out_dir)
+
+    def _wait_indexed(self):
+        loop = QEventLoop()
+        self.controller._scanner.idle.connect(loop.quit)
+        QTimer.singleShot(10000, loop.quit)
+        loop.exec_()
+
+    def test_indexed_in_background(self):
+        updated = []
+        self.model.metadata_updated.connect(updated.extend)
+        self.controller.update_dirpath(self.dirpath)
+        self._wait_indexed()
+        self.assertEqual(sorted(updated), list(self.model.files))
+        self.assertEqual(len(self.index.get_many(self.model.files)), len(self.model.files))
+
+        # Renamed: entry moved, nothing to read again
+        file = self.dirpath / 'lenna.jpg'
+        file.rename(self.dirpath / 'lenna2.jpg')
+        self.controller.refresh_dirpath()
+        self.assertFalse(self.controller._scanner.is_running)
+        self.assertEqual(self.index.get(self.dirpath / 'lenna2.jpg').persons, ['lenna'])
+        self.assertEqual(len(self.index), len(self.model.files))
+
+    def test_media_comment_from_index(self):
+        self.controller.update_dirpath(self.dirpath)
+        self.controller.set_media_path(self.dirpath / 'lenna.jpg')
+        self.assertEqual([tag.name for tag in self.model.media_comment.tags], ['tag1'])
+        self.assertEqual([person.name for person in self.model.media_comment.persons], ['lenna'])
+
+    def test_save_media_comment(self):
+        self.controller.update_dirpath(self.dirpath)
+        file = self.dirpath / 'lenna.jpg'
+        self.controller.set_media_path(file)
+        comment = self.model.media_comment
+        comment.add_entity(TagEntity('beach'))
+        self.controller.update_media_comment(comment)
+        self.controller.save_media_comment()
+        self.controller.exif_edits.add_entities(file, [TagEntity('sea')])
+        self.controller.flush_exif_edits()
+        # Written in the background: reading it waits for the writes
+        comment = self.controller.load_media_comment(file)
+        self.assertEqual([tag.name for tag in comment.tags], ['tag1', 'beach', 'sea'])
+        self.assertEqual(self.index.search(tags=['sea']), [file])
+
+    def test_flush_after_shutdown(self):
+        self.controller.update_dirpath(self.dirpath)
+        file = self.dirpath / 'lenna.jpg'
+        self.controller.shutdown()
+        self.assertIsNone(self.controller.metadata_writer)
+        # Edit of a window still open: written synchronously
+        self.controller.exif_edits.add_entities(file, [TagEntity('sea')])
+        self.controller.flush_exif_edits()
+        self.assertNotIn(file, self.controller.exif_edits)
+        self.assertEqual([tag.name for tag in self.controller.load_media_comment(file).tags], ['tag1', 'sea'])
+        self.assertEqual(self.index.search(tags=['sea']), [file])
+
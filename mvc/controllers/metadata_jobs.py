@@ -0,0 +1,428 @@
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from pathlib import Path
+
+from PyQt5.QtCore import QObject, pyqtSignal, QTimer
+
+from common.constants import FILE_EXTENSION_MEDIA
+from common.exif_edits import ExifEdits, write_exif_edits
+from common.metadata_index import MetadataIndex, read_metadata
+
+
+def _stale_files_of_tree(index: MetadataIndex, root: Path) -> list[Path]:
+    # Media files of the tree not indexed or changed since, one query per directory. Hidden dirs are skipped
+    stale = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+        snapshot = {}
+        for name in sorted(filenames):
+            if os.path.splitext(name)[1] not in FILE_EXTENSION_MEDIA:
+                continue
+            file = Path(dirpath) / name
+            try:
+                stat = file.stat()
+            except OSError:
+                continue
+            snapshot[file] = (stat.st_mtime_ns, stat.st_size)
+        if snapshot:
+            stale += index.stale(snapshot)
+    return stale
+
+
+def _read_metadata(file: Path):
+    try:
+        return read_metadata(file)
+    except OSError as e:
+        logging.warning(f"Cannot read the metadata of {file}: {e}")
+        return None
+
+
+def _write_exif_edits(file: Path, edits: list, read_back: bool):
+    changed = write_exif_edits(file, edits)
+    # Metadata of the file written, for the index
+    return changed, read_metadata(file) if changed and read_back else None
+
+
+class MetadataScanner(QObject):
+    """
+    Fill the metadata index in the background: files are read in a pool of worker threads, and the results
+    are written to the index by batches, in the GUI thread (a single writer, one transaction per batch).
+
+    A new request replaces the pending one, cancel drops everything: results of the tasks already running are
+    ignored. The whole library is crawled with a lower priority: its files are read when no request is pending.
+    """
+    # Files (re)indexed, sorted
+    indexed = pyqtSignal(list)
+    # Number of files indexed, total number of requested files
+    progress = pyqtSignal(int, int)
+    # All the requested files have been indexed
+    idle = pyqtSignal()
+
+    def __init__(self, index: MetadataIndex, max_workers=None, parent=None):
+        super(MetadataScanner, self).__init__(parent)
+        self.index = index
+        self.max_workers = max_workers if max_workers else max(1, min(4, os.cpu_count() or 1))
+
+        # Pending files, in request order
+        self._pending: OrderedDict[Path, None] = OrderedDict()
+        # Pending files of the crawled trees, read when there is no pending request
+        self._crawled: OrderedDict[Path, None] = OrderedDict()
+        # Listing of the crawled trees
+        self._crawl_futures: list[Future] = []
+        # Tasks submitted and not delivered yet: (file, future)
+        self._futures: list[tuple[Path, Future]] = []
+        self._done = 0
+        self._total = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._timer = QTimer(self, interval=50)
+        self._timer.timeout.connect(self._on_timeout_collect)
+
+    @property
+    def is_running(self):
+        return len(self._futures) > 0 or len(self._pending) > 0 or len(self._crawled) > 0 or \
+            len(self._crawl_futures) > 0
+
+    def request(self, files: list[Path]):
+        """
+        Replace the pending requests by files, read and indexed in this order
+        """
+        in_flight = {file for file, _ in self._futures}
+        self._pending = OrderedDict((file, None) for file in files if file not in in_flight)
+        for file in self._pending:
+            self._crawled.pop(file, None)
+        self._done = 0
+        self._total = len(self._pending) + len(self._futures) + len(self._crawled)
+        if self.is_running:
+            self._submit()
+            self._timer.start()
+
+    def crawl(self, roots: list[Path]):
+        """
+        Index the media files of the trees of roots not indexed yet or changed since (listed in a worker)
+        """
+        for root in roots:
+            self._crawl_futures.append(self._executor.submit(_stale_files_of_tree, self.index, root))
+        if self.is_running:
+            self._timer.start()
+
+    def cancel(self):
+        """
+        Drop the pending requests and crawls, and the results of the running tasks
+        """
+        self._pending.clear()
+        self._crawled.clear()
+        for _, future in self._futures:
+            future.cancel()
+        for future in self._crawl_futures:
+            future.cancel()
+        self._futures = []
+        self._crawl_futures = []
+        self._timer.stop()
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self):
+        while (self._pending or self._crawled) and len(self._futures) < 2 * self.max_workers:
+            file, _ = (self._pending or self._crawled).popitem(last=False)
+            self._futures.append((file, self._executor.submit(_read_metadata, file)))
+
+    def _collect_crawls(self):
+        pending = []
+        for future in self._crawl_futures:
+            if not future.done():
+                pending.append(future)
+                continue
+            try:
+                files = future.result()
+            except Exception as e:
+                logging.warning(f"Cannot crawl the library: {e}")
+                continue
+            in_flight = {file for file, _ in self._futures}
+            files = [file for file in files if file not in self._crawled and file not in in_flight]
+            self._crawled.update((file, None) for file in files)
+            self._total += len(files)
+        self._crawl_futures = pending
+
+    def _on_timeout_collect(self):
+        self._collect_crawls()
+        pending, results, n_delivered = [], [], 0
+        for file, future in self._futures:
+            if not future.done():
+                pending.append((file, future))
+                continue
+            try:
+                metadata = future.result()
+            except Exception as e:
+                logging.warning(f"Cannot read the metadata of {file}: {e}")
+                metadata = None
+            n_delivered += 1
+            if metadata is not None:
+                results.append(metadata)
+        self._futures = pending
+        self._submit()
+
+        if results:
+            self.index.put_many(results)
+        self._done += n_delivered
+        done, total = self._done, self._total
+        # State updated first: receivers may request / cancel
+        if results:
+            self.indexed.emit(sorted(metadata.path for metadata in results))
+        if n_delivered > 0:
+            self.progress.emit(done, total)
+
+        if not self.is_running:
+            self._timer.stop()
+            self.idle.emit()
+
+
+class MetadataWriter(QObject):
+    """
+    Write the exif edits gathered from all the views (edits) in the background: the edits of a file are coalesced
+    and written with a single atomic rewrite (see common.exif_edits), files written in a pool of worker threads.
+    The metadata index, if any, is updated with the files written, in the GUI thread.
+
+    A file is never written by 2 tasks at once: its new edits stay pending until the running write is delivered.
+    """
+    # Files written, sorted
+    written = pyqtSignal(list)
+    # Files that could not be written: [(file, error message)]
+    failed = pyqtSignal(list)
+    # Number of files written (or failed), total number of files to write since idle
+    progress = pyqtSignal(int, int)
+    # All the edits have been written
+    idle = pyqtSignal()
+
+    def __init__(self, edits: ExifEdits, index: MetadataIndex = None, max_workers=None, parent=None):
+        super(MetadataWriter, self).__init__(parent)
+        self.edits = edits
+        self.index = index
+        self.max_workers = max_workers if max_workers else max(1, min(4, os.cpu_count() or 1))
+
+        # Files being written
+        self._futures: dict[Path, Future] = {}
+        self._flushing = False
+        self._done = 0
+        self._total = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._timer = QTimer(self, interval=50)
+        self._timer.timeout.connect(self._on_timeout_collect)
+
+    @property
+    def is_running(self):
+        return len(self._futures) > 0 or (self._flushing and len(self.edits) > 0)
+
+    def flush(self):
+        """
+        Write all the pending edits, and the ones added until idle
+        """
+        if not self.is_running:
+            self._done, self._total = 0, 0
+        self._flushing = True
+        self._submit()
+        if self.is_running:
+            self._timer.start()
+
+    def sync(self, files: list[Path]):
+        """
+        Write now the pending edits of files and wait for the ones being written: files and index are up to date
+        when it returns
+        """
+        wait([self._futures[file] for file in files if file in self._futures])
+        self._collect()
+        results = []
+        for file, edits in self.edits.pop(files).items():
+            self._total += 1
+            try:
+                results.append((file, *_write_exif_edits(file, edits, self.index is not None), None))
+            except Exception as e:
+                results.append((file, False, None, e))
+        self._deliver(results)
+
+    def shutdown(self):
+        """
+        Write everything pending, then stop the workers
+        """
+        self.sync(list(self._futures) + self.edits.files)
+        self._timer.stop()
+        self._executor.shutdown(wait=True)
+
+    def _submit(self):
+        files = [file for file in self.edits.files if file not in self._futures]
+        for file, edits in self.edits.pop(files).items():
+            self._futures[file] = self._executor.submit(_write_exif_edits, file, edits, self.index is not None)
+            self._total += 1
+
+    def _collect(self):
+        results = []
+        for file, future in list(self._futures.items()):
+            if not future.done():
+                continue
+            del self._futures[file]
+            try:
+                results.append((file, *future.result(), None))
+            except Exception as e:
+                results.append((file, False, None, e))
+        self._deliver(results)
+
+    def _deliver(self, results):
+        # results: [(file, rewritten, metadata or None, error or None)]
+        if not results:
+            return
+        written = sorted(file for file, changed, _, _ in results if changed)
+        failed = [(file, str(error)) for file, _, _, error in results if error is not None]
+        for file, message in failed:
+            logging.warning(f"Cannot write the exif of {file}: {message}")
+        metadata = [metadata for _, _, metadata, _ in results if metadata is not None]
+        if metadata:
+            self.index.put_many(metadata)
+        self._done += len(results)
+        done, total = self._done, self._total
+        # State updated first: receivers may add edits / flush
+        if written:
+            self.written.emit(written)
+        if failed:
+            self.failed.emit(failed)
+        self.progress.emit(done, total)
+
+    def _on_timeout_collect(self):
+        self._collect()
+        self._submit()
+        if not self.is_running:
+            self._flushing = False
+            self._timer.stop()
+            self.idle.emit()
+
+
+class ExifMaintenanceJob(QObject):
+    """
+    Apply the same exif edits (see common.exif_edits: strip the thumbnails, add tags, shift the dates...) to many
+    files in a pool of worker threads. The files left unchanged by the edits are not rewritten. The metadata index,
+    if any, is updated with the files rewritten, in the GUI thread. The job can be cancelled: the files being
+    written are completed, the others are left untouched.
+    """
+    # Files rewritten, sorted
+    written = pyqtSignal(list)
+    # Number of processed files, total number of files, throughput in files / s
+    progress = pyqtSignal(int, int, float)
+    # Emitted when all the files have been processed (False) or the job has been cancelled (True)
+    finished = pyqtSignal(bool)
+
+    def __init__(self, files: list[Path], edits: list, index: MetadataIndex = None, max_workers=None, parent=None):
+        super(ExifMaintenanceJob, self).__init__(parent)
+        # A file is written by a single task
+        self.files = list(dict.fromkeys(files))
+        self.edits = list(edits)
+        self.index = index
+        # I/O bound: more threads than cores
+        self.max_workers = max_workers if max_workers else max(1, min(8, 2 * (os.cpu_count() or 1)))
+
+        # Files rewritten, left unchanged, and the ones that could not be processed
+        self.rewritten: list[Path] = []
+        self.unchanged: list[Path] = []
+        self.failed: dict[Path, str] = {}
+
+        self._executor = None
+        self._futures: list[Future] = []
+        # Tasks done, appended by the workers: large jobs are not polled task by task
+        self._done_queue: deque[tuple[Path, Future]] = deque()
+        self._t_start = 0.
+        self._t_end = 0.
+        self._timer = QTimer(self, interval=50)
+        self._timer.timeout.connect(self._on_timeout_collect)
+
+    @property
+    def is_running(self):
+        return self._executor is not None
+
+    @property
+    def n_done(self):
+        return len(self.rewritten) + len(self.unchanged) + len(self.failed)
+
+    @property
+    def throughput(self):
+        """
+        Files processed per second
+        """
+        elapsed = (self._t_end if not self.is_running else time.time()) - self._t_start
+        return self.n_done / elapsed if elapsed > 0 else 0.
+
+    def start(self):
+        if self.is_running:
+            return
+        if len(self.files) == 0:
+            self.finished.emit(False)
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        read_back = self.index is not None
+        self._t_start = time.time()
+        for file in self.files:
+            future = self._executor.submit(_write_exif_edits, file, self.edits, read_back)
+            future.add_done_callback(lambda future, file=file: self._done_queue.append((file, future)))
+            self._futures.append(future)
+        self.progress.emit(0, len(self.files), 0.)
+        self._timer.start()
+
+    def cancel(self):
+        if not self.is_running:
+            return
+        for future in self._futures:
+            future.cancel()
+        # The files being written are completed and delivered
+        self._executor.shutdown(wait=True)
+        self._collect()
+        self._stop()
+        logging.info(f"Exif maintenance cancelled after {self.n_done}/{len(self.files)} files")
+        self.finished.emit(True)
+
+    def _stop(self):
+        self._timer.stop()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._futures = []
+        self._done_queue.clear()
+        self._t_end = time.time()
+
+    def _collect(self):
+        rewritten, metadata = [], []
+        while self._done_queue:
+            file, future = self._done_queue.popleft()
+            if future.cancelled():
+                continue
+            try:
+                changed, file_metadata = future.result()
+            except Exception as e:
+                logging.warning(f"Cannot write the exif of {file}: {e}")
+                self.failed[file] = str(e)
+                continue
+            if changed:
+                rewritten.append(file)
+                if file_metadata is not None:
+                    metadata.append(file_metadata)
+            else:
+                self.unchanged.append(file)
+
+        if metadata:
+            self.index.put_many(metadata)
+        self.rewritten += rewritten
+        if rewritten:
+            self.written.emit(sorted(rewritten))
+
+    def _on_timeout_collect(self):
+        n_done = self.n_done
+        self._collect()
+        if self.n_done == n_done:
+            return
+        self.progress.emit(self.n_done, len(self.files), self.throughput)
+        if self.n_done == len(self.files):
+            self._stop()
+            logging.info(f"Exif maintenance done: {len(self.rewritten)} files rewritten, {len(self.unchanged)} "
+                         f"unchanged, {len(self.failed)} failed, {self.throughput:.1f} files/s")
+            self.finished.emit(False)
@@ -0,0 +1,223 @@
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+from PyQt5.QtCore import QEventLoop, QTimer
+from PyQt5.QtWidgets import QApplication
+
+import resources.test_pics as test_pics
+from common.comment import ImageUserComment, TagEntity
+from common.exif import get_exif
+from common.exif_edits import ExifEdits, strip_thumbnail, add_entities
+from common.metadata_index import MetadataIndex
+from common.thumbnails_test import add_exif_thumbnail
+from mvc.controllers.metadata_jobs import ExifMaintenanceJob, MetadataScanner, MetadataWriter
+
+default_pics_folder = Path(test_pics.__file__).parent
+
+app = QApplication.instance() or QApplication(sys.argv)
+
+
+def _run(scanner, timeout=10000, signal='idle'):
+    loop = QEventLoop()
+    getattr(scanner, signal).connect(loop.quit)
+    QTimer.singleShot(timeout, loop.quit)
+    loop.exec_()
+
+
+class MetadataScannerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.files = []
+        for i in range(5):
+            file = self.out_dir / f"{i}.jpg"
+            shutil.copy(default_pics_folder / 'lenna.jpg', file)
+            self.files.append(file)
+        self.index = MetadataIndex(self.out_dir / 'metadata.sqlite')
+        self.scanner = MetadataScanner(self.index, max_workers=2)
+        self.indexed, self.progress = [], []
+        self.scanner.indexed.connect(self.indexed.extend)
+        self.scanner.progress.connect(lambda done, total: self.progress.append((done, total)))
+
+    def tearDown(self) -> None:
+        self.scanner.shutdown()
+        self.index.close()
+        shutil.rmtree(self.out_dir)
+
+    def test_scan(self):
+        self.scanner.request(self.files + [self.out_dir / 'not_existing.jpg'])
+        _run(self.scanner)
+        self.assertFalse(self.scanner.is_running)
+        self.assertEqual(sorted(self.indexed), self.files)
+        self.assertEqual(self.progress[-1], (6, 6))
+        self.assertEqual(len(self.index.get_many(self.files)), len(self.files))
+
+    def test_cancel(self):
+        self.scanner.request(self.files)
+        self.scanner.cancel()
+        self.assertFalse(self.scanner.is_running)
+        self.scanner._on_timeout_collect()
+        self.assertEqual(self.indexed, [])
+
+    def test_crawl(self):
+        sub_dir = self.out_dir / 'sub'
+        hidden_dir = self.out_dir / '.backup'
+        for dirpath in [sub_dir, hidden_dir]:
+            dirpath.mkdir()
+            shutil.copy(self.files[0], dirpath / 'pic.jpg')
+        self.index.load_many(self.files[:2])
+        self.scanner.crawl([self.out_dir])
+        _run(self.scanner)
+        # Only the files not indexed yet, hidden dirs skipped
+        self.assertEqual(sorted(self.indexed), sorted(self.files[2:] + [sub_dir / 'pic.jpg']))
+        self.assertEqual(len(self.index), 6)
+
+
+
+class MetadataWriterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.files = []
+        for i in range(5):
+            file = self.out_dir / f"{i}.jpg"
+            shutil.copy(default_pics_folder / 'lenna.jpg', file)
+            self.files.append(file)
+        self.index = MetadataIndex(self.out_dir / 'metadata.sqlite')
+        self.index.load_many(self.files)
+        self.writer = MetadataWriter(ExifEdits(), index=self.index, max_workers=2)
+        self.written, self.failed, self.progress = [], [], []
+        self.writer.written.connect(self.written.extend)
+        self.writer.failed.connect(self.failed.extend)
+        self.writer.progress.connect(lambda done, total: self.progress.append((done, total)))
+
+    def tearDown(self) -> None:
+        self.writer.shutdown()
+        self.index.close()
+        shutil.rmtree(self.out_dir)
+
+    def test_flush(self):
+        not_existing = self.out_dir / 'not_existing.jpg'
+        for file in self.files + [not_existing]:
+            self.writer.edits.add_entities(file, [TagEntity('beach')])
+        self.writer.edits.add_entities(self.files[0], [TagEntity('sea')])
+        self.writer.flush()
+        _run(self.writer)
+        self.assertFalse(self.writer.is_running)
+        self.assertEqual(self.written, self.files)
+        self.assertEqual([file for file, _ in self.failed], [not_existing])
+        self.assertEqual(self.progress[-1], (6, 6))
+        # Index up to date
+        self.assertEqual(self.index.get(self.files[0]).tags, ['tag1', 'beach', 'sea'])
+        self.assertEqual(self.index.search(tags=['beach']), self.files)
+
+    def test_sync(self):
+        self.writer.edits.add_entities(self.files[0], [TagEntity('beach')])
+        self.writer.flush()
+        self.writer.edits.add_entities(self.files[0], [TagEntity('sea')])
+        self.writer.edits.add_entities(self.files[1], [TagEntity('sea')])
+        self.writer.sync([self.files[0]])
+        # Both edits of the file written, in order, the other file still pending
+        self.assertEqual(self.index.get(self.files[0]).tags, ['tag1', 'beach', 'sea'])
+        self.assertEqual(self.writer.edits.files, [self.files[1]])
+        self.writer.shutdown()
+        self.assertEqual(len(self.writer.edits), 0)
+        self.assertEqual(self.index.get(self.files[1]).tags, ['tag1', 'sea'])
+
+
+class ExifMaintenanceJobTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.files = []
+        for i in range(6):
+            file = self.out_dir / f"{i}.jpg"
+            shutil.copy(default_pics_folder / 'lenna.jpg', file)
+            self.files.append(file)
+        # Only 2 files with a thumbnail
+        for file in self.files[:2]:
+            add_exif_thumbnail(file)
+        self.index = MetadataIndex(self.out_dir / 'metadata.sqlite')
+        self.written, self.progress, self.finished = [], [], []
+
+    def tearDown(self) -> None:
+        self.index.close()
+        shutil.rmtree(self.out_dir)
+
+    def _job(self, files, edits):
+        job = ExifMaintenanceJob(files, edits, index=self.index, max_workers=2)
+        job.written.connect(self.written.extend)
+        job.progress.connect(lambda done, total, throughput: self.progress.append((done, total)))
+        job.finished.connect(self.finished.append)
+        return job
+
+    def test_strip_thumbnails(self):
+        not_existing = self.out_dir / 'not_existing.jpg'
+        job = self._job(self.files + [not_existing], [strip_thumbnail])
+        job.start()
+        _run(job, signal='finished')
+        self.assertEqual(self.finished, [False])
+        self.assertFalse(job.is_running)
+        # Files without thumbnail not rewritten
+        self.assertEqual(sorted(job.rewritten), self.files[:2])
+        self.assertEqual(sorted(self.written), self.files[:2])
+        self.assertEqual(sorted(job.unchanged), self.files[2:])
+        self.assertEqual(list(job.failed.keys()), [not_existing])
+        self.assertEqual(self.progress[-1], (7, 7))
+        self.assertGreater(job.throughput, 0.)
+        for file in self.files:
+            self.assertIsNone(get_exif(file)['thumbnail'])
+        self.assertEqual(len(self.index.get_many(self.files[:2])), 2)
+
+    def test_add_tags(self):
+        job = self._job(self.files + self.files[:1], [add_entities([TagEntity('beach')])])
+        job.start()
+        _run(job, signal='finished')
+        self.assertEqual(sorted(job.rewritten), self.files)
+        self.assertEqual(self.index.search(tags=['beach']), self.files)
+
+    def test_cancel(self):
+        job = self._job(self.files, [add_entities([TagEntity('beach')])])
+        job.start()
+        job.cancel()
+        self.assertEqual(self.finished, [True])
+        self.assertFalse(job.is_running)
+        # Files written or left untouched, never half written
+        self.assertEqual(job.n_done, len(job.rewritten))
+        self.assertEqual(sorted(self.index.search(tags=['beach'])), sorted(job.rewritten))
+
+    def test_writer_edit_during_job(self):
+        started = threading.Event()
+
+        def slow_edit(exif_dict):
+            started.set()
+            time.sleep(0.3)
+
+        file = self.files[0]
+        job = self._job([file], [add_entities([TagEntity('beach')]), slow_edit])
+        writer = MetadataWriter(ExifEdits(), index=self.index, max_workers=2)
+        try:
+            job.start()
+            self.assertTrue(started.wait(5))
+            # Edit of the file being written by the job
+            writer.edits.add_entities(file, [TagEntity('sea')])
+            writer.flush()
+            _run(job, signal='finished')
+            if writer.is_running:
+                _run(writer)
+        finally:
+            writer.shutdown()
+        # Both edits kept
+        tags = [tag.name for tag in ImageUserComment.load_from_file(file).tags]
+        self.assertIn('beach', tags)
+        self.assertIn('sea', tags)
+        self.assertEqual(self.index.search(tags=['beach', 'sea']), [file])
+
+
+if __name__ == '__main__':
+    unittest.main()
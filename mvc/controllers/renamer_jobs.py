@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from PyQt5.QtCore import QObject, pyqtSignal, QTimer
+
+
+class RenamerScanJob(QObject):
+    """
+    Build the results of a renamer (see mvc.views.renamer.IRenamer.iter_parse_build_filename) in the background,
+    and deliver them by batches in the GUI thread as soon as they are built, so that a large folder is previewed
+    while it is being read. The job can be cancelled: the results not delivered yet are dropped.
+    """
+    # Results (mvc.views.renamer.Result) built since the last batch
+    results = pyqtSignal(list)
+    # Number of results delivered, total number of files, throughput in files / s
+    progress = pyqtSignal(int, int, float)
+    # Emitted when all the files have been parsed (False) or the job has been cancelled (True)
+    finished = pyqtSignal(bool)
+
+    # Max number of results delivered at once: the GUI stays responsive
+    batch_size = 1000
+
+    def __init__(self, renamer, files: list[Path], max_workers=None, parent=None):
+        super(RenamerScanJob, self).__init__(parent)
+        self.renamer = renamer
+        self.files = list(files)
+        self.max_workers = max_workers
+        self.n_done = 0
+
+        self._thread: threading.Thread = None
+        self._cancelled = threading.Event()
+        self._scan_done = threading.Event()
+        # Results built, appended by the scanning thread
+        self._queue = deque()
+        self._t_start = 0.
+        self._t_end = 0.
+        self._timer = QTimer(self, interval=50)
+        self._timer.timeout.connect(self._on_timeout_collect)
+
+    @property
+    def is_running(self):
+        return self._thread is not None
+
+    @property
+    def throughput(self):
+        """
+        Files parsed per second
+        """
+        elapsed = (self._t_end if not self.is_running else time.time()) - self._t_start
+        return self.n_done / elapsed if elapsed > 0 else 0.
+
+    def start(self):
+        if self.is_running:
+            return
+        self._t_start = time.time()
+        self._thread = threading.Thread(target=self._scan, daemon=True)
+        self._thread.start()
+        self.progress.emit(0, len(self.files), 0.)
+        self._timer.start()
+
+    def _scan(self):
+        # Scanning thread: the generator is created, iterated and closed here
+        generator = self.renamer.iter_parse_build_filename(self.files, max_workers=self.max_workers)
+        try:
+            for result in generator:
+                if self._cancelled.is_set():
+                    break
+                self._queue.append(result)
+        except Exception as e:
+            logging.warning(f"Scan of the files to rename interrupted: {e}")
+        finally:
+            generator.close()
+            self._scan_done.set()
+
+    def cancel(self):
+        if not self.is_running:
+            return
+        self._cancelled.set()
+        # The files being read are completed, their results dropped
+        self._thread.join()
+        self._stop()
+        logging.info(f"Scan of the files to rename cancelled after {self.n_done}/{len(self.files)} files")
+        self.finished.emit(True)
+
+    def _stop(self):
+        self._timer.stop()
+        self._thread = None
+        self._queue.clear()
+        self._t_end = time.time()
+
+    def _on_timeout_collect(self):
+        if not self.is_running:
+            return
+        # Read before the queue: all the results are queued once it is set
+        scan_done = self._scan_done.is_set()
+        batch = []
+        while self._queue and len(batch) < self.batch_size:
+            batch.append(self._queue.popleft())
+        if batch:
+            self.n_done += len(batch)
+            self.results.emit(batch)
+            self.progress.emit(self.n_done, len(self.files), self.throughput)
+            # Cancelled by a slot
+            if not self.is_running:
+                return
+        if scan_done and not self._queue:
+            self._thread.join()
+            self._stop()
+            logging.info(f"Scan of the files to rename done: {self.n_done} files, {self.throughput:.1f} files/s")
+            self.finished.emit(False)
@@ -0,0 +1,82 @@
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from PyQt5.QtCore import QEventLoop, QTimer
+from PyQt5.QtWidgets import QApplication
+
+import resources.test_pics as test_pics
+from common import nameddic
+from common.constants import FILE_EXTENSION_PHOTO_JPG
+from mvc.controllers.renamer_jobs import RenamerScanJob
+from mvc.views.renamer import MetaParser, parsers
+from mvc.views.renamer.common.status import StatusPhoto
+from mvc.views.renamer.photo import RenamerPhoto
+
+default_pics_folder = Path(test_pics.__file__).parent
+
+app = QApplication.instance() or QApplication(sys.argv)
+
+parsers.load_plugins(parent_module_name='mvc.views.renamer.parsers')
+
+
+def _run(job, timeout=10000):
+    loop = QEventLoop()
+    job.finished.connect(loop.quit)
+    QTimer.singleShot(timeout, loop.quit)
+    loop.exec_()
+
+
+class RenamerScanJobTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.files = []
+        for i in range(20):
+            file = self.out_dir / f"IMG_{i:02d}.jpg"
+            shutil.copy(default_pics_folder / 'to_rename.jpg', file)
+            self.files.append(file)
+        config = nameddic()
+        config.parser_cls_list = parsers.REPO_PARSERS['photo']
+        self.renamer = RenamerPhoto(parser=MetaParser.generate_parser(config=config,
+                                                                      file_extensions=FILE_EXTENSION_PHOTO_JPG))
+        self.results, self.progress, self.finished = [], [], []
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.out_dir)
+
+    def _job(self, files):
+        job = RenamerScanJob(self.renamer, files, max_workers=2)
+        job.results.connect(self.results.extend)
+        job.progress.connect(lambda done, total, throughput: self.progress.append((done, total)))
+        job.finished.connect(self.finished.append)
+        return job
+
+    def test_scan(self):
+        job = self._job(self.renamer.list_files(self.out_dir))
+        job.batch_size = 8
+        job.start()
+        _run(job)
+        self.assertEqual(self.finished, [False])
+        self.assertFalse(job.is_running)
+        self.assertEqual(sorted(result.filename_src for result in self.results), [file.name for file in self.files])
+        self.assertTrue(all(result.status == StatusPhoto.exif_only for result in self.results))
+        # Delivered by batches
+        self.assertEqual(self.progress[1], (8, 20))
+        self.assertEqual(self.progress[-1], (20, 20))
+
+    def test_cancel(self):
+        job = self._job(self.files)
+        job.start()
+        job.cancel()
+        self.assertEqual(self.finished, [True])
+        self.assertFalse(job.is_running)
+        # Nothing delivered once cancelled
+        job._on_timeout_collect()
+        self.assertEqual(len(self.results), job.n_done)
+
+
+if __name__ == '__main__':
+    unittest.main()
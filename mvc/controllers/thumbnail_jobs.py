@@ -0,0 +1,173 @@
+import logging
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+
+from PyQt5.QtCore import QObject, pyqtSignal, QTimer
+from PyQt5.QtGui import QImage
+
+import common.cv
+from common.thumbnails import ThumbnailCache, get_thumbnail, load_exif_thumbnail, fit_size
+
+# Kinds of results of a task
+kind_none = 0
+kind_preview = 1
+kind_thumbnail = 2
+
+
+def _to_qimage(arr):
+    # Copy: the QImage must not share the buffer of a numpy array of the worker
+    return common.cv.toQImage(arr, copy=True)
+
+
+def _produce_preview(file: Path, size, cache: ThumbnailCache):
+    # Cheap pass: cached thumbnail, else thumbnail embedded in the exif
+    arr = cache.get(file, size) if cache is not None else None
+    if arr is not None:
+        return kind_thumbnail, _to_qimage(arr)
+    arr = load_exif_thumbnail(file)
+    if arr is None:
+        return kind_none, None
+    if max(arr.shape[:2]) >= size:
+        # Large enough: no need to decode the file
+        return kind_thumbnail, _to_qimage(fit_size(arr, size))
+    return kind_preview, _to_qimage(arr)
+
+
+def _produce_thumbnail(file: Path, size, cache: ThumbnailCache):
+    arr = get_thumbnail(file, size, cache)
+    if arr is None:
+        return kind_none, None
+    return kind_thumbnail, _to_qimage(arr)
+
+
+class ThumbnailProducer(QObject):
+    """
+    Produce the thumbnails of files in a pool of worker threads (decoding and resizing release the GIL).
+
+    Requested files are processed in the order given (visible first), in 2 passes: first the cheap previews
+    (cached thumbnail or exif thumbnail) for all the requested files, then the decoding of the thumbnails
+    not found in the cache. A new request replaces the pending one, cancel drops everything: results of the
+    tasks already running are ignored.
+    Memory is capped by limiting the estimated size of the tasks submitted and not delivered yet.
+    """
+    # Thumbnail of a file
+    thumbnail_ready = pyqtSignal(Path, QImage)
+    # Low resolution thumbnail of a file, to be displayed until its thumbnail is ready
+    preview_ready = pyqtSignal(Path, QImage)
+    # File that cannot be read
+    failed = pyqtSignal(Path)
+    # All the requested files have been processed
+    idle = pyqtSignal()
+
+    def __init__(self, size, cache: ThumbnailCache = None, max_workers=None, max_bytes_in_flight=128 * 1024 * 1024,
+                 parent=None):
+        super(ThumbnailProducer, self).__init__(parent)
+        self.size = size
+        self.cache = cache
+        self.max_workers = max_workers if max_workers else max(1, min(4, os.cpu_count() or 1))
+        self.max_bytes_in_flight = max_bytes_in_flight
+
+        # Pending files, in priority order
+        self._previews: OrderedDict[Path, None] = OrderedDict()
+        self._thumbnails: OrderedDict[Path, None] = OrderedDict()
+        # Tasks submitted and not delivered yet: (file, is_preview, estimated bytes, future)
+        self._futures: list[tuple[Path, bool, int, Future]] = []
+        self._bytes_in_flight = 0
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._timer = QTimer(self, interval=10)
+        self._timer.timeout.connect(self._on_timeout_collect)
+
+    @property
+    def is_running(self):
+        return len(self._futures) > 0 or len(self._previews) > 0 or len(self._thumbnails) > 0
+
+    def _estimated_bytes(self, is_preview):
+        # Exif thumbnails are tiny, a picture is decoded at up to 2x the size (jpeg draft) before the resize
+        return 160 * 160 * 3 if is_preview else 4 * 3 * self.size * self.size
+
+    def request(self, files: list[Path], previews: list[Path] = None):
+        """
+        Replace the pending requests
+        :param files: files whose thumbnail is wanted, in priority order
+        :param previews: files (in files) for which a preview pass is wanted, all of them if None
+        """
+        previews = files if previews is None else previews
+        in_flight = {(file, is_preview) for file, is_preview, _, _ in self._futures}
+        self._previews = OrderedDict((file, None) for file in previews if (file, True) not in in_flight)
+        self._thumbnails = OrderedDict((file, None) for file in files if (file, False) not in in_flight)
+        if self.is_running:
+            self._submit()
+            self._timer.start()
+
+    def cancel(self):
+        """
+        Drop the pending requests, and the results of the running tasks
+        """
+        self._previews.clear()
+        self._thumbnails.clear()
+        for _, _, _, future in self._futures:
+            future.cancel()
+        self._futures = []
+        self._bytes_in_flight = 0
+        self._timer.stop()
+
+    def shutdown(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self):
+        # Keep the workers busy, without exceeding the memory cap (at least one task)
+        while len(self._futures) < 2 * self.max_workers:
+            if self._previews:
+                file, is_preview, func = next(iter(self._previews)), True, _produce_preview
+            else:
+                # Not before the preview of the file: a cached thumbnail makes it useless
+                previewing = {file for file, is_preview, _, _ in self._futures if is_preview}
+                file = next((file for file in self._thumbnails if file not in previewing), None)
+                if file is None:
+                    return
+                is_preview, func = False, _produce_thumbnail
+            nbytes = self._estimated_bytes(is_preview)
+            if self._futures and self._bytes_in_flight + nbytes > self.max_bytes_in_flight:
+                return
+            del (self._previews if is_preview else self._thumbnails)[file]
+            self._futures.append((file, is_preview, nbytes, self._executor.submit(func, file, self.size, self.cache)))
+            self._bytes_in_flight += nbytes
+
+    def _on_timeout_collect(self):
+        pending, delivered = [], []
+        for file, is_preview, nbytes, future in self._futures:
+            if not future.done():
+                pending.append((file, is_preview, nbytes, future))
+                continue
+            self._bytes_in_flight -= nbytes
+            try:
+                kind, qimage = future.result()
+            except Exception as e:
+                logging.warning(f"Cannot produce the thumbnail of {file}: {e}")
+                kind, qimage = kind_none, None
+            if kind == kind_thumbnail:
+                self._thumbnails.pop(file, None)
+            delivered.append((file, is_preview, kind, qimage))
+        self._futures = pending
+        self._submit()
+
+        # State updated first: receivers may request / cancel
+        futures = self._futures
+        for file, is_preview, kind, qimage in delivered:
+            if futures is not self._futures:
+                # Cancelled
+                break
+            if kind == kind_thumbnail:
+                self.thumbnail_ready.emit(file, qimage)
+            elif kind == kind_preview:
+                self.preview_ready.emit(file, qimage)
+            elif not is_preview:
+                self.failed.emit(file)
+
+        if not self.is_running:
+            self._timer.stop()
+            self.idle.emit()
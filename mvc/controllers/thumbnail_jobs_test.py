@@ -0,0 +1,122 @@
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from PyQt5.QtCore import QEventLoop, QTimer
+from PyQt5.QtWidgets import QApplication
+
+import mvc.controllers.thumbnail_jobs as thumbnail_jobs
+import resources.test_pics as test_pics
+from common.thumbnails import ThumbnailCache
+from common.thumbnails_test import add_exif_thumbnail
+from mvc.controllers.thumbnail_jobs import ThumbnailProducer
+
+default_pics_folder = Path(test_pics.__file__).parent
+
+app = QApplication.instance() or QApplication(sys.argv)
+
+
+def _run(producer, timeout=10000):
+    loop = QEventLoop()
+    producer.idle.connect(loop.quit)
+    QTimer.singleShot(timeout, loop.quit)
+    loop.exec_()
+
+
+class ThumbnailProducerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.files = []
+        for i in range(6):
+            file = self.out_dir / f"{i}.jpg"
+            shutil.copy(default_pics_folder / 'lenna.jpg', file)
+            self.files.append(file)
+        self.received = []
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.out_dir)
+
+    def _producer(self, size=100, **kwargs):
+        producer = ThumbnailProducer(size, max_workers=2, **kwargs)
+        producer.thumbnail_ready.connect(lambda file, qimage: self.received.append(('thumbnail', file, qimage)))
+        producer.preview_ready.connect(lambda file, qimage: self.received.append(('preview', file, qimage)))
+        producer.failed.connect(lambda file: self.received.append(('failed', file, None)))
+        return producer
+
+    def test_thumbnails(self):
+        producer = self._producer()
+        files = self.files + [self.out_dir / 'not_existing.jpg']
+        producer.request(files)
+        _run(producer)
+        self.assertFalse(producer.is_running)
+        self.assertEqual({file for kind, file, _ in self.received if kind == 'thumbnail'}, set(self.files))
+        self.assertEqual([file for kind, file, _ in self.received if kind == 'failed'], files[-1:])
+        for kind, _, qimage in self.received:
+            if kind == 'thumbnail':
+                self.assertEqual(max(qimage.width(), qimage.height()), 100)
+        producer.shutdown()
+
+    def test_previews_first(self):
+        add_exif_thumbnail(self.files[0])
+        add_exif_thumbnail(self.files[1])
+        producer = self._producer(size=400, max_bytes_in_flight=1)
+        producer.request(self.files[:2])
+        _run(producer)
+        # Memory cap of 1 byte: one task at a time, previews of all the files before the thumbnails
+        self.assertEqual([(kind, file) for kind, file, _ in self.received],
+                         [('preview', self.files[0]), ('preview', self.files[1]),
+                          ('thumbnail', self.files[0]), ('thumbnail', self.files[1])])
+        producer.shutdown()
+
+    def test_large_exif_thumbnail_is_enough(self):
+        add_exif_thumbnail(self.files[0])
+        producer = self._producer(size=100)
+        with mock.patch.object(thumbnail_jobs, 'get_thumbnail') as get_thumbnail:
+            producer.request(self.files[:1])
+            _run(producer)
+            get_thumbnail.assert_not_called()
+        self.assertEqual([(kind, file) for kind, file, _ in self.received], [('thumbnail', self.files[0])])
+        producer.shutdown()
+
+    def test_cached(self):
+        cache = ThumbnailCache(self.out_dir / 'thumbnails.sqlite')
+        cache.load(self.files[0], 100)
+        producer = self._producer(cache=cache)
+        with mock.patch.object(thumbnail_jobs, 'get_thumbnail') as get_thumbnail:
+            producer.request(self.files[:1])
+            _run(producer)
+            get_thumbnail.assert_not_called()
+        self.assertEqual([(kind, file) for kind, file, _ in self.received], [('thumbnail', self.files[0])])
+        producer.shutdown()
+        cache.close()
+
+    def test_cancel(self):
+        release = threading.Event()
+
+        def slow_thumbnail(file, size, cache):
+            release.wait(5)
+            return thumbnail_jobs.kind_none, None
+
+        producer = self._producer()
+        with mock.patch.object(thumbnail_jobs, '_produce_thumbnail', slow_thumbnail):
+            producer.request(self.files, previews=[])
+            time.sleep(0.05)
+            producer.cancel()
+            self.assertFalse(producer.is_running)
+            release.set()
+            loop = QEventLoop()
+            QTimer.singleShot(100, loop.quit)
+            loop.exec_()
+        # Results of the running tasks are dropped
+        self.assertEqual(self.received, [])
+        producer.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,8 @@ class FaceDetectionModel(QObject):
     detection_model_changed = pyqtSignal(str)
     # Change of recognition model
     recognition_model_changed = pyqtSignal(str)
+    # Change of detection resolution
+    detection_max_size_changed = pyqtSignal(int)
     # Detection results for the file specified by main model
     detection_results_changed = pyqtSignal(list)
     # Selected detection result
@@ -17,8 +19,11 @@ class FaceDetectionModel(QObject):
         super(FaceDetectionModel, self).__init__()
         self._detection_model = detection_backend[0]
         self._recognition_model = face_recognition_model[0]
-        self._det_results = {}
+        self._detection_max_size = -1
+        self._det_results = []
         self.db = db
+        # Number of workers of the batch detection jobs (None: half of the cores)
+        self.workers = None
 
     @property
     def detection_model(self):
@@ -38,6 +43,15 @@ class FaceDetectionModel(QObject):
         self._recognition_model = value
         self.recognition_model_changed.emit(value)
 
+    @property
+    def detection_max_size(self):
+        return self._detection_max_size
+
+    @detection_max_size.setter
+    def detection_max_size(self, value: int):
+        self._detection_max_size = value
+        self.detection_max_size_changed.emit(value)
+
     @property
     def detection_results(self):
         return self._det_results
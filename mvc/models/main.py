@@ -1,11 +1,14 @@
 from pathlib import Path
-from typing import List, Set
+from typing import List, Set, Iterable, Tuple
 
 from PyQt5.QtCore import QObject, pyqtSignal
+from sortedcontainers import SortedList
 
 from common.comment import UserComment, TagEntity
 from common.constants import FILE_EXTENSION_MEDIA
 from common.db import TagDB
+from common.metadata_index import MetadataIndex
+from common.thumbnails import ThumbnailCache
 
 
 class MainModel(QObject):
@@ -17,18 +20,32 @@ class MainModel(QObject):
     selected_media_comment_updated = pyqtSignal(UserComment)
     # Change of directory path
     selected_dir_content_changed = pyqtSignal(Path)
+    # Files added to / removed from the current directory, sorted
+    files_added = pyqtSignal(list)
+    files_removed = pyqtSignal(list)
+    # Files of the current directory renamed: sorted list of (old path, new path)
+    files_renamed = pyqtSignal(list)
+    # Files of the current directory whose content has changed
+    files_modified = pyqtSignal(list)
     # Change of the content of the selected image (maybe it has been modified
     selected_file_content_changed = pyqtSignal(Path)
     # Addition of a tag
     tag_added = pyqtSignal(TagEntity)
+    # Files whose metadata has been (re)indexed, sorted
+    metadata_updated = pyqtSignal(list)
 
-    def __init__(self, db_tags=None):
+    def __init__(self, db_tags=None, thumbnails: ThumbnailCache = None, metadata: MetadataIndex = None):
         super(MainModel, self).__init__()
         self._dir_path: Path = None
         self._media_path: Path = None
         self._media_comment: UserComment = None
-        self._files: List[Path] = []
+        # Sorted index of the media files: O(log n) insertion, removal and position lookup
+        self._files: SortedList[Path] = SortedList()
         self._db_tags: TagDB = db_tags if db_tags else TagDB()
+        # On-disk thumbnail cache shared by the views, None: no caching
+        self.thumbnails: ThumbnailCache = thumbnails
+        # Metadata index queried by the views, None: metadata read from the files
+        self.metadata: MetadataIndex = metadata
 
     @property
     def dirpath(self) -> Path:
@@ -61,7 +78,7 @@ class MainModel(QObject):
         self.selected_media_comment_updated.emit(value)
 
     @property
-    def files(self) -> List[Path]:
+    def files(self) -> SortedList:
         return self._files
 
     @files.setter
@@ -71,13 +88,17 @@ class MainModel(QObject):
             return
         # Ensure same parent dir
         assert len(parents) == 1
-        dirpath = parents.pop()
+        self.set_dir_files(parents.pop(), [file for file in new_files if file.is_file()])
+
+    def set_dir_files(self, dirpath: Path, files: Iterable[Path]):
+        """
+        Set the directory and its files, already listed (media files are kept, they are not stat again)
+        """
         if dirpath != self.dirpath:
             self._dir_path = dirpath
             self.selected_dir_changed.emit(dirpath)
 
-        self._files = sorted([file for file in new_files if file.is_file() and
-                              file.suffix in FILE_EXTENSION_MEDIA])
+        self._files = SortedList(file for file in files if file.suffix in FILE_EXTENSION_MEDIA)
         self.selected_dir_content_changed.emit(self.dirpath)
 
     @property
@@ -92,18 +113,45 @@ class MainModel(QObject):
     def set_db_tags_path(self, dirpath: Path):
         self._db_tags = TagDB(dirpath=dirpath)
 
+    def index_of(self, file: Path) -> int:
+        """
+        :return: position of file in the files, -1 if not listed
+        """
+        idx = self._files.bisect_left(file)
+        return idx if idx < len(self._files) and self._files[idx] == file else -1
+
     def remove_files_from_list(self, files: Set[Path]):
-        temp = files.intersection(self._files)
-        for file in temp:
+        removed = [file for file in sorted(files) if file in self._files]
+        for file in removed:
             self._files.remove(file)
-        if len(temp) > 0:
-            self.selected_dir_content_changed.emit(self.dirpath)
+        if len(removed) > 0:
+            self.files_removed.emit(removed)
 
     def add_files_to_list(self, files: Set[Path]):
-        temp = files.union(self._files)
-        self._files = sorted([file for file in temp if file.is_file() and
-                            file.suffix in FILE_EXTENSION_MEDIA])
-        self.selected_dir_changed.emit(self.dirpath)
+        added = [file for file in sorted(files) if file.suffix in FILE_EXTENSION_MEDIA and file not in self._files
+                 and file.is_file()]
+        self._files.update(added)
+        if len(added) > 0:
+            self.files_added.emit(added)
+
+    def rename_files_in_list(self, renames: Iterable[Tuple[Path, Path]]):
+        renamed = []
+        for old, new in sorted(renames):
+            if old not in self._files or new in self._files or new.suffix not in FILE_EXTENSION_MEDIA:
+                continue
+            self._files.remove(old)
+            self._files.add(new)
+            renamed.append((old, new))
+        if len(renamed) > 0:
+            self.files_renamed.emit(renamed)
+
+    def set_files_modified(self, files: List[Path]):
+        files = sorted(file for file in files if file in self._files)
+        if len(files) > 0:
+            self.files_modified.emit(files)
+
+    def set_metadata_updated(self, files: List[Path]):
+        self.metadata_updated.emit(files)
 
     def update_selected_file_content(self):
         self.selected_file_content_changed.emit(self.media_path)
@@ -1,13 +1,14 @@
 from pathlib import Path
 
 from PyQt5 import QtWidgets, QtCore
-from PyQt5.QtCore import pyqtSlot, Qt
-from PyQt5.QtGui import QIcon, QPixmap
+from PyQt5.QtCore import pyqtSlot, Qt, QSize
+from PyQt5.QtGui import QIcon, QPixmap, QImage
 from PyQt5.QtWidgets import QWidget, QHBoxLayout, QAction, QMainWindow, QMessageBox, QFileDialog
 
 from common import exif
 from common.constants import FILE_EXTENSION_PHOTO_JPG
 from mvc.controllers.main import MainController
+from mvc.controllers.thumbnail_jobs import ThumbnailProducer
 from mvc.models.main import MainModel
 from mvc.views.gps import opacity_selected, opacity_unselected
 from mvc.views.gps.widgets import MyDraw, MyQTableWidgetItem
@@ -16,6 +17,8 @@ from pyqtlet2 import L, MapWidget
 from pyqtlet2.leaflet.core import Evented
 
 icon_path = Path(widgets.__file__).parent / "icons"
+# Size of the file thumbnails in the table
+thumbnail_size = 48
 
 
 class MainGPSWindow(QMainWindow):
@@ -23,6 +26,7 @@ class MainGPSWindow(QMainWindow):
     # This is a workaround for some issues with
     # "Registered new object after initialization, existing clients won't be notified!"
     def closeEvent(self, qcloseevent):
+        self._thumbnail_producer.shutdown()
         Evented.mapWidget = None
         qcloseevent.accept()
 
@@ -36,9 +40,16 @@ class MainGPSWindow(QMainWindow):
         self._controller.set_parent(self)
 
         # listen for model event signals
+        self._controller.metadata_writer.progress.connect(self.on_metadata_write_progress)
+        self._controller.metadata_writer.failed.connect(self.on_metadata_write_failed)
         self._model.selected_dir_changed.connect(self.on_dirpath_changed)
         self._model.selected_media_changed.connect(self.on_media_changed)
         self._model.selected_dir_content_changed.connect(self.on_dir_content_changed)
+        self._model.files_added.connect(self.on_files_added)
+        self._model.files_removed.connect(self.on_files_removed)
+        self._model.files_renamed.connect(self.on_files_renamed)
+        self._model.files_modified.connect(self.on_files_modified)
+        self._model.metadata_updated.connect(self.on_metadata_updated)
 
         # Main attributes
         self.setAttribute(Qt.WA_DeleteOnClose, True)
@@ -64,6 +75,12 @@ class MainGPSWindow(QMainWindow):
         self.gps_table.setMaximumWidth(150 + 120 + 120)
         self.gps_table.setColumnWidth(0, 150)
         self.gps_table.setSortingEnabled(True)
+        self.gps_table.setIconSize(QSize(thumbnail_size, thumbnail_size))
+
+        # Thumbnails of the table, produced in the background
+        self._thumbnail_producer = ThumbnailProducer(thumbnail_size, cache=self._model.thumbnails, parent=self)
+        self._thumbnail_producer.thumbnail_ready.connect(self.on_thumbnail_ready)
+        self._thumbnail_producer.preview_ready.connect(self.on_thumbnail_ready)
 
         # GPS widget
         self.gps_view = MapWidget(self.central_widget)
@@ -137,6 +154,8 @@ class MainGPSWindow(QMainWindow):
         self.selected_items = {}
 
     def _reset_state(self):
+        # Items are deleted with the table rows
+        self._thumbnail_producer.cancel()
         # Clear the table of results
         self.gps_table.setRowCount(0)
         # Remove all markers from the map
@@ -198,12 +217,42 @@ class MainGPSWindow(QMainWindow):
     def on_dir_content_changed(self, dirpath: Path):
         self.set_dirpath(dirpath)
 
+    @pyqtSlot(list)
+    def on_files_added(self, files):
+        self._add_items(files)
+        self._request_thumbnails()
+
+    @pyqtSlot(list)
+    def on_files_removed(self, files):
+        self._remove_items(files)
+
+    @pyqtSlot(list)
+    def on_files_renamed(self, renames):
+        self._remove_items([old for old, _ in renames])
+        self._add_items([new for _, new in renames])
+        self._request_thumbnails()
+
+    @pyqtSlot(list)
+    def on_files_modified(self, files):
+        self._update_lng_lat(files)
+        for file in files:
+            item = self.items_dic.get(file, None)
+            if item is not None:
+                # Produced again from the new content
+                item.setIcon(QIcon())
+        self._request_thumbnails()
+
+    @pyqtSlot(list)
+    def on_metadata_updated(self, files):
+        self._update_lng_lat(files)
+
     @pyqtSlot(Path)
     def on_media_changed(self, file: Path):
         if file is None:
             return
         # Center map on double cliked item
-        lng, lat = exif.get_lng_lat(file)
+        item = self.items_dic.get(file, None)
+        lng, lat = (item.lng, item.lat) if item is not None else (None, None)
         if lng and lat:
             for item in self.selected_items.values():
                 item.marker.setOpacity(self.opacity_unselected)
@@ -240,23 +289,15 @@ class MainGPSWindow(QMainWindow):
             file = self.gps_table.item(idx.row(), 0).file
             lng, lat = event['layer']['_latlng']['lng'], event['layer']['_latlng']['lat']
             self.items_dic[file].set_lng_lat(lng, lat, update_marker=True)
+            self.items_dic[file].dirty = True
             self.drawControl.featureGroup.addLayer(self.items_dic[file].marker)
 
     def set_dirpath(self, dirpath):
         self._reset_state()
         self.gps_table.blockSignals(True)
+        lng_lat = self._lng_lat(self._model.files)
         for file in self._model.files:
-            try:
-                if file.suffix not in FILE_EXTENSION_PHOTO_JPG:
-                    continue
-            except:
-                continue
-
-            lng, lat = exif.get_lng_lat(file)
-            item = MyQTableWidgetItem(file=file, map=self.map, lng=lng, lat=lat)
-            self.items_dic[file] = item
-            if item.marker:
-                self.drawControl.featureGroup.addLayer(item.marker)
+            self._create_item(file, lng_lat)
 
         # Show the results
         self._display_results_table()
@@ -265,6 +306,67 @@ class MainGPSWindow(QMainWindow):
         # Activate a selected imagepath changed
         self.on_media_changed(self._model.media_path)
 
+    def _lng_lat(self, files):
+        """
+        :return: {file: (lng, lat)} of the jpgs of files. From the metadata index if any: the files not indexed yet
+        are updated when the scanner has read them
+        """
+        files = [file for file in files if file.suffix in FILE_EXTENSION_PHOTO_JPG]
+        if self._model.metadata is None:
+            return {file: exif.get_lng_lat_from_exif(exif_dict) for file, exif_dict in exif.load_exifs(files)}
+        return {file: (metadata.lng, metadata.lat) for file, metadata in self._model.metadata.get_many(files).items()}
+
+    def _update_lng_lat(self, files):
+        # The coords set by the user and not saved yet are kept
+        files = [file for file in files if file in self.items_dic and not self.items_dic[file].dirty]
+        for file, (lng, lat) in self._lng_lat(files).items():
+            item = self.items_dic[file]
+            has_marker = item.marker is not None
+            item.set_lng_lat(lng, lat, update_marker=True)
+            if not has_marker and item.marker:
+                self.drawControl.featureGroup.addLayer(item.marker)
+
+    def _create_item(self, file: Path, lng_lat: dict):
+        if file.suffix not in FILE_EXTENSION_PHOTO_JPG or file in self.items_dic:
+            return None
+        lng, lat = lng_lat.get(file, (None, None))
+        item = MyQTableWidgetItem(file=file, map=self.map, lng=lng, lat=lat)
+        self.items_dic[file] = item
+        if item.marker:
+            self.drawControl.featureGroup.addLayer(item.marker)
+        return item
+
+    def _add_items(self, files):
+        # Rows appended to the table, the other rows are kept
+        self.gps_table.blockSignals(True)
+        self.gps_table.setSortingEnabled(False)
+        lng_lat = self._lng_lat(files)
+        for file in files:
+            item = self._create_item(file, lng_lat)
+            if item is None:
+                continue
+            row = self.gps_table.rowCount()
+            self.gps_table.insertRow(row)
+            self.gps_table.setItem(row, 0, item)
+            self.gps_table.setItem(row, 1, item.item_lng)
+            self.gps_table.setItem(row, 2, item.item_lat)
+        self.gps_table.setSortingEnabled(True)
+        self.gps_table.blockSignals(False)
+
+    def _remove_items(self, files):
+        for file in files:
+            item = self.items_dic.pop(file, None)
+            if item is None:
+                continue
+            self.selected_items.pop(file, None)
+            if item.marker:
+                self.drawControl.featureGroup.removeLayer(item.marker)
+            self.gps_table.removeRow(item.row())
+
+    def _request_thumbnails(self):
+        # Thumbnails not displayed yet
+        self._thumbnail_producer.request([file for file, item in self.items_dic.items() if item.icon().isNull()])
+
     # Set the results and display them
     def _display_results_table(self):
         # Clear the table of results
@@ -284,6 +386,12 @@ class MainGPSWindow(QMainWindow):
             self.gps_table.setItem(i, 2, item.item_lat)
         self.gps_table.setSortingEnabled(True)
         self.gps_table.repaint()
+        self._thumbnail_producer.request(list(self.items_dic.keys()))
+
+    def on_thumbnail_ready(self, file: Path, qimage: QImage):
+        item = self.items_dic.get(file, None)
+        if item is not None:
+            item.setIcon(QIcon(QPixmap.fromImage(qimage)))
 
     def _display_result_figure(self):
         self.is_set_view_init = False
@@ -295,5 +403,13 @@ class MainGPSWindow(QMainWindow):
                 self.is_set_view_init = True
 
     def save_gps(self):
+        # Written in the background, a single rewrite per file
         for item in self.items_dic.values():
-            item.save_gps()
+            item.save_gps(self._controller.exif_edits)
+        self._controller.flush_exif_edits()
+
+    def on_metadata_write_progress(self, done, total):
+        self.statusBar().showMessage(f"Metadata written: {done} / {total} files")
+
+    def on_metadata_write_failed(self, failed):
+        self.statusBar().showMessage(f"Cannot write the metadata of {len(failed)} files (see the log)")
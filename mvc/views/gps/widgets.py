@@ -4,7 +4,8 @@ from pathlib import Path
 from PyQt5.QtCore import QJsonValue
 from PyQt5.QtWidgets import QTableWidgetItem
 
-from common.exif import get_exif, set_geotagging, save_exif, get_lng_lat
+from common.exif import get_lng_lat
+from common.exif_edits import ExifEdits
 from mvc.views.gps import opacity_unselected
 from pyqtlet2.leaflet import Marker
 from pyqtlet2.leaflet.control import Draw
@@ -26,6 +27,8 @@ class MyQTableWidgetItem(QTableWidgetItem):
         self.item_lng = QTableWidgetItem()
         self.item_lat = QTableWidgetItem()
         self.marker = None
+        # Coords set by the user and not saved yet: not reloaded from the file
+        self.dirty = False
         self.set_lng_lat(lng, lat, True)
 
     def set_lng_lat(self, lng, lat, update_marker=True):
@@ -44,17 +47,19 @@ class MyQTableWidgetItem(QTableWidgetItem):
                     self.marker.moveend.connect(self.on_marker_move)
                     self.marker.move.connect(self.on_marker_move)
 
-    def save_gps(self):
+    def save_gps(self, edits: ExifEdits):
+        """
+        Add the coords to the pending exif edits, if changed
+        """
         file = self.file
+        self.dirty = False
         if self.lng and self.lat:
             lng, lat = get_lng_lat(file)
             # Avoid re-saving identical coords
             if lng == self.lng and lat == self.lat:
                 return
             logging.info(f'Saving exif GPS info to {file}')
-            exif = get_exif(file)
-            exif = set_geotagging(exif, self.lng, self.lat)
-            save_exif(exif, path=file)
+            edits.set_lng_lat(file, self.lng, self.lat)
 
     def on_marker_move(self, event: QJsonValue):
         if 'latlng' in event:
@@ -63,3 +68,4 @@ class MyQTableWidgetItem(QTableWidgetItem):
             lat, lng = event["latLng"]
 
         self.set_lng_lat(lng=lng, lat=lat, update_marker=False)
+        self.dirty = True
@@ -4,13 +4,14 @@ from pathlib import Path
 
 from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtCore import QEvent
-from PyQt5.QtGui import QPalette
+from PyQt5.QtGui import QPalette, QIcon
 from PyQt5.QtWidgets import QMainWindow, QStatusBar, QTableWidgetItem, QHBoxLayout, QLabel, QLineEdit, QCompleter, \
-    QPushButton
+    QPushButton, QProgressBar
 
 import common.face as api
-from common.comment import PersonEntity, ImageUserComment
+from common.comment import PersonEntity
 from common.face import DetectionResult
+from common.thumbnails import get_thumbnail
 from common.utils import pixmap_from_frame
 from mvc.controllers.face import FaceDetectionController
 from mvc.controllers.main import MainController
@@ -27,6 +28,8 @@ idx_col_filename = 0
 idx_col_name = 1
 idx_col_faction_save_img = 2
 idx_col_faction_save_db = 3
+# Size of the file thumbnails in the table
+thumbnail_size = 48
 
 
 class FaceEditorBatchWindow(QMainWindow):
@@ -65,6 +68,7 @@ class FaceEditorBatchWindow(QMainWindow):
 
         self.table_result.horizontalHeader().setVisible(True)
         self.table_result.setSortingEnabled(True)
+        self.table_result.setIconSize(QtCore.QSize(thumbnail_size, thumbnail_size))
         self.table_result.horizontalHeader().setCascadingSectionResizes(True)
         self.table_result.horizontalHeader().setSortIndicatorShown(True)
         self.table_result.verticalHeader().setCascadingSectionResizes(True)
@@ -89,48 +93,110 @@ class FaceEditorBatchWindow(QMainWindow):
         self.setStatusBar(QStatusBar())
         self.setVisible(False)
 
+        # Progress of the detection job
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximumWidth(200)
+        self.btn_cancel = QPushButton('Cancel', self)
+        self.btn_cancel.clicked.connect(self.cancel_detection)
+        self.btn_resume = QPushButton('Resume', self)
+        self.btn_resume.clicked.connect(self.resume_detection)
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        self.statusBar().addPermanentWidget(self.btn_cancel)
+        self.statusBar().addPermanentWidget(self.btn_resume)
+        self._set_job_buttons(running=False, resumable=False)
+
         # Files
-        self.results = {}
+        self.results = []
+        self.job = None
 
     def detect_faces(self, files: list[Path]):
+        # Previous job and results are dropped
+        if self.job is not None:
+            self.job.cancel()
         self.results = []
+        self.table_result.setRowCount(0)
 
-        # Detect
-        for file in files:
-            temp = api.face_recognition(path=file,
-                                        detection_model=self._model_local.detection_model,
-                                        recognition_model=self._model_local.recognition_model,
-                                        db=self._model_local.db)
-            self.results += temp
-
-        # Display
-        self.table_result.setRowCount(len(self.results))
-        for i, result in enumerate(self.results):
-            # Filename
-            self.table_result.setItem(i, idx_col_filename, QTableWidgetItem(result.file.name))
-
-            # Name
-            cell = MyQTableWidgetCell(result, self._model_local.db.known_face_names)
-            index = QtCore.QPersistentModelIndex(self.table_result.model().index(i, idx_col_name))
-            cell.returnPressed.connect(lambda *args, index=index: self.on_return_pressed(index))
-            self.table_result.setCellWidget(i, idx_col_name, cell)
-
-            # Action save to Image
-            btn = QPushButton('Save to Img', self)
-            index = QtCore.QPersistentModelIndex(self.table_result.model().index(i, idx_col_faction_save_img))
-            btn.clicked.connect(lambda *args, index=index: self.save_to_img(index))
-            btn.setEnabled(True)
-            self.table_result.setCellWidget(i, idx_col_faction_save_img, btn)
-
-            # Action save to DB
-            btn = QPushButton('Save to db', self)
-            index = QtCore.QPersistentModelIndex(
-                self.table_result.model().index(i, idx_col_faction_save_db))
-            btn.clicked.connect(lambda *args, index=index: self.save_to_db(index))
-            btn.setEnabled(True)
-            self.table_result.setCellWidget(i, idx_col_faction_save_db, btn)
-
-        self.table_result.repaint()
+        self.job = self._controller_local.create_detection_job(files, parent=self)
+        self.job.results_ready.connect(self.on_job_results_ready)
+        self.job.progress.connect(self.on_job_progress)
+        self.job.finished.connect(self.on_job_finished)
+        self.progress_bar.setRange(0, len(files))
+        self.progress_bar.setValue(0)
+        self._set_job_buttons(running=True, resumable=False)
+        self.job.start()
+
+    def cancel_detection(self):
+        if self.job is not None:
+            self.job.cancel()
+
+    def resume_detection(self):
+        if self.job is not None and not self.job.is_running:
+            self._set_job_buttons(running=True, resumable=False)
+            self.job.resume()
+
+    def _set_job_buttons(self, running, resumable):
+        self.btn_cancel.setEnabled(running)
+        self.btn_resume.setEnabled(resumable)
+
+    def on_job_results_ready(self, file: Path, results: list):
+        # Sorting would move the rows while they are being filled
+        self.table_result.setSortingEnabled(False)
+        for result in results:
+            self.results.append(result)
+            self._add_result_row(result)
+        self.table_result.setSortingEnabled(True)
+
+    def on_job_progress(self, done: int, total: int, eta: float):
+        self.progress_bar.setValue(done)
+        msg = f"Face detection: {done}/{total} files"
+        if eta >= 0:
+            msg += f" - {int(eta) // 60:d} min {int(eta) % 60:02d} s remaining"
+        self.statusBar().showMessage(msg)
+
+    def on_job_finished(self, cancelled: bool):
+        self._set_job_buttons(running=False, resumable=cancelled)
+        if cancelled:
+            self.statusBar().showMessage(f"Face detection cancelled: {len(self.job.remaining_files)} files remaining")
+        else:
+            msg = f"Face detection done: {len(self.results)} faces"
+            if len(self.job.failed) > 0:
+                msg += f", {len(self.job.failed)} files failed"
+            self.statusBar().showMessage(msg)
+
+    def closeEvent(self, event):
+        self.cancel_detection()
+        super(FaceEditorBatchWindow, self).closeEvent(event)
+
+    def _add_result_row(self, result: DetectionResult):
+        i = self.table_result.rowCount()
+        self.table_result.insertRow(i)
+        # Filename
+        item = QTableWidgetItem(result.file.name)
+        thumbnail = get_thumbnail(result.file, thumbnail_size, self._model.thumbnails)
+        if thumbnail is not None:
+            item.setIcon(QIcon(pixmap_from_frame(thumbnail)))
+        self.table_result.setItem(i, idx_col_filename, item)
+
+        # Name
+        cell = MyQTableWidgetCell(result, self._model_local.db.known_face_names)
+        index = QtCore.QPersistentModelIndex(self.table_result.model().index(i, idx_col_name))
+        cell.returnPressed.connect(lambda *args, index=index: self.on_return_pressed(index))
+        self.table_result.setCellWidget(i, idx_col_name, cell)
+
+        # Action save to Image
+        btn = QPushButton('Save to Img', self)
+        index = QtCore.QPersistentModelIndex(self.table_result.model().index(i, idx_col_faction_save_img))
+        btn.clicked.connect(lambda *args, index=index: self.save_to_img(index))
+        btn.setEnabled(True)
+        self.table_result.setCellWidget(i, idx_col_faction_save_img, btn)
+
+        # Action save to DB
+        btn = QPushButton('Save to db', self)
+        index = QtCore.QPersistentModelIndex(
+            self.table_result.model().index(i, idx_col_faction_save_db))
+        btn.clicked.connect(lambda *args, index=index: self.save_to_db(index))
+        btn.setEnabled(True)
+        self.table_result.setCellWidget(i, idx_col_faction_save_db, btn)
 
     def save_to_img(self, index):
         if index.isValid():
@@ -140,15 +206,16 @@ class FaceEditorBatchWindow(QMainWindow):
             result.name = cell.text()
 
             # Update the file comment
-            comment = ImageUserComment.load_from_file(result.file)
             entity = PersonEntity(name=result.name, location=result.location)
-            comment.add_entity(entity)
-
             if result.file == self._model.media_path:
+                comment = self._controller.load_media_comment(result.file)
+                comment.add_entity(entity)
                 self._controller.update_media_comment(comment)
                 self._controller.save_media_comment()
             else:
-                comment.save_comment(result.file)
+                # Coalesced with the other persons of the file not written yet
+                self._controller.exif_edits.add_entities(result.file, [entity])
+                self._controller.flush_exif_edits()
 
             # Turn the background green and deactivate button
             palette = QPalette()
@@ -190,6 +257,7 @@ class FaceEditorBatchWindow(QMainWindow):
                 btn.setPalette(palette)
                 btn.update()
                 btn.setEnabled(False)
+            self._model_local.db.save_db()
 
     def on_table_double_clicked(self, index):
         file = self.table_result.cellWidget(index.row(), idx_col_name).result.file
@@ -38,6 +38,8 @@ class PhotoEditorWindow(QMainWindow):
         self._controller_local = controller_local
 
         self.cumul_scale_factor = 1
+        # Background face detection
+        self._detection_job = None
 
         self.create_main_label()
         self.create_editing_bar()
@@ -337,6 +339,7 @@ class PhotoEditorWindow(QMainWindow):
         self.face_bar.setMinimumWidth(90)
 
         self.det_face_widget = FaceDetectionWidget(db=self._model_local.db)
+        self.det_face_widget.set_detection_max_size(self._model_local.detection_max_size)
         self.det_face_widget.result_widget.clicked.connect(self.on_det_res_widget_clicked)
         self.face_bar.setWidget(self.det_face_widget)
         self.addDockWidget(Qt.LeftDockWidgetArea, self.face_bar)
@@ -376,9 +379,12 @@ class PhotoEditorWindow(QMainWindow):
             self.det_face_widget.face_model_combobox.currentIndex())
         self._controller_local.set_detection_model(detection_model)
         self._controller_local.set_recognition_model(recognition_model)
+        self._controller_local.set_detection_max_size(self.det_face_widget.detection_max_size)
 
-        # Detect
-        self._controller_local.detect_faces([self._model.media_path])
+        # Detect in the background, a new request replaces the previous one
+        if self._detection_job is not None:
+            self._detection_job.cancel()
+        self._detection_job = self._controller_local.detect_faces_async([self._model.media_path], parent=self)
 
     def open_media(self, file: Path = None):
         """Load a new media"""
@@ -445,6 +451,8 @@ class PhotoEditorWindow(QMainWindow):
             if file:
                 self.media_widget.save_media(file=file)
                 self.media_widget.save_comment(self.comment_toolbar.get_user_comment(), file=file)
+                if self._model.metadata is not None:
+                    self._model.metadata.update(file)
                 # Save tags
                 tags = self.comment_toolbar.tags_widget.get_entities()
                 for tag in tags:
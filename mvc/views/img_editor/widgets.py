@@ -299,6 +299,10 @@ class FaceDetectionWidget(QtWidgets.QWidget):
         self.detection_model_combobox.addItems(common.face.detection_backend)
         self.face_model_combobox = QtWidgets.QComboBox()
         self.face_model_combobox.addItems(common.face.face_recognition_model)
+        # Resolution of the detection
+        self.detection_size_combobox = QtWidgets.QComboBox()
+        for size in common.face.detection_sizes:
+            self.detection_size_combobox.addItem("Full resolution" if size <= 0 else f"{size} px", size)
 
         # Search bar.
         self.searchbar = QLineEdit()
@@ -339,6 +343,8 @@ class FaceDetectionWidget(QtWidgets.QWidget):
         self.setLayout(vlay)
         vlay.addWidget(QLabel("Detection Backend"))
         vlay.addWidget(self.detection_model_combobox)
+        vlay.addWidget(QLabel("Detection Resolution"))
+        vlay.addWidget(self.detection_size_combobox)
         vlay.addWidget(QLabel("Face Recognition Model"))
         vlay.addWidget(self.face_model_combobox)
         vlay.addWidget(self.searchbar)
@@ -355,6 +361,17 @@ class FaceDetectionWidget(QtWidgets.QWidget):
     def set_file(self, file: Path):
         self.file = file
 
+    @property
+    def detection_max_size(self):
+        return self.detection_size_combobox.currentData()
+
+    def set_detection_max_size(self, max_size: int):
+        idx = self.detection_size_combobox.findData(max_size)
+        if idx == -1:
+            self.detection_size_combobox.addItem(f"{max_size} px", max_size)
+            idx = self.detection_size_combobox.count() - 1
+        self.detection_size_combobox.setCurrentIndex(idx)
+
     def update_display_when_searching(self, text):
         for i in range(self.list_db_tags_widget.count()):
             # item(row)->setHidden(!item(row)->text().contains(filter, Qt::CaseInsensitive));
@@ -397,6 +414,7 @@ class FaceDetectionWidget(QtWidgets.QWidget):
                 self.db.add_to_db(name=item.result.name, patch=item.result.patch, embedding=embedding,
                                   location=item.result.location, file=item.result.file, model=model, overwrite=True)
 
+        self.db.save_db()
         self.update_db_display()
 
     def eventFilter(self, source, event):
@@ -1,11 +1,13 @@
 from functools import partial
 from pathlib import Path
 
-from PyQt5.QtCore import pyqtSlot
-from PyQt5.QtWidgets import QMainWindow
+from PyQt5.QtCore import pyqtSlot, Qt, QTimer
+from PyQt5.QtWidgets import QApplication, QMainWindow, QDockWidget
 
 from common.constants import FILE_EXTENSION_PHOTO_JPG
 from common.db import FaceDetectionDB
+from common.face_matcher import FaceMatcher
+from common.metadata_index import parse_search_query
 from mvc.controllers.face import FaceDetectionController
 from mvc.controllers.main import MainController
 from mvc.models.face import FaceDetectionModel
@@ -15,12 +17,15 @@ from mvc.views.gps.view import MainGPSWindow
 from mvc.views.img_editor.face_batch import FaceEditorBatchWindow
 from mvc.views.img_editor.view import PhotoEditorWindow
 from mvc.views.mainview import gui
+from mvc.views.mainview.widgets import MediaSearchWidget
 from mvc.views.renamer import nameddic
 from mvc.views.renamer.view import MainRenamerWindow
 from mvc.views.tileview.view import MainTileWindow
 
 
 class MediaManagementView(QMainWindow, gui.Ui_MainWindow):
+    # Max number of files listed by the search
+    max_search_results = 1000
 
     def __init__(self, model: MainModel, controller: MainController, config: dict):
         super(self.__class__, self).__init__()
@@ -35,8 +40,16 @@ class MediaManagementView(QMainWindow, gui.Ui_MainWindow):
         db_face_folder = Path(self.config["DB_FACE_FOLDER"])
         self._model_face = FaceDetectionModel(db=FaceDetectionDB(db_face_folder))
         self._controller_face = FaceDetectionController(model=self._model_face)
+        config_face = self.config.get("FaceDetection", {})
+        self._model_face.workers = config_face.get("WORKERS", None)
+        self._model_face.detection_max_size = config_face.get("DETECTION_MAX_SIZE", -1)
+        self._model_face.db.matcher.mode = config_face.get("MATCHING", FaceMatcher.mode_samples)
+        self._model_face.db.matcher.ambiguity_margin = config_face.get("AMBIGUITY_MARGIN", 0.05)
+        if config_face.get("PRELOAD_MODELS", False):
+            self._controller_face.preload_models()
 
         self.setupUi(self)
+        QApplication.instance().aboutToQuit.connect(self.on_about_to_quit)
 
         # connect widgets to controller
         self.__class__.dropEvent = self._controller.update_dirpath
@@ -49,6 +62,22 @@ class MediaManagementView(QMainWindow, gui.Ui_MainWindow):
         self._model.selected_dir_changed.connect(self.on_dirpath_changed)
         self._model.selected_media_changed.connect(self.on_media_changed)
 
+        # Search over the tags / persons of the library, with the metadata index
+        self.search_widget = None
+        if self._model.metadata is not None:
+            self.search_widget = MediaSearchWidget()
+            self.search_widget.search_requested.connect(self.on_search_requested)
+            self.search_widget.file_activated.connect(self._controller.set_media_path)
+            self.search_dock = QDockWidget("Search", self)
+            self.search_dock.setWidget(self.search_widget)
+            self.addDockWidget(Qt.RightDockWidgetArea, self.search_dock)
+            # Names proposed by the search box, updated once the indexing calms down
+            self._search_names_timer = QTimer(self, singleShot=True, interval=2000)
+            self._search_names_timer.timeout.connect(self._update_search_names)
+            self._model.metadata_updated.connect(lambda files: self._search_names_timer.start())
+            self._update_search_names()
+            self._controller.crawl_library([Path(root) for root in self.config.get("LIBRARY_ROOTS", [])])
+
         # update exif button
         self.options = nameddic()
 
@@ -142,6 +171,12 @@ class MediaManagementView(QMainWindow, gui.Ui_MainWindow):
             self.win_batch_faces.destroyed.connect(_on_destroyed)
         self.win_batch_faces.show()
 
+    def on_about_to_quit(self):
+        # Pending exif edits and face index changes are written before leaving. Not on close: the other windows
+        # can still use the controller and the face db
+        self._controller.shutdown()
+        self._model_face.db.close()
+
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
             event.accept()
@@ -171,6 +206,15 @@ class MediaManagementView(QMainWindow, gui.Ui_MainWindow):
         if index.row() != -1:
             self.widget.listview.setCurrentIndex(index)
 
+    @pyqtSlot(str)
+    def on_search_requested(self, text):
+        tags, persons, names = parse_search_query(text)
+        files = self._model.metadata.search(tags=tags, persons=persons, names=names, limit=self.max_search_results)
+        self.search_widget.set_results(files, max_results=self.max_search_results)
+
+    def _update_search_names(self):
+        self.search_widget.set_names(list(self._model.metadata.names().keys()))
+
     @pyqtSlot()
     def on_selected_files_face_det(self):
         files = []
@@ -1,8 +1,8 @@
 from pathlib import Path
 
-from PyQt5.QtCore import pyqtSignal, QDir, QEvent
+from PyQt5.QtCore import pyqtSignal, QDir, QEvent, QTimer, Qt
 from PyQt5.QtWidgets import QWidget, QTreeView, QListView, QAbstractItemView, QHBoxLayout, QFileSystemModel, QMenu, \
-    QAction
+    QAction, QVBoxLayout, QLineEdit, QLabel, QListWidget, QListWidgetItem, QCompleter
 
 from common.constants import FILE_EXTENSION_MEDIA
 
@@ -57,3 +57,51 @@ class FileExplorerWidget(QWidget):
             menu.exec_(event.globalPos())
             return True
         return super().eventFilter(source, event)
+
+
+class MediaSearchWidget(QWidget):
+    """
+    Search box over the tags / persons of the library, and the list of the matching files
+    """
+    # Query typed, emitted once the typing is over
+    search_requested = pyqtSignal(str)
+    # Double click on a result
+    file_activated = pyqtSignal(Path)
+
+    def __init__(self, *args, **kwargs):
+        QWidget.__init__(self, *args, **kwargs)
+        vlay = QVBoxLayout(self)
+        self.line_edit = QLineEdit()
+        self.line_edit.setPlaceholderText('tag:beach person:"John Doe"')
+        self.line_edit.setClearButtonEnabled(True)
+        self.label = QLabel()
+        self.results = QListWidget()
+        self.results.setUniformItemSizes(True)
+        vlay.addWidget(self.line_edit)
+        vlay.addWidget(self.label)
+        vlay.addWidget(self.results)
+
+        # Coalesce the keystrokes
+        self._timer = QTimer(self, singleShot=True, interval=200)
+        self._timer.timeout.connect(lambda: self.search_requested.emit(self.line_edit.text()))
+        self.line_edit.textChanged.connect(self._timer.start)
+        self.line_edit.returnPressed.connect(self._timer.start)
+        self.results.itemDoubleClicked.connect(lambda item: self.file_activated.emit(item.data(Qt.UserRole)))
+
+    def set_names(self, names: list[str]):
+        """
+        Names proposed while typing
+        """
+        completer = QCompleter(names + [f"{prefix}:{name}" for prefix in ('tag', 'person') for name in names], self)
+        completer.setCaseSensitivity(Qt.CaseInsensitive)
+        self.line_edit.setCompleter(completer)
+
+    def set_results(self, files: list[Path], max_results: int = None):
+        self.results.clear()
+        for file in files:
+            item = QListWidgetItem(file.name)
+            item.setData(Qt.UserRole, file)
+            item.setToolTip(str(file))
+            self.results.addItem(item)
+        more = max_results is not None and len(files) >= max_results
+        self.label.setText(f"{len(files)}{'+' if more else ''} files" if self.line_edit.text() else '')
@@ -1,5 +1,5 @@
 from mvc.views.mainview.view_test import BaseTest
-from mvc.views.mainview.widgets import FileExplorerWidget
+from mvc.views.mainview.widgets import FileExplorerWidget, MediaSearchWidget
 
 
 class FileExplorerWidgetTest(BaseTest):
@@ -13,3 +13,20 @@ class FileExplorerWidgetTest(BaseTest):
     def test_set_dirpath(self):
         self.widget.set_dirpath(self.pics_folder)
         self.assertTrue(self.widget.fileModel.rowCount() > 0)
+
+
+class MediaSearchWidgetTest(BaseTest):
+    def setUp(self) -> None:
+        super(MediaSearchWidgetTest, self).setUp()
+        self.widget = MediaSearchWidget()
+
+    def test_set_results(self):
+        files = sorted(self.pics_folder.glob('*.jpg'))
+        activated = []
+        self.widget.file_activated.connect(activated.append)
+        self.widget.line_edit.setText('tag:tag1')
+        self.widget.set_results(files, max_results=len(files))
+        self.assertEqual(self.widget.results.count(), len(files))
+        self.assertEqual(self.widget.label.text(), f"{len(files)}+ files")
+        self.widget.results.itemDoubleClicked.emit(self.widget.results.item(0))
+        self.assertEqual(activated, files[:1])
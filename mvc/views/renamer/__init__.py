@@ -55,6 +55,8 @@ class ResultsRenaming(nameddic):
 
 
 class IRenamer(object):
+    # Metadata index queried instead of parsing the files, if any (common.metadata_index.MetadataIndex)
+    metadata_index = None
 
     def __init__(self, config: dict):
         self.create_backup = config
@@ -68,6 +70,24 @@ class IRenamer(object):
     def try_parse_build_filename(self, folderpath_or_list_files):
         raise NotImplementedError
 
+    def list_files(self, folderpath_or_list_files) -> list[Path]:
+        """
+        Files handled by this renamer, among the files of the folder or the list
+        """
+        if folderpath_or_list_files is None:
+            return []
+        if isinstance(folderpath_or_list_files, Path):
+            return list(folderpath_or_list_files.glob("*.*"))
+        return list(folderpath_or_list_files)
+
+    def iter_parse_build_filename(self, folderpath_or_list_files, max_workers=None):
+        """
+        Results of try_parse_build_filename one by one, as soon as they are built. The renamers able to stream
+        their results (e.g. reading the files in a pool of threads) override it, the others build all of them first.
+        Closing the generator stops the parsing
+        """
+        yield from self.try_parse_build_filename(folderpath_or_list_files).values()
+
     def try_rename_folder(self, folderpath_or_list_files):
         # 'filename' -> result
         results = ResultsRenaming()
@@ -1,5 +1,6 @@
 import abc
 import datetime
+import os
 import re
 
 from mvc.views.renamer.common import nameddic
@@ -23,6 +24,24 @@ class ResultParser(nameddic):
         # return str(self.year) + ':' + str(self.month).zfill(2) + ':' + str(self.day).zfill(2) + ' ' + str(self.hour).zfill(2) + ':' + str(self.minute).zfill(2) + ':' + str(self.second).zfill(2)
 
 
+# Literal, character class or escape: a single character of the string
+_re_fixed_char = re.compile(r'\[[^\]]*\]|\\.|[^\\\[\]()|*+?{}]')
+
+
+def _fixed_width(pattern):
+    # Characters matched by a pattern of literals, character classes and escapes, 0 if it has quantifiers, groups
+    # or alternatives
+    chars = _re_fixed_char.findall(pattern)
+    return len(chars) if sum(len(char) for char in chars) == len(pattern) else 0
+
+
+def _process_match(out, processors, result):
+    for name, parser in processors:
+        value = out.group(name)
+        if value is not None:
+            parser._process_string(value, result)
+
+
 class IParser(object):
 
     @classmethod
@@ -39,6 +58,16 @@ class ParserWithRegexSegments(IParser):
         self.ext = ext
         self.reg_segments = []
 
+    @property
+    def reg_segments(self):
+        return self._reg_segments
+
+    @reg_segments.setter
+    def reg_segments(self, reg_segments):
+        self._reg_segments = reg_segments
+        # Compiled again on the next match
+        self._compiled = None
+
     # recover from string relevant details and return false if cannot
     # result in dic format
     @abc.abstractmethod
@@ -54,41 +83,74 @@ class ParserWithRegexSegments(IParser):
                 out += '(' + seg.get_regex(do_grouping=False) + ')' if do_grouping else seg.get_regex(do_grouping=False)
         return out
 
-    def try_match(self, string, result=nameddic(), do_search_first=False):
-        out = re.match(self.get_regex(do_grouping=True), string=string)
-
-        is_ok = True
-        if (out is not None):
-            self._process_string(out.group(0), result)
-
-            for ind, seg in enumerate(self.reg_segments):
-                if isinstance(seg, ParserWithRegexSegments):
-                    if not seg.try_match(string=out.group(ind + 1), result=result):
-                        is_ok = False
-                        break
-
-        if (out is not None) and (is_ok):
-            return True
+    def compile(self):
+        """
+        Flatten the tree of segments into a single compiled regex, with a named group for each parser of the tree
+        processing its string: all the fields are extracted from a single match
+        :return: compiled regex, [(group name, parser)] in the order the parsers process their strings
+        """
+        if self._compiled is None:
+            processors = []
+            self._compiled = re.compile(self._flat_regex(processors)), processors
+        return self._compiled
+
+    def _flat_regex(self, processors):
+        name = None
+        # Parents process their string before their segments, as the nested matches did
+        if type(self)._process_string is not ParserWithRegexSegments._process_string:
+            name = f"p{len(processors)}"
+            processors.append((name, self))
+        out = ''
+        for seg in self.reg_segments:
+            if isinstance(seg, str):
+                out += '(?:' + seg + ')'
+            elif isinstance(seg, ParserWithRegexSegments):
+                out += seg._flat_regex(processors)
+        return f"(?P<{name}>{out})" if name is not None else f"(?:{out})"
 
-        # Return None if no
-        out = re.search(self.get_regex(do_grouping=True), string=string)
+    @property
+    def precision(self) -> int:
+        """
+        Number of characters fixed by the pattern (literals and character classes): the more precise parsers are
+        tried first
+        """
+        out = 0
+        for seg in self.reg_segments:
+            if isinstance(seg, str):
+                out += _fixed_width(seg)
+            elif isinstance(seg, ParserWithRegexSegments):
+                out += seg.precision
+        return out
 
-        if (out is None):
+    def try_match(self, string, result=nameddic(), do_search_first=False):
+        regex, processors = self.compile()
+        # Leftmost match: at the start of the string if any, else anywhere
+        out = regex.search(string)
+        if out is None:
             return False
-
-        self._process_string(out.group(0), result)
-
-        for ind, seg in enumerate(self.reg_segments):
-            if isinstance(seg, ParserWithRegexSegments):
-                if not seg.try_match(string=out.group(ind + 1), result=result):
-                    return False
+        _process_match(out, processors, result)
         return True
 
 
 class MetaParser(IParser):
+    """
+    Parsers tried on a filename in a single pass: the parsers of its extension (and the ones without extension) are
+    combined into a single regex, an alternative per parser ranked by precision. The leftmost match wins, and the
+    most precise parser among the ones matching at the same position.
+    """
     def __init__(self):
         self.parser_list = []
 
+    @property
+    def parser_list(self):
+        return self._parser_list
+
+    @parser_list.setter
+    def parser_list(self, parser_list):
+        self._parser_list = parser_list
+        # Compiled again on the next match
+        self._dispatch = None
+
     @classmethod
     def generate_parser(cls, config, file_extensions):
         # Get all the parsers under such name
@@ -97,15 +159,42 @@ class MetaParser(IParser):
         obj = cls()
         obj.parser_list = [parser_cls(file_extension) for parser_cls in parser_cls_list
                            for file_extension in file_extensions]
+        # Regexes compiled once, before the files are parsed
+        obj.compile()
         return obj
 
-    # TODO: Add a hierarchy notion especially for aprooximate search
-    # (if ne is less precise than the other,  better put him last)
+    @staticmethod
+    def _combine(parsers):
+        # Regex with an alternative per parser, and {alternative group name: processors of its parser}
+        if not parsers:
+            return None, {}
+        processors, alternatives, groups = [], [], {}
+        for i, parser in enumerate(parsers):
+            start = len(processors)
+            alternatives.append(f"(?P<m{i}>{parser._flat_regex(processors)})")
+            groups[f"m{i}"] = processors[start:]
+        return re.compile('|'.join(alternatives)), groups
+
+    def compile(self):
+        """
+        :return: {extension: (regex, groups)} of the parsers of each extension, (regex, groups) of the parsers
+        without extension for the other filenames
+        """
+        if self._dispatch is None:
+            # Stable: same precision, same order as the list
+            ranked = sorted(self.parser_list, key=lambda parser: parser.precision, reverse=True)
+            extensions = {parser.ext for parser in ranked if parser.ext is not None}
+            dispatch = {ext: self._combine([parser for parser in ranked if parser.ext in (ext, None)])
+                        for ext in extensions}
+            self._dispatch = dispatch, self._combine([parser for parser in ranked if parser.ext is None])
+        return self._dispatch
+
     def try_match(self, string, result=nameddic(), do_search_first=False):
-        for parser in self.parser_list:
-            tmp = nameddic()
-            if parser.try_match(string, result=tmp):
-                for key, value in tmp.items():
-                    result[key] = value
-                return True
-        return False
+        dispatch, others = self.compile()
+        regex, groups = dispatch.get(os.path.splitext(string)[1], others)
+        out = regex.search(string) if regex is not None else None
+        if out is None:
+            return False
+        # The outermost group closed last: the alternative of the parser matched
+        _process_match(out, groups[out.lastgroup], result)
+        return True
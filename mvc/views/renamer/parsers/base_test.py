@@ -0,0 +1,101 @@
+import re
+import unittest
+from unittest import mock
+
+import mvc.views.renamer.parsers as parsers
+import mvc.views.renamer.parsers.photo as photo_parsers
+from common import nameddic
+from common.constants import FILE_EXTENSION_PHOTO_JPG
+from mvc.views.renamer.parsers.base import MetaParser, ParserWithRegexSegments, ResultParser
+
+
+def _parse(parser, filename):
+    result = ResultParser()
+    if not parser.try_match(filename, result):
+        return None
+    return result.DateTimeOriginal.strftime('%Y%m%d_%H%M%S'), result.extra
+
+
+class ParserWithRegexSegmentsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        # Classes taken from their module: not registered again by the plugins loading
+        config = nameddic()
+        config.parser_cls_list = [photo_parsers.RegPic1, photo_parsers.RegPic2, photo_parsers.RegPic3,
+                                  photo_parsers.RegPic4, photo_parsers.RegPic5, photo_parsers.RegPicWhatsapp]
+        self.parser = MetaParser.generate_parser(config=config, file_extensions=FILE_EXTENSION_PHOTO_JPG)
+
+    def test_flattened(self):
+        regex, processors = photo_parsers.RegPic1('.jpg').compile()
+        self.assertIsInstance(regex, re.Pattern)
+        # One named group per field, in the order of the segments
+        self.assertEqual([type(parser) for _, parser in processors],
+                         [parsers.YearParser, parsers.MonthParser, parsers.DayParser,
+                          parsers.HourParser, parsers.MinParser, parsers.SecondParser])
+
+    def test_try_match(self):
+        self.assertEqual(_parse(self.parser, 'IMG_20210908_122743.jpg'), ('20210908_122743', ''))
+        self.assertEqual(_parse(self.parser, '20210908_122743_HDR.JPG'), ('20210908_122743', ''))
+        self.assertEqual(_parse(self.parser, 'Office Lens 20210908-122743.jpg'), ('20210908_122743', ''))
+        self.assertEqual(_parse(self.parser, 'IMG-20210908-WA0012.jpg'), ('20210908_000000', 'WA0012'))
+        # Anywhere in the name
+        self.assertEqual(_parse(self.parser, 'copy of 20210908_122743.jpg'), ('20210908_122743', ''))
+        self.assertIsNone(_parse(self.parser, 'lenna.jpg'))
+
+    def test_compiled_once(self):
+        # Compiled by generate_parser
+        with mock.patch.object(ParserWithRegexSegments, '_flat_regex') as flat_regex:
+            for _ in range(3):
+                _parse(self.parser, 'IMG_20210908_122743.jpg')
+            self.assertEqual(flat_regex.call_count, 0)
+
+    def test_segments_replaced(self):
+        parser = ParserWithRegexSegments(None)
+        parser.reg_segments = [parsers.YearMonthDayParser()]
+        self.assertEqual(_parse(parser, 'a_20210908'), ('20210908_000000', ''))
+        parser.reg_segments = [parsers.YearMonthDayParser(), '_', parsers.TimeParser()]
+        self.assertEqual(_parse(parser, 'a_20210908_122743'), ('20210908_122743', ''))
+
+
+
+def _parser(ext, reg_segments):
+    parser = ParserWithRegexSegments(ext)
+    parser.reg_segments = reg_segments + ([ext] if ext is not None else [])
+    return parser
+
+
+class MetaParserTest(unittest.TestCase):
+
+    def test_precision(self):
+        precisions = [parser_cls('.jpg').precision for parser_cls in [photo_parsers.RegPic1, photo_parsers.RegPic2,
+                                                                      photo_parsers.RegPic3]]
+        self.assertEqual(precisions, [23, 19, 27])
+        self.assertEqual(_parser(None, ['[0-9]+', '_']).precision, 1)
+
+    def test_ranked(self):
+        meta_parser = MetaParser()
+        # Both match at the start of the name: the most precise one wins whatever the order of the list
+        meta_parser.parser_list = [_parser(None, ['IMG_', parsers.YearMonthDayParser()]),
+                                   _parser(None, ['IMG_', parsers.YearMonthDayParser(), '_', parsers.TimeParser()])]
+        self.assertEqual(_parse(meta_parser, 'IMG_20210908_122743.jpg'), ('20210908_122743', ''))
+        # Leftmost match first
+        self.assertEqual(_parse(meta_parser, 'IMG_20210908_IMG_20200101_000000.jpg'), ('20210908_000000', ''))
+
+    def test_dispatch(self):
+        meta_parser = MetaParser()
+        meta_parser.parser_list = [_parser('.jpg', ['IMG_', parsers.YearMonthDayParser()]),
+                                   _parser('.mp4', ['VID_', parsers.YearMonthDayParser()]),
+                                   _parser(None, ['DSC_', parsers.YearMonthDayParser()])]
+        dispatch, _ = meta_parser.compile()
+        self.assertEqual(sorted(dispatch.keys()), ['.jpg', '.mp4'])
+        self.assertEqual(_parse(meta_parser, 'IMG_20210908.jpg'), ('20210908_000000', ''))
+        self.assertEqual(_parse(meta_parser, 'VID_20210908.mp4'), ('20210908_000000', ''))
+        self.assertIsNone(_parse(meta_parser, 'VID_20210908.jpg'))
+        # Parsers without extension: all the files
+        self.assertEqual(_parse(meta_parser, 'DSC_20210908.jpg'), ('20210908_000000', ''))
+        self.assertEqual(_parse(meta_parser, 'DSC_20210908.png'), ('20210908_000000', ''))
+        self.assertIsNone(_parse(meta_parser, 'IMG_20210908.png'))
+
+
+if __name__ == '__main__':
+    unittest.main()
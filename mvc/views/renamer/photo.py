@@ -1,21 +1,38 @@
 import datetime
-import io
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
 
-import piexif
-from PIL import Image
-
 import mvc.views.renamer.parsers.base
 from common import exif
+from common.exif_edits import ExifEdits
 from common.constants import FILE_EXTENSION_PHOTO_JPG
+from common.metadata_index import read_metadata
 from mvc.views.renamer import ClassWithTag, RenamerWithParser, MetaParser, ResultsRenaming, Result
 from mvc.views.renamer import parsers
 from mvc.views.renamer.common.status import StatusPhoto
 
 
+def _read_datetime(path: Path, read_back: bool):
+    # Datetime of the exif, read from the header of the file, and its metadata for the index if read_back
+    if read_back:
+        try:
+            metadata = read_metadata(path)
+        except Exception as e:
+            logging.warning(f"Cannot read {path}: {e}")
+            return None, None
+        return metadata.datetime_original, metadata
+    try:
+        return exif.get_datetime(exif.load_exif(path)), None
+    except Exception:
+        return None, None
+
+
 class RenamerPhoto(ClassWithTag, RenamerWithParser):
     tag = 'photo'
+    # Number of files read put at once in the metadata index
+    index_batch_size = 256
 
     def __init__(self,
                  parser,
@@ -29,51 +46,92 @@ class RenamerPhoto(ClassWithTag, RenamerWithParser):
                                             file_extensions=file_extensions)
         return RenamerPhoto(parser=parser)
 
+    def list_files(self, folderpath_or_list_files) -> list[Path]:
+        # Skip if not the right extension
+        return [path for path in super(RenamerPhoto, self).list_files(folderpath_or_list_files)
+                if path.suffix in FILE_EXTENSION_PHOTO_JPG]
+
     # Build the list of files based on this renamer rules
     def try_parse_build_filename(self, folderpath_or_list_files):
 
         # 'filename' -> result
         results = ResultsRenaming()
-        if folderpath_or_list_files is None:
-            return results
-
-        # Now get the generator
-        if isinstance(folderpath_or_list_files, Path):
-            generator = folderpath_or_list_files.glob("*.*")
-        else:
-            generator = folderpath_or_list_files
-
-        for path in generator:
-            # Skip if not the right extension
-            if path.suffix not in FILE_EXTENSION_PHOTO_JPG: continue
-
-            # Datetime from exif
-            try:
-                metadata = piexif.load(str(path))
-                datetime_from_exif = exif.get_datetime(metadata)
-            except:
-                datetime_from_exif = None
-
-            # Datetime from filename
-            datetime_from_filename = None
-            result_parser = mvc.views.renamer.parsers.base.ResultParser()
-            if self.parser.try_match(path.name, result_parser, do_search_first=False):
-                datetime_from_filename = result_parser.DateTimeOriginal
-
-            result_parser.datetime_from_exif = datetime_from_exif
-            result_parser.datetime_from_filename = datetime_from_filename
-
-            filename_dst, status_out = self.build_filename(path.name, result_parser)
-            results[path.name] = Result(dirpath=path.parent,
-                                        filename_src=path.name,
-                                        filename_dst=filename_dst,
-                                        status=status_out)
-
-            logging.info(path.name + '|' + str(datetime_from_exif) + '|' + str(datetime_from_filename) + '|' + str(
-                datetime_from_filename) + '|')
-
+        paths = self.list_files(folderpath_or_list_files)
+        built = {result.filename_src: result for result in self.iter_parse_build_filename(paths)}
+        # In the order of the files
+        for path in paths:
+            results[path.name] = built[path.name]
         return results
 
+    def iter_parse_build_filename(self, folderpath_or_list_files, max_workers=None):
+        """
+        Results of the files as soon as they are built: first the files up to date in the metadata index, then
+        the others, whose exif header is read in a pool of threads (the files read are indexed). Only a few reads
+        per worker are queued at once, closing the generator drops the others
+        """
+        paths = self.list_files(folderpath_or_list_files)
+        index = self.metadata_index
+        # A single query per directory for the files already indexed
+        indexed = index.get_many(paths) if index is not None else {}
+        for path in paths:
+            if path in indexed:
+                yield self.parse_build_file(path, indexed[path].datetime_original)
+
+        files = iter([path for path in paths if path not in indexed])
+        # I/O bound: more threads than cores
+        max_workers = max_workers if max_workers else max(1, min(8, 2 * (os.cpu_count() or 1)))
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        pending = {}
+        read = []
+        try:
+            while True:
+                while len(pending) < 2 * max_workers:
+                    path = next(files, None)
+                    if path is None:
+                        break
+                    pending[executor.submit(_read_datetime, path, index is not None)] = path
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    datetime_from_exif, metadata = future.result()
+                    if metadata is not None:
+                        read.append(metadata)
+                    yield self.parse_build_file(path, datetime_from_exif)
+                if len(read) >= self.index_batch_size:
+                    index.put_many(read)
+                    read = []
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            if read:
+                index.put_many(read)
+
+    def parse_build_file(self, path: Path, datetime_from_exif: datetime.datetime = None) -> Result:
+        """
+        Result of a file, from the datetime of its exif and the one parsed from its name
+        """
+        # Datetime from filename
+        datetime_from_filename = None
+        result_parser = mvc.views.renamer.parsers.base.ResultParser()
+        if self.parser.try_match(path.name, result_parser, do_search_first=False):
+            datetime_from_filename = result_parser.DateTimeOriginal
+
+        result_parser.datetime_from_exif = datetime_from_exif
+        result_parser.datetime_from_filename = datetime_from_filename
+
+        filename_dst, status_out = self.build_filename(path.name, result_parser)
+        result = Result(dirpath=path.parent,
+                        filename_src=path.name,
+                        filename_dst=filename_dst,
+                        status=status_out)
+        # Compared to the date of the new name by rename_all
+        result.datetime_from_exif = datetime_from_exif
+
+        logging.info(path.name + '|' + str(datetime_from_exif) + '|' + str(datetime_from_filename) + '|' + str(
+            datetime_from_filename) + '|')
+        return result
+
     def rename_all(self, results_to_rename,
                    create_backup, backup_foldername, delete_duplicate=True, options=None):
         results = super(RenamerPhoto, self).rename_all(results_to_rename=results_to_rename,
@@ -87,58 +145,25 @@ class RenamerPhoto(ClassWithTag, RenamerWithParser):
 
         # Time to input the new date in exif if applicable
         # Only applicable if filename_out is either built from datetime_in or datetime_out
+        # The new dates are written at once, in a pool of threads
+        edits = ExifEdits()
+        # The regex is compiled once for all the files
+        regex = mvc.views.renamer.parsers.base.ParserWithRegexSegments(None)
+        regex.reg_segments = [parsers.YearMonthDayParser(), '_', parsers.TimeParser()]
         for filename_out, result in results.items():
             file = Path(filename_out)
 
             # Try to reparse the filename and see if we get a date different from exif.
             # If so change exif
             out = mvc.views.renamer.parsers.base.ResultParser()
-            regex = mvc.views.renamer.parsers.base.ParserWithRegexSegments(file.suffix)
-            regex.reg_segments = [parsers.YearMonthDayParser(), '_', parsers.TimeParser()]
             datetime_name_test = None
             if regex.try_match(file.stem, out, do_search_first=True):
                 datetime_name_test = out.DateTimeOriginal
             if (datetime_name_test is not None) and (result.datetime_from_exif != datetime_name_test):
                 folderpath = result.dirpath
-                self._write_datetime_to_exif(folderpath / filename_out, datetime_name_test)
-
-    def _write_datetime_to_exif(self, filepath: Path, datetime_new):
-        logging.info(f"Loading  {filepath} ...")
-        try:
-            exif_dict = exif.get_exif(filepath)
-            exif_dict["0th"][piexif.ImageIFD.DateTime] = datetime.datetime.strftime(datetime_new, '%Y:%m:%d %H:%M:%S')
-        except KeyError:
-            o = io.BytesIO()
-            thumb_im = Image.open(filepath)
-            thumb_im.thumbnail((50, 50), Image.ANTIALIAS)
-            thumb_im.save(o, "jpeg")
-            thumbnail = o.getvalue()
-
-            zeroth_ifd = {piexif.ImageIFD.Make: u"unknown",
-                          piexif.ImageIFD.XResolution: (96, 1),
-                          piexif.ImageIFD.YResolution: (96, 1),
-                          piexif.ImageIFD.Software: u"piexif",
-                          piexif.ImageIFD.DateTime: datetime.datetime.strftime(datetime_new, '%Y:%m:%d %H:%M:%S')
-                          }
-
-            exif_ifd = {piexif.ExifIFD.DateTimeOriginal: datetime.datetime.strftime(datetime_new, '%Y:%m:%d %H:%M:%S'),
-                        piexif.ExifIFD.LensMake: u"LensMake",
-                        piexif.ExifIFD.Sharpness: 65535,
-                        piexif.ExifIFD.LensSpecification: ((1, 1), (1, 1), (1, 1), (1, 1)),
-                        }
-            gps_ifd = {piexif.GPSIFD.GPSVersionID: (2, 0, 0, 0),
-                       piexif.GPSIFD.GPSAltitudeRef: 1,
-                       piexif.GPSIFD.GPSDateStamp: datetime.datetime.strftime(datetime_new, '%Y:%m:%d %H:%M:%S'),
-                       }
-            first_ifd = {piexif.ImageIFD.Make: u"unknown",
-                         piexif.ImageIFD.XResolution: (40, 1),
-                         piexif.ImageIFD.YResolution: (40, 1),
-                         piexif.ImageIFD.Software: u"piexif"
-                         }
-
-            exif_dict = {"0th": zeroth_ifd, "Exif": exif_ifd, "GPS": gps_ifd, "1st": first_ifd, "thumbnail": thumbnail}
-
-        exif.save_exif(exif_dict=exif_dict, path=filepath)
+                logging.info(f"Updating the datetime of {folderpath / filename_out} ...")
+                edits.set_datetime(folderpath / filename_out, datetime_name_test)
+        edits.flush()
 
     def _is_timedelta_ok(self, time1, time2):
         return abs(time1 - time2) <= self.timedelta_max
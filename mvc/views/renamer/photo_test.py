@@ -1,10 +1,14 @@
+import datetime
 import shutil
 import tempfile
 import unittest
 from pathlib import Path
 
+from PIL import Image
+
 import resources.test_pics as test_pics
-from common import nameddic
+from common import exif, nameddic
+from common.metadata_index import MetadataIndex
 from common.constants import FILE_EXTENSION_PHOTO_JPG
 from mvc.views.renamer import MetaParser
 from mvc.views.renamer.common.status import StatusPhoto
@@ -107,6 +111,59 @@ class RenamerPhotoTest(unittest.TestCase):
         finally:
             self._delete_temp()
 
+    def test_try_parse_build_filename_metadata_index(self):
+        self.init()
+        index = MetadataIndex(self.out_dir / 'metadata.sqlite')
+        try:
+            self.renamer.metadata_index = index
+            for _ in range(2):
+                results = self.renamer.try_parse_build_filename([self.file_to_rename])
+                self.assertEqual(results[self.file_to_rename.name].filename_dst, self.file_renamed.name)
+                self.assertEqual(results[self.file_to_rename.name].status, StatusPhoto.exif_only)
+            self.assertIsNotNone(index.get(self.file_to_rename))
+        finally:
+            index.close()
+            self._delete_temp()
+
+    def test_iter_parse_build_filename(self):
+        self.init()
+        index = MetadataIndex(self.out_dir / 'metadata.sqlite')
+        try:
+            self.renamer.metadata_index = index
+            index.load_many([self.file_renamed])
+            files = [self.file_to_rename, self.file_renamed, self.file_to_rename_upper_case, self.out_dir / 'test.txt']
+            results = list(self.renamer.iter_parse_build_filename(files, max_workers=2))
+            # The file indexed first, the others as they are read, and indexed
+            self.assertEqual(results[0].filename_src, self.file_renamed.name)
+            self.assertEqual(sorted(result.filename_src for result in results[1:]),
+                             sorted([self.file_to_rename.name, self.file_to_rename_upper_case.name]))
+            self.assertTrue(all(result.filename_dst == self.file_renamed.name for result in results))
+            self.assertEqual(len(index.get_many(files)), 3)
+
+            # All indexed now, in order. Stopped early
+            generator = self.renamer.iter_parse_build_filename(files, max_workers=1)
+            self.assertEqual(next(generator).filename_src, self.file_to_rename.name)
+            generator.close()
+        finally:
+            index.close()
+            self._delete_temp()
+
+    def test_rename_all_update_exif(self):
+        out_dir = Path(tempfile.mkdtemp())
+        try:
+            # No exif: dated by its name, written to the exif once renamed
+            file = out_dir / 'IMG_20200102_030405.jpg'
+            Image.new('RGB', (16, 16)).save(file)
+            options = nameddic()
+            options.update_exif = True
+            results = self.renamer.try_parse_build_filename([file])
+            self.renamer.rename_all(results_to_rename=results, create_backup=False, backup_foldername=None,
+                                    options=options)
+            file_renamed = out_dir / '20200102_030405.jpg'
+            self.assertEqual(exif.get_datetime(exif.get_exif(file_renamed)), datetime.datetime(2020, 1, 2, 3, 4, 5))
+        finally:
+            shutil.rmtree(out_dir)
+
     def test_rename_all_exif_only(self):
         self.init()
         try:
@@ -3,13 +3,14 @@ from functools import partial
 from pathlib import Path
 
 from PyQt5.QtCore import pyqtSlot, Qt
-from PyQt5.QtWidgets import QMainWindow, QFileDialog, QTableWidgetItem
+from PyQt5.QtWidgets import QMainWindow, QFileDialog, QTableWidgetItem, QPushButton
 
 from common.constants import FILE_EXTENSION_PHOTO_JPG, FILE_EXTENSION_PHOTO_HEIF, FILE_EXTENSION_VIDEO
 from mvc.controllers.main import MainController
+from mvc.controllers.renamer_jobs import RenamerScanJob
 from mvc.models.main import MainModel
 from mvc.views import renamer
-from mvc.views.renamer import gui as renamer_ui
+from mvc.views.renamer import gui as renamer_ui, ResultsRenaming
 from mvc.views.renamer.common import nameddic
 from mvc.views.renamer.parsers import load_plugins, REPO_PARSERS
 
@@ -38,6 +39,9 @@ class MainRenamerWindow(QMainWindow, renamer_ui.Ui_MainWindow):
         # listen for model event signals
         self._model.selected_dir_changed.connect(self.on_dirpath_changed)
         self._model.selected_dir_content_changed.connect(self.on_dir_content_changed)
+        self._model.files_added.connect(lambda files: self.on_dir_content_changed())
+        self._model.files_removed.connect(lambda files: self.on_dir_content_changed())
+        self._model.files_renamed.connect(lambda renames: self.on_dir_content_changed())
 
         # Load the different parsers in a plugin way.
         load_plugins(parent_module_name='mvc.views.renamer.parsers')
@@ -83,6 +87,12 @@ class MainRenamerWindow(QMainWindow, renamer_ui.Ui_MainWindow):
         # The dictionary containing the list of results
         self.results = renamer.ResultsRenaming()
         self.renamer = None
+        # Results built in the background and shown as they arrive
+        self.scan_job: RenamerScanJob = None
+        self.pushButton_cancelScan = QPushButton("Cancel", self)
+        self.pushButton_cancelScan.clicked.connect(self.cancel_scan)
+        self.pushButton_cancelScan.setVisible(False)
+        self.statusbar.addPermanentWidget(self.pushButton_cancelScan)
 
         # Connect the different buttons
         self.pushButton_openFolder.clicked.connect(self.openDir)
@@ -188,17 +198,24 @@ class MainRenamerWindow(QMainWindow, renamer_ui.Ui_MainWindow):
         # Set row and col counts
         if (results is None) or (len(results.values()) == 0):
             return
-        self.table_result.setRowCount(len(results))
+        self._append_results(results.items())
+
+    def _append_results(self, items):
+        # Rows added at the end of the table: no sorting while they are filled
+        self.table_result.setSortingEnabled(False)
+        row = self.table_result.rowCount()
+        self.table_result.setRowCount(row + len(items))
         self.table_result.setColumnCount(3)
 
         # Populate the table
-        for i, (filename_in, result) in enumerate(results.items()):
+        for i, (filename_in, result) in enumerate(items, start=row):
             item = QTableWidgetItem(filename_in)
             self.table_result.setItem(i, 0, item)
             item = QTableWidgetItem(result.filename_dst)
             self.table_result.setItem(i, 1, item)
             item = QTableWidgetItem(result.status)
             self.table_result.setItem(i, 2, item)
+        self.table_result.setSortingEnabled(True)
 
     # Set the dir path
     def set_dirpath(self, dirpath: Path):
@@ -216,14 +233,49 @@ class MainRenamerWindow(QMainWindow, renamer_ui.Ui_MainWindow):
 
         renamer = renamer_generator.generate_renamer(config=config,
                                                      file_extensions=file_extensions_per_tag[tag])
-        results_parsing = renamer.try_parse_build_filename(folderpath_or_list_files=dirpath)
+        renamer.metadata_index = self._model.metadata
 
-        self.results = results_parsing
+        # The results of the previous scan are dropped
+        self.cancel_scan()
+        if self.scan_job is not None:
+            self.scan_job.deleteLater()
+        self.results = ResultsRenaming()
         self.renamer = renamer
-        # Show the results
-        self.show_results(results_parsing)
-        # Show the checkboxes
-        self.show_checkboxes()
+        self.show_results(None)
+        # Results shown as they are built
+        self.scan_job = RenamerScanJob(renamer, renamer.list_files(dirpath), parent=self)
+        self.scan_job.results.connect(self.on_scan_results)
+        self.scan_job.progress.connect(self.on_scan_progress)
+        self.scan_job.finished.connect(self.on_scan_finished)
+        self.pushButton_cancelScan.setVisible(True)
+        self.scan_job.start()
+
+    def cancel_scan(self):
+        if self.scan_job is not None:
+            self.scan_job.cancel()
+
+    def on_scan_results(self, results: list):
+        items = [(result.filename_src, result) for result in results]
+        for filename, result in items:
+            self.results[filename] = result
+        # Shown unless filtered out
+        if self.checkBox_all.isChecked():
+            self._append_results(items)
+
+    def on_scan_progress(self, done: int, total: int, throughput: float):
+        self.statusBar().showMessage(f"Reading the files: {done}/{total} - {throughput:.1f} files/s")
+
+    def on_scan_finished(self, cancelled: bool):
+        job = self.scan_job
+        self.pushButton_cancelScan.setVisible(False)
+        msg = f"{job.n_done} files{' (cancelled)' if cancelled else ''}"
+        self.statusBar().showMessage(msg + f" - {job.throughput:.1f} files/s")
+        # The rows are already shown
+        self.checkBox_all.setVisible(True)
+
+    def closeEvent(self, event):
+        self.cancel_scan()
+        super(MainRenamerWindow, self).closeEvent(event)
 
     def on_dir_content_changed(self):
         self.set_dirpath(self._model.dirpath)
@@ -240,6 +292,8 @@ class MainRenamerWindow(QMainWindow, renamer_ui.Ui_MainWindow):
     # Change the name
     def rename_list(self):
         logging.info('RENAMING')
+        # Only the files shown are renamed
+        self.cancel_scan()
         # We only rename file that are visible in the table AND
         # for which there is an output filename
         out = {}
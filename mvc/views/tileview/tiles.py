@@ -0,0 +1,322 @@
+import bisect
+from collections import OrderedDict
+from pathlib import Path
+
+from PyQt5 import QtCore, QtGui, QtWidgets
+from PyQt5.QtCore import Qt, QModelIndex, QSize, pyqtSignal
+
+from common.thumbnails import ThumbnailCache
+from mvc.controllers.thumbnail_jobs import ThumbnailProducer
+
+# Role giving the path of a tile
+PathRole = Qt.UserRole + 1
+
+
+class TileModel(QtCore.QAbstractListModel):
+    """
+    List of the media files of the tile view, sorted.
+
+    Thumbnails are only produced for the rows requested by the view (visible rows + prefetch margin) and kept
+    in a LRU cache of at most max_cached pixmaps, so the memory does not depend on the number of files.
+    They are produced off the GUI thread by a ThumbnailProducer, through the on-disk cache if any: first a
+    cheap preview (the small thumbnail embedded in the exif) so that the grid is quickly complete, then the
+    thumbnail replacing it.
+    """
+    # Thumbnail of the row now available
+    thumbnail_ready = pyqtSignal(int)
+
+    def __init__(self, thumbnail_size=800, max_cached=200, cache: ThumbnailCache = None, max_workers=None,
+                 parent=None):
+        super(TileModel, self).__init__(parent)
+        self.thumbnail_size = thumbnail_size
+        self.max_cached = max_cached
+        # Sorted: rows are found by bisection
+        self._files: list[Path] = []
+        # LRU {path: QPixmap}
+        self._thumbnails: OrderedDict[Path, QtGui.QPixmap] = OrderedDict()
+        # LRU {path: QPixmap} of the exif thumbnails, shown until the thumbnail is produced
+        self._previews: OrderedDict[Path, QtGui.QPixmap] = OrderedDict()
+        # Files whose thumbnail has to be produced, in priority order
+        self._requested: OrderedDict[Path, None] = OrderedDict()
+        # Files that could not be read
+        self._failed: set[Path] = set()
+
+        self.producer = ThumbnailProducer(thumbnail_size, cache=cache, max_workers=max_workers, parent=self)
+        self.producer.thumbnail_ready.connect(
+            lambda file, qimage: self.set_thumbnail(file, QtGui.QPixmap.fromImage(qimage)))
+        self.producer.preview_ready.connect(
+            lambda file, qimage: self.set_preview(file, QtGui.QPixmap.fromImage(qimage)))
+        self.producer.failed.connect(self.set_failed)
+        # Coalesce the requests of the painted rows
+        self._request_timer = QtCore.QTimer(self, singleShot=True, interval=0)
+        self._request_timer.timeout.connect(self._send_requests)
+
+    @property
+    def files(self):
+        return self._files
+
+    @property
+    def cache(self) -> ThumbnailCache:
+        return self.producer.cache
+
+    def set_files(self, files: list[Path]):
+        self.beginResetModel()
+        self.cancel()
+        self._files = sorted(files)
+        # Keep the thumbnails of the files still listed
+        for file in [file for file in self._thumbnails if self.row_of(file) == -1]:
+            del self._thumbnails[file]
+        self._previews.clear()
+        self._failed.clear()
+        self.endResetModel()
+
+    def insert_files(self, files: list[Path]):
+        """
+        Insert the rows of files, the other rows keep their thumbnail
+        """
+        for file in sorted(files):
+            row = bisect.bisect_left(self._files, file)
+            if row < len(self._files) and self._files[row] == file:
+                continue
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._files.insert(row, file)
+            self.endInsertRows()
+
+    def remove_files(self, files: list[Path]):
+        """
+        Remove the rows of files, the other rows keep their thumbnail
+        """
+        for file in files:
+            row = self.row_of(file)
+            if row == -1:
+                continue
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self._files[row]
+            self.endRemoveRows()
+            self._thumbnails.pop(file, None)
+            self._previews.pop(file, None)
+            self._requested.pop(file, None)
+            self._failed.discard(file)
+
+    def rename_files(self, renames: list[tuple[Path, Path]]):
+        """
+        Move the rows of the renamed files (old path, new path), with their thumbnail
+        """
+        for old, new in renames:
+            pixmap = self._thumbnails.get(old, None)
+            self.remove_files([old])
+            self.insert_files([new])
+            if pixmap is not None:
+                self._thumbnails[new] = pixmap
+
+    def row_of(self, file: Path):
+        row = bisect.bisect_left(self._files, file)
+        return row if row < len(self._files) and self._files[row] == file else -1
+
+    def file(self, row) -> Path:
+        return self._files[row]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._files)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._files):
+            return None
+        file = self._files[index.row()]
+        if role == Qt.DisplayRole:
+            return file.name
+        elif role == Qt.DecorationRole:
+            pixmap = self._thumbnails.get(file, None)
+            if pixmap is None:
+                if file not in self._failed and file not in self._requested:
+                    self._requested[file] = None
+                    self._request_timer.start()
+                return self._previews.get(file, None)
+            self._thumbnails.move_to_end(file)
+            return pixmap
+        elif role == Qt.ToolTipRole:
+            return str(file)
+        elif role == PathRole:
+            return file
+        return None
+
+    def request(self, rows):
+        """
+        Replace the pending requests by the thumbnails of rows (in priority order) not available yet
+        """
+        self._requested.clear()
+        for row in rows:
+            if 0 <= row < len(self._files):
+                file = self._files[row]
+                if file not in self._thumbnails and file not in self._failed:
+                    self._requested[file] = None
+        self._send_requests()
+
+    def _send_requests(self):
+        self._request_timer.stop()
+        files = list(self._requested)
+        self.producer.request(files, previews=[file for file in files if file not in self._previews])
+
+    def has_requests(self):
+        return self.producer.is_running
+
+    def cancel(self):
+        """
+        Drop the pending requests and the thumbnails being produced
+        """
+        self._request_timer.stop()
+        self._requested.clear()
+        self.producer.cancel()
+
+    def set_preview(self, file: Path, pixmap: QtGui.QPixmap):
+        row = self.row_of(file)
+        if row == -1 or file in self._thumbnails:
+            return
+        self._previews[file] = pixmap
+        self._previews.move_to_end(file)
+        # Small pixmaps: more of them are kept
+        while len(self._previews) > 4 * self.max_cached:
+            self._previews.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def set_thumbnail(self, file: Path, pixmap: QtGui.QPixmap):
+        row = self.row_of(file)
+        if row == -1:
+            return
+        self._thumbnails[file] = pixmap
+        self._thumbnails.move_to_end(file)
+        self._previews.pop(file, None)
+        self._requested.pop(file, None)
+        while len(self._thumbnails) > self.max_cached:
+            self._thumbnails.popitem(last=False)
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.DecorationRole])
+        self.thumbnail_ready.emit(row)
+
+    def set_failed(self, file: Path):
+        self._failed.add(file)
+        self._requested.pop(file, None)
+
+    def invalidate(self, file: Path):
+        """
+        Content of file has changed: its thumbnail is produced again when displayed
+        """
+        self._thumbnails.pop(file, None)
+        self._previews.pop(file, None)
+        self._requested.pop(file, None)
+        self._failed.discard(file)
+        row = self.row_of(file)
+        if row != -1:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+
+class TileDelegate(QtWidgets.QStyledItemDelegate):
+    """
+    Draw a tile: thumbnail fitted in the cell + file name below
+    """
+    margin = 4
+
+    def paint(self, painter, option, index):
+        painter.save()
+        if option.state & QtWidgets.QStyle.State_Selected:
+            painter.fillRect(option.rect, option.palette.highlight())
+
+        rect = option.rect.adjusted(self.margin, self.margin, -self.margin, -self.margin)
+        text_height = option.fontMetrics.height()
+        img_rect = rect.adjusted(0, 0, 0, -text_height - self.margin)
+
+        pixmap = index.data(Qt.DecorationRole)
+        if pixmap is not None and not pixmap.isNull():
+            size = pixmap.size().scaled(img_rect.size(), Qt.KeepAspectRatio)
+            target = QtCore.QRect(0, 0, size.width(), size.height())
+            target.moveCenter(img_rect.center())
+            painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, True)
+            painter.drawPixmap(target, pixmap)
+        else:
+            painter.fillRect(img_rect, option.palette.alternateBase())
+
+        text_rect = QtCore.QRect(rect.left(), rect.bottom() - text_height, rect.width(), text_height)
+        text = option.fontMetrics.elidedText(index.data(Qt.DisplayRole), Qt.ElideMiddle, text_rect.width())
+        painter.setPen(option.palette.highlightedText().color() if option.state & QtWidgets.QStyle.State_Selected
+                       else option.palette.text().color())
+        painter.drawText(text_rect, Qt.AlignCenter, text)
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        view = self.parent()
+        return view.gridSize() if view is not None else QSize(200, 170)
+
+
+class TileListView(QtWidgets.QListView):
+    """
+    Grid of tiles with max_col columns. Only the visible rows are painted, and the thumbnails of the visible rows
+    plus prefetch rows before / after are requested to the model.
+    """
+    # Rows to display, in priority order
+    visible_rows_changed = pyqtSignal(list)
+
+    def __init__(self, max_col=3, prefetch_rows=2, parent=None):
+        super(TileListView, self).__init__(parent)
+        self.max_col = max_col
+        self.prefetch_rows = prefetch_rows
+
+        self.setViewMode(QtWidgets.QListView.IconMode)
+        self.setMovement(QtWidgets.QListView.Static)
+        self.setResizeMode(QtWidgets.QListView.Adjust)
+        self.setWrapping(True)
+        self.setUniformItemSizes(True)
+        # Several tiles selected for the bulk operations
+        self.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.setVerticalScrollMode(QtWidgets.QAbstractItemView.ScrollPerPixel)
+        # A scrollbar showing up would change the width of the tiles, and the layout again
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn)
+        self.setItemDelegate(TileDelegate(self))
+
+        # Coalesce the scroll / resize events
+        self._visible_timer = QtCore.QTimer(self, singleShot=True, interval=0)
+        self._visible_timer.timeout.connect(self._emit_visible_rows)
+        self.verticalScrollBar().valueChanged.connect(lambda value: self._visible_timer.start())
+
+    def setModel(self, model):
+        super(TileListView, self).setModel(model)
+        model.modelReset.connect(self._visible_timer.start)
+
+    def update_grid_size(self):
+        width = max(50, (self.viewport().width() - 1) // self.max_col)
+        height = int(width * 3 / 4) + self.fontMetrics().height() + 3 * TileDelegate.margin
+        if self.gridSize() != QSize(width, height):
+            self.setGridSize(QSize(width, height))
+
+    def resizeEvent(self, event):
+        self.update_grid_size()
+        super(TileListView, self).resizeEvent(event)
+        self._visible_timer.start()
+
+    def selected_files(self) -> list[Path]:
+        """
+        Files of the selected tiles, sorted
+        """
+        return sorted(self.model().file(index.row()) for index in self.selectionModel().selectedIndexes())
+
+    def visible_rows(self):
+        """
+        :return: rows of the viewport first, then the prefetch rows after and before
+        """
+        model = self.model()
+        if model is None or model.rowCount() == 0:
+            return []
+        # Tiles of the first column at the top and bottom of the viewport. Below the last tile: end of the list
+        first = self.indexAt(QtCore.QPoint(1, 1))
+        last = self.indexAt(QtCore.QPoint(1, self.viewport().height() - 2))
+        first = first.row() if first.isValid() else 0
+        last = min(last.row() + self.max_col - 1, model.rowCount() - 1) if last.isValid() else model.rowCount() - 1
+        margin = self.prefetch_rows * self.max_col
+        rows = list(range(first, last + 1))
+        rows += list(range(last + 1, min(model.rowCount(), last + 1 + margin)))
+        rows += list(range(first - 1, max(-1, first - 1 - margin), -1))
+        return rows
+
+    def _emit_visible_rows(self):
+        self.visible_rows_changed.emit(self.visible_rows())
@@ -0,0 +1,156 @@
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from PyQt5.QtCore import Qt, QEventLoop, QTimer, QItemSelectionModel
+from PyQt5.QtWidgets import QApplication
+
+import resources.test_pics as test_pics
+from common.thumbnails_test import add_exif_thumbnail
+from mvc.views.tileview.tiles import TileModel, TileListView
+
+default_pics_folder = Path(test_pics.__file__).parent
+
+app = QApplication.instance() or QApplication(sys.argv)
+
+
+def _run(model, timeout=10000):
+    loop = QEventLoop()
+    model.producer.idle.connect(loop.quit)
+    QTimer.singleShot(timeout, loop.quit)
+    loop.exec_()
+
+
+class TileModelTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        self.files = sorted(default_pics_folder.glob('*.jpg'))
+        self.model = TileModel(thumbnail_size=100, max_cached=2)
+        self.model.set_files(self.files)
+
+    def tearDown(self) -> None:
+        self.model.producer.shutdown()
+        shutil.rmtree(self.out_dir)
+
+    def test_requested_thumbnails_only(self):
+        self.model.request([1])
+        _run(self.model)
+
+        pixmap = self.model.data(self.model.index(1), Qt.DecorationRole)
+        self.assertIsNotNone(pixmap)
+        self.assertLessEqual(max(pixmap.width(), pixmap.height()), 100)
+        self.assertEqual(list(self.model._thumbnails.keys()), [self.files[1]])
+
+    def test_painted_rows_requested(self):
+        self.assertIsNone(self.model.data(self.model.index(0), Qt.DecorationRole))
+        _run(self.model)
+        self.assertEqual(list(self.model._thumbnails.keys()), [self.files[0]])
+
+    def test_lru(self):
+        self.model.request(range(len(self.files)))
+        _run(self.model)
+        self.assertEqual(len(self.model._thumbnails), 2)
+
+    def test_exif_preview(self):
+        file = self.out_dir / 'test.jpg'
+        shutil.copy(self.files[0], file)
+        add_exif_thumbnail(file)
+        model = TileModel(thumbnail_size=400)
+        model.set_files([file])
+        previews = []
+        model.producer.preview_ready.connect(lambda *args: previews.append(model.data(model.index(0),
+                                                                                       Qt.DecorationRole)))
+        model.request([0])
+        _run(model)
+
+        # Preview first, then replaced by the thumbnail
+        self.assertEqual(len(previews), 1)
+        pixmap = model.data(model.index(0), Qt.DecorationRole)
+        self.assertEqual(max(pixmap.width(), pixmap.height()), 400)
+        self.assertEqual(len(model._previews), 0)
+        model.producer.shutdown()
+
+    def test_reset_cancels(self):
+        self.model.request(range(len(self.files)))
+        self.model.set_files([])
+        self.assertFalse(self.model.has_requests())
+        self.model.producer._on_timeout_collect()
+        self.assertEqual(len(self.model._thumbnails), 0)
+
+    def test_invalidate(self):
+        self.model.request([0])
+        _run(self.model)
+        self.model.invalidate(self.files[0])
+        self.assertIsNone(self.model.data(self.model.index(0), Qt.DecorationRole))
+        _run(self.model)
+        self.assertIn(self.files[0], self.model._thumbnails)
+
+    def test_insert_remove_keep_thumbnails(self):
+        self.model.request([0])
+        _run(self.model)
+        inserted = []
+        self.model.rowsInserted.connect(lambda parent, first, last: inserted.append(first))
+        new_file = default_pics_folder / '0.jpg'
+        self.model.insert_files([new_file, self.files[1]])
+        # Sorted position, already listed files are ignored
+        self.assertEqual(inserted, [0])
+        self.assertEqual(self.model.files, sorted(self.files + [new_file]))
+        self.assertIsNotNone(self.model.data(self.model.index(1), Qt.DecorationRole))
+
+        self.model.remove_files([new_file, self.files[1]])
+        self.assertEqual(self.model.files, self.files[:1] + self.files[2:])
+        self.assertEqual(self.model.row_of(self.files[1]), -1)
+        self.assertIn(self.files[0], self.model._thumbnails)
+
+    def test_rename_keeps_thumbnail(self):
+        self.model.request([0])
+        _run(self.model)
+        new_file = default_pics_folder / 'zzz.jpg'
+        self.model.rename_files([(self.files[0], new_file)])
+        self.assertEqual(self.model.files, self.files[1:] + [new_file])
+        self.assertIn(new_file, self.model._thumbnails)
+
+
+class TileListViewTest(unittest.TestCase):
+
+    def test_visible_rows(self):
+        files = [Path(f"/not_existing/{i}.jpg") for i in range(1000)]
+        model = TileModel()
+        model.set_files(files)
+        view = TileListView(max_col=4, prefetch_rows=1)
+        view.setModel(model)
+        view.resize(400, 300)
+        view.show()
+        app.processEvents()
+
+        rows = view.visible_rows()
+        # A few rows of 4 tiles + 1 prefetch row, not the whole list
+        self.assertEqual(rows[0], 0)
+        self.assertLess(len(rows), 40)
+        self.assertEqual(len(rows) % 4, 0)
+
+        view.scrollTo(model.index(500))
+        app.processEvents()
+        rows = view.visible_rows()
+        self.assertIn(500, rows)
+        self.assertLess(len(rows), 40)
+        # Scrolling coalesces the updates, it does not change the delay
+        self.assertEqual(view._visible_timer.interval(), 0)
+        view.close()
+
+    def test_selected_files(self):
+        files = [Path(f"/not_existing/{i}.jpg") for i in range(10)]
+        model = TileModel()
+        model.set_files(files)
+        view = TileListView(max_col=4)
+        view.setModel(model)
+        view.selectionModel().select(model.index(5), QItemSelectionModel.Select)
+        view.selectionModel().select(model.index(2), QItemSelectionModel.Select)
+        self.assertEqual(view.selected_files(), [files[2], files[5]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,18 +1,20 @@
-import copy
 from pathlib import Path
 
-from PyQt5 import QtCore, QtWidgets
+from PyQt5 import QtWidgets
 from PyQt5.QtCore import Qt
 from PyQt5.QtCore import pyqtSlot
 from PyQt5.QtGui import QGuiApplication
-from PyQt5.QtWidgets import QStatusBar, QHBoxLayout, QAction
+from PyQt5.QtWidgets import QStatusBar, QHBoxLayout, QAction, QMessageBox, QInputDialog
 
 import common.comment
-import common.exif
-from common.constants import FILE_EXTENSION_VIDEO, FILE_EXTENSION_PHOTO
+from common.comment import TagEntity
+from common.constants import FILE_EXTENSION_VIDEO, FILE_EXTENSION_PHOTO, FILE_EXTENSION_PHOTO_JPG
+from common.exif_edits import strip_thumbnail, strip_orientation, add_entities, shift_datetimes, parse_time_offset
 from mvc.controllers.main import MainController
+from mvc.controllers.metadata_jobs import ExifMaintenanceJob
 from mvc.models.main import MainModel
-from mvc.views.tileview.widgets import UserCommentWidget, ImageWidget, VideoWidget
+from mvc.views.tileview.tiles import TileModel, TileListView
+from mvc.views.tileview.widgets import UserCommentWidget
 
 
 class MainTileWindow(QtWidgets.QMainWindow):
@@ -30,27 +32,31 @@ class MainTileWindow(QtWidgets.QMainWindow):
         self._model.selected_dir_changed.connect(self.on_dirpath_changed)
         self._model.selected_media_changed.connect(self.on_selected_media_changed)
         self._model.selected_dir_content_changed.connect(self.on_watcher_dir_changed)
+        self._model.files_added.connect(self.on_files_added)
+        self._model.files_removed.connect(self.on_files_removed)
+        self._model.files_renamed.connect(self.on_files_renamed)
+        self._model.files_modified.connect(self.on_files_modified)
         self._model.selected_file_content_changed.connect(self.on_watcher_file_changed)
         self._model.selected_media_comment_updated.connect(self.on_model_comment_updated)
 
-        # Max col settings for the gridlayout
+        # Max col settings for the grid
         self.max_col = config["MAX_COL"] if config else 3
-        # Available position in the grid layout
-        self._col_idx = 0
-        self._row_idx = 0
-        # List of file to process (widget creation and placement)
-        self._files_to_process = None
-        # Path -> widget dict
-        self.media_widgets = {}
         # Current selected file
         self.file: Path = None
-
-        # Tiles widget
-        self.scrollArea = QtWidgets.QScrollArea(widgetResizable=True)
-        self.content_widget = QtWidgets.QWidget()
-        self.scrollArea.setWidget(self.content_widget)
-        self._layout = QtWidgets.QGridLayout()
-        self.content_widget.setLayout(self._layout)
+        # Bulk exif operation running
+        self.exif_job: ExifMaintenanceJob = None
+        self.exif_job_title = ''
+
+        # Tiles widget: only the visible tiles are materialized
+        self.tiles_model = TileModel(thumbnail_size=config["TILES_THUMBNAIL_SIZE"] if config else 800,
+                                     max_cached=config.get("TILES_MAX_CACHED", 200) if config else 200,
+                                     cache=self._model.thumbnails,
+                                     max_workers=config.get("TILES_WORKERS", None) if config else None,
+                                     parent=self)
+        self.tiles_view = TileListView(max_col=self.max_col)
+        self.tiles_view.setModel(self.tiles_model)
+        self.tiles_view.doubleClicked.connect(self.on_tile_double_clicked)
+        self.tiles_view.visible_rows_changed.connect(self.on_visible_rows_changed)
 
         # Side Comment widget
         self.comment_widget = UserCommentWidget()
@@ -58,29 +64,45 @@ class MainTileWindow(QtWidgets.QMainWindow):
 
         # Set the central Widget
         self.layout = QHBoxLayout()
-        self.layout.addWidget(self.scrollArea, 3)
+        self.layout.addWidget(self.tiles_view, 3)
         self.layout.addWidget(self.comment_widget, 1)
         self.central_widget = QtWidgets.QWidget()
         self.central_widget.setLayout(self.layout)
         self.setCentralWidget(self.central_widget)
 
-        # Timer for loading the images (avoid freeze)
-        self._timer = QtCore.QTimer(self, interval=1)
-        self._timer.timeout.connect(self.on_timeout_process_next_file)
-
         # Menu Actions
         self.save_user_comment = QAction("Save user comment / tags...", self)
         self.save_user_comment.setShortcut('Ctrl+S')
         self.save_user_comment.triggered.connect(self._save_user_comment)
+        # The bulk exif operations only apply to the selected pictures
+        self.select_all = QAction("Select all", self)
+        self.select_all.setShortcut('Ctrl+A')
+        self.select_all.triggered.connect(self.tiles_view.selectAll)
         self.delete_thumbnails = QAction("Delete embedded thumbnails...", self)
         self.delete_thumbnails.triggered.connect(self._delete_thumbnails)
+        self.delete_orientations = QAction("Delete orientation tags...", self)
+        self.delete_orientations.triggered.connect(self._delete_orientations)
+        self.add_tags = QAction("Add tags...", self)
+        self.add_tags.triggered.connect(self._add_tags)
+        self.shift_dates = QAction("Shift dates...", self)
+        self.shift_dates.triggered.connect(self._shift_dates)
+        self.cancel_exif_job = QAction("Cancel", self)
+        self.cancel_exif_job.triggered.connect(self._cancel_exif_job)
+        self.cancel_exif_job.setEnabled(False)
 
         # Menu bar
         menubar = self.menuBar()
         file_menu = menubar.addMenu('File')
         file_menu.addAction(self.save_user_comment)
+        edit_menu = menubar.addMenu('Edit')
+        edit_menu.addAction(self.select_all)
         tools_menu = menubar.addMenu("Tools")
         tools_menu.addAction(self.delete_thumbnails)
+        tools_menu.addAction(self.delete_orientations)
+        tools_menu.addAction(self.add_tags)
+        tools_menu.addAction(self.shift_dates)
+        tools_menu.addSeparator()
+        tools_menu.addAction(self.cancel_exif_job)
 
         # Initial window size
         self.resize(QGuiApplication.primaryScreen().availableSize() * 3 / 5)
@@ -91,51 +113,126 @@ class MainTileWindow(QtWidgets.QMainWindow):
         self._controller.update_media_comment(comment=comment)
         self._controller.save_media_comment()
 
+    def _exif_job_files(self, title):
+        # Pictures of the selected tiles
+        files = [file for file in self.tiles_view.selected_files() if file.suffix in FILE_EXTENSION_PHOTO_JPG]
+        if len(files) == 0:
+            QMessageBox.information(self, title, "No picture selected (Edit > Select all for the whole folder)")
+        return files
+
+    def _exif_job_scope(self, files):
+        if len(files) == 1:
+            return f"the picture {files[0].name}"
+        n_pictures = sum(file.suffix in FILE_EXTENSION_PHOTO_JPG for file in self._model.files)
+        if len(files) == n_pictures:
+            return f"all the {len(files)} pictures of {self._model.dirpath}"
+        return f"the {len(files)} selected pictures"
+
+    def _start_exif_job(self, title, edits, files):
+        if self.exif_job is not None and self.exif_job.is_running:
+            QMessageBox.information(self, title, f"{self.exif_job_title} is running")
+            return
+        self.exif_job_title = title
+        self.exif_job = self._controller.create_exif_job(files, edits, parent=self)
+        self.exif_job.progress.connect(self.on_exif_job_progress)
+        self.exif_job.finished.connect(self.on_exif_job_finished)
+        self.cancel_exif_job.setEnabled(True)
+        self.exif_job.start()
+
+    def _confirm_exif_job(self, title, question, files):
+        answer = QMessageBox.question(self, title, f"{question} of {self._exif_job_scope(files)}?",
+                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        return answer == QMessageBox.Yes
+
     def _delete_thumbnails(self):
-        for file in self._model.files:
-            exif_dict = common.exif.get_exif(file)
-            if 'thumbnail' in exif_dict and exif_dict['thumbnail'] is not None:
-                del exif_dict['thumbnail']
-            common.exif.save_exif(exif_dict, path=file)
+        title = "Delete embedded thumbnails"
+        files = self._exif_job_files(title)
+        if files and self._confirm_exif_job(title, "Delete the embedded thumbnails", files):
+            self._start_exif_job(title, [strip_thumbnail], files)
+
+    def _delete_orientations(self):
+        # The pixels are not rotated: for the pictures already upright
+        title = "Delete orientation tags"
+        files = self._exif_job_files(title)
+        if files and self._confirm_exif_job(title, "Delete the orientation tags (pixels not rotated)", files):
+            self._start_exif_job(title, [strip_orientation], files)
+
+    def _add_tags(self):
+        title = "Add tags"
+        files = self._exif_job_files(title)
+        if len(files) == 0:
+            return
+        text, ok = QInputDialog.getText(self, title, f"Tags added to {self._exif_job_scope(files)} "
+                                                     f"(comma separated):")
+        tags = [tag.strip() for tag in text.split(',') if tag.strip()] if ok else []
+        if tags and self._confirm_exif_job(title, f"Add the tags {', '.join(tags)} to the exif", files):
+            self._start_exif_job(title, [add_entities([TagEntity(tag) for tag in tags])], files)
+
+    def _shift_dates(self):
+        title = "Shift dates"
+        files = self._exif_job_files(title)
+        if len(files) == 0:
+            return
+        text, ok = QInputDialog.getText(self, title, f"Offset added to the dates of {self._exif_job_scope(files)} "
+                                                     f"([-][D days] H[:MM[:SS]]):")
+        if not ok or not text.strip():
+            return
+        try:
+            delta = parse_time_offset(text)
+        except ValueError as e:
+            QMessageBox.warning(self, title, str(e))
+            return
+        if self._confirm_exif_job(title, f"Shift by {delta} the dates", files):
+            self._start_exif_job(title, [shift_datetimes(delta)], files)
+
+    def _cancel_exif_job(self):
+        if self.exif_job is not None:
+            self.exif_job.cancel()
+
+    def on_exif_job_progress(self, done: int, total: int, throughput: float):
+        self.statusBar().showMessage(f"{self.exif_job_title}: {done}/{total} files - {throughput:.1f} files/s")
+
+    def on_exif_job_finished(self, cancelled: bool):
+        job = self.exif_job
+        self.cancel_exif_job.setEnabled(False)
+        msg = f"{self.exif_job_title}{' cancelled' if cancelled else ''}: {len(job.rewritten)} files written, " \
+              f"{len(job.unchanged)} unchanged"
+        if len(job.failed) > 0:
+            msg += f", {len(job.failed)} failed (see the log)"
+        self.statusBar().showMessage(msg + f" - {job.throughput:.1f} files/s")
+
+    def closeEvent(self, event):
+        self._cancel_exif_job()
+        self.tiles_model.producer.shutdown()
+        super(MainTileWindow, self).closeEvent(event)
 
     def _reset_state(self):
-        self._timer.stop()
-        self._col_idx = 0
-        self._row_idx = 0
-        for widget in self.media_widgets.values():
-            self._layout.removeWidget(widget)
-            widget.close()
-        self.media_widgets = {}
+        # Thumbnails of the previous dir being produced are dropped
+        self.tiles_model.cancel()
+        self.tiles_model.set_files([])
 
     def set_dirpath(self, dirpath):
         if dirpath is None:
             return
         self._reset_state()
-        self._files_to_process = copy.deepcopy(self._model.files)
-        self._timer.start()
+        self.tiles_model.set_files(self._media_files())
+        self._select_tile(self._model.media_path)
 
     def update_dirpath_content(self):
-        # Make sure not conflict with if we're populating the files
-        self._timer.stop()
-
-        files_it = self._model.files
-        key_to_del = []  # List of filepaths that dont exist anymore
-        for widget in self.media_widgets.values():
-            self._layout.removeWidget(widget)
-            if widget.file not in files_it:
-                key_to_del.append(widget.file)
-                widget.close()
-        for key in key_to_del:
-            del self.media_widgets[key]
-
-        self._col_idx = 0
-        self._row_idx = 0
-        self._files_to_process = copy.deepcopy(self._model.files)
-        self._timer.start()
-
-    def resizeEvent(self, event):
-        self.resize_widgets()
-        QtWidgets.QMainWindow.resizeEvent(self, event)
+        self.tiles_model.set_files(self._media_files())
+        self._select_tile(self.file)
+
+    def _media_files(self, files=None):
+        files = self._model.files if files is None else files
+        return [file for file in files if file.suffix in FILE_EXTENSION_PHOTO + FILE_EXTENSION_VIDEO]
+
+    def _select_tile(self, file: Path):
+        row = self.tiles_model.row_of(file) if file else -1
+        if row == -1:
+            return
+        index = self.tiles_model.index(row)
+        self.tiles_view.setCurrentIndex(index)
+        self.tiles_view.scrollTo(index, QtWidgets.QAbstractItemView.PositionAtTop)
 
     @pyqtSlot(Path)
     def on_dirpath_changed(self, dirpath):
@@ -148,12 +245,9 @@ class MainTileWindow(QtWidgets.QMainWindow):
         if file is None:
             return
         # Make sure we reload the selected filepath, in case the signal is emitted because the image has been modified
-        if file in self.media_widgets:
-            self.media_widgets[file].open_media(file)
-            self.media_widgets[file].scaledToWidth(self.scrollArea.size().width() / self.max_col)
-            # Scroll down to the selected image
-            posy = self.scrollArea.findChild(QtWidgets.QWidget, str(file)).pos().y()
-            self.scrollArea.verticalScrollBar().setValue(posy)
+        if self.tiles_model.row_of(file) != -1:
+            self.tiles_model.invalidate(file)
+            self._select_tile(file)
         else:
             # Seems like a file has been added (or a rename)
             self.update_dirpath_content()
@@ -163,65 +257,36 @@ class MainTileWindow(QtWidgets.QMainWindow):
         # Display the comment
         self.comment_widget.set_user_comment(self._model.media_comment, self.file)
 
-    def on_timeout_process_next_file(self):
-        try:
-            file = self._files_to_process.pop(0)
-            self._add_media_widget(file)
-        except IndexError:
-            self._timer.stop()
-            # Scroll down to the selected image
-            filepath = self._model.media_path
-            try:
-                posy = self.scrollArea.findChild(QtWidgets.QLabel, filepath).pos().y()
-                self.scrollArea.verticalScrollBar().setValue(posy)
-            except:
-                pass
+    def on_tile_double_clicked(self, index):
+        self._controller.set_media_path(self.tiles_model.file(index.row()))
+
+    @pyqtSlot(list)
+    def on_visible_rows_changed(self, rows):
+        self.tiles_model.request(rows)
 
     @pyqtSlot(Path)
     def on_watcher_file_changed(self, filepath):
-        self.media_widgets[filepath].open_media(filepath)
-        self.media_widgets[filepath].scaledToWidth(self.scrollArea.size().width() / self.max_col)
-        self.repaint()
+        self.tiles_model.invalidate(filepath)
+        self.tiles_view.viewport().update()
 
     @pyqtSlot(Path)
     def on_watcher_dir_changed(self, dirpath):
         self.update_dirpath_content()
 
-    def reset(self, delete_widget=False):
-        self._timer.stop()
-        self._col_idx = 0
-        self._row_idx = 0
-        for widget in self.media_widgets.values():
-            self._layout.removeWidget(widget)
-            if delete_widget:
-                widget.close()
-        if delete_widget:
-            self.media_widgets = {}
-
-    def _add_media_widget(self, path: Path):
-        if path in self.media_widgets:
-            widget = self.media_widgets[path]
-        else:
-            if path.suffix in FILE_EXTENSION_PHOTO:
-                widget = ImageWidget(path)
-            elif path.suffix in FILE_EXTENSION_VIDEO:
-                widget = VideoWidget(path)
-            widget.doubleClicked.connect(self._controller.set_media_path)
-
-        if widget.orig_pixmap and not widget.orig_pixmap.isNull():
-            widget.setAttribute(Qt.WA_DeleteOnClose, True)
-            widget.scaledToWidth(self.scrollArea.size().width() / self.max_col)
-            self.media_widgets[path] = widget
-            self._layout.addWidget(widget, self._row_idx, self._col_idx)
-            self._col_idx = (self._col_idx + 1)
-            if self._col_idx == self.max_col:
-                self._col_idx = 0
-                self._row_idx += 1
-        else:
-            widget.close()
+    @pyqtSlot(list)
+    def on_files_added(self, files):
+        self.tiles_model.insert_files(self._media_files(files))
+
+    @pyqtSlot(list)
+    def on_files_removed(self, files):
+        self.tiles_model.remove_files(files)
+
+    @pyqtSlot(list)
+    def on_files_renamed(self, renames):
+        self.tiles_model.rename_files(renames)
+        self._select_tile(self.file)
 
-    def resize_widgets(self):
-        win_size = self.scrollArea.size()
-        for i in range(self._layout.count()):
-            item = self._layout.itemAt(i)
-            item.widget().scaledToWidth(win_size.width() / self.max_col)
+    @pyqtSlot(list)
+    def on_files_modified(self, files):
+        for file in files:
+            self.tiles_model.invalidate(file)
@@ -0,0 +1,82 @@
+import shutil
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from PyQt5.QtCore import QItemSelectionModel
+from PyQt5.QtWidgets import QApplication, QMessageBox, QInputDialog
+
+import resources.test_pics as test_pics
+from mvc.controllers.main import MainController
+from mvc.models.main import MainModel
+from mvc.views.tileview.view import MainTileWindow
+
+default_pics_folder = Path(test_pics.__file__).parent
+
+app = QApplication.instance() or QApplication(sys.argv)
+
+
+class ExifJobScopeTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.out_dir = Path(tempfile.mkdtemp())
+        for i in range(3):
+            shutil.copy(default_pics_folder / 'lenna.jpg', self.out_dir / f"{i}.jpg")
+        self.model = MainModel()
+        self.controller = MainController(self.model)
+        self.window = MainTileWindow(model=self.model, controller=self.controller)
+        self.controller.update_dirpath(self.out_dir)
+        self.window.set_dirpath(self.out_dir)
+        self.files = sorted(self.out_dir.iterdir())
+        self.started = []
+        self.window._start_exif_job = lambda title, edits, files: self.started.append(files)
+
+    def tearDown(self) -> None:
+        self.window.close()
+        self.controller.shutdown()
+        shutil.rmtree(self.out_dir)
+
+    def _select(self, rows):
+        selection = self.window.tiles_view.selectionModel()
+        selection.clearSelection()
+        for row in rows:
+            selection.select(self.window.tiles_model.index(row, 0), QItemSelectionModel.Select)
+
+    def test_single_selected(self):
+        self._select([1])
+        with mock.patch.object(QMessageBox, 'question', return_value=QMessageBox.Yes) as question:
+            self.window._delete_thumbnails()
+        # Only the selected picture, named by the confirmation
+        self.assertEqual(self.started, [[self.files[1]]])
+        self.assertIn(self.files[1].name, question.call_args[0][2])
+
+    def test_nothing_selected(self):
+        self._select([])
+        with mock.patch.object(QMessageBox, 'information') as information, \
+                mock.patch.object(QInputDialog, 'getText') as get_text:
+            self.window._add_tags()
+        information.assert_called_once()
+        get_text.assert_not_called()
+        self.assertEqual(self.started, [])
+
+    def test_select_all(self):
+        self.window.select_all.trigger()
+        with mock.patch.object(QInputDialog, 'getText', return_value=('beach', True)), \
+                mock.patch.object(QMessageBox, 'question', return_value=QMessageBox.Yes) as question:
+            self.window._add_tags()
+        self.assertEqual(sorted(self.started[0]), self.files)
+        self.assertIn(f"all the 3 pictures of {self.out_dir}", question.call_args[0][2])
+
+    def test_declined(self):
+        self._select([0, 2])
+        with mock.patch.object(QInputDialog, 'getText', return_value=('1:00', True)), \
+                mock.patch.object(QMessageBox, 'question', return_value=QMessageBox.No) as question:
+            self.window._shift_dates()
+        self.assertIn("the 2 selected pictures", question.call_args[0][2])
+        self.assertEqual(self.started, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
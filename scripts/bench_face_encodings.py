@@ -0,0 +1,38 @@
+import argparse
+import logging
+import sys
+
+import numpy as np
+
+from common.face import face_encodings, face_recognition_model
+
+argparser = argparse.ArgumentParser(description='Throughput of face_encodings for different batch sizes')
+argparser.add_argument('--model', help='Recognition model', type=str, default=face_recognition_model[-1],
+                       choices=face_recognition_model)
+argparser.add_argument('--patches', help='Number of random face patches to encode', type=int, default=128)
+argparser.add_argument('--batch_sizes', help='Batch sizes to test', type=int, nargs='+',
+                       default=[1, 4, 8, 16, 32, 64])
+
+logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO, stream=sys.stdout)
+
+
+def main():
+    args = argparser.parse_args()
+    rng = np.random.default_rng(0)
+    patches = [rng.integers(0, 255, size=(rng.integers(80, 300), rng.integers(80, 300), 3), dtype=np.uint8)
+               for _ in range(args.patches)]
+
+    # Warm up (model construction + first inference)
+    face_encodings(patches[:1], recognition_model=args.model)
+
+    for batch_size in args.batch_sizes:
+        timings = []
+        face_encodings(patches, recognition_model=args.model, batch_size=batch_size, timings=timings)
+        total = sum(t for _, t in timings)
+        per_batch = np.mean([t for _, t in timings]) * 1000.
+        logging.info(f"batch_size={batch_size:4d} | {len(timings):4d} batches | {per_batch:8.1f} ms/batch | "
+                     f"{len(patches) / total:8.1f} patches/s")
+
+
+if __name__ == '__main__':
+    main()
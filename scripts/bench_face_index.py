@@ -0,0 +1,64 @@
+import argparse
+import logging
+import sys
+import time
+
+import numpy as np
+
+from common.face_index import IVFIndex
+from common.face_matcher import FaceMatcher, _ModelMatrix
+
+argparser = argparse.ArgumentParser(description='Recall vs latency of the IVF face index against brute-force search')
+argparser.add_argument('--identities', help='Number of identities', type=int, default=500)
+argparser.add_argument('--samples', help='Number of samples per identity', type=int, default=60)
+argparser.add_argument('--dim', help='Embedding dimension', type=int, default=128)
+argparser.add_argument('--queries', help='Number of queries', type=int, default=500)
+argparser.add_argument('--n_probes', help='Number of probed lists to test', type=int, nargs='+',
+                       default=[1, 2, 4, 8, 16, 32])
+
+logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO, stream=sys.stdout)
+
+
+def main():
+    args = argparser.parse_args()
+    rng = np.random.default_rng(0)
+
+    # Synthetic embeddings: one cluster per identity
+    centers = rng.normal(size=(args.identities, args.dim)).astype(np.float32)
+    labels = np.repeat(np.arange(args.identities), args.samples)
+    data = centers[labels] + 0.3 * rng.normal(size=(len(labels), args.dim)).astype(np.float32)
+    names = [f"person{i}" for i in labels]
+    hashes = [f"{i}" for i in range(len(labels))]
+    queries = centers[rng.integers(0, args.identities, args.queries)] + \
+        0.3 * rng.normal(size=(args.queries, args.dim)).astype(np.float32)
+
+    # Brute force
+    matcher = FaceMatcher(ann_min_size=np.inf)
+    matcher._matrices['model'] = _ModelMatrix(hashes, names, data)
+    # Queries one by one, as in face_recognition (one image at a time)
+    t = time.perf_counter()
+    expected = [matcher.match(query[None], model='model')[0][0][0] for query in queries]
+    t_brute = (time.perf_counter() - t) / args.queries
+    dist, _ = matcher.distances(queries, 'model')
+    expected_rows = np.argmin(dist, axis=1)
+    logging.info(f"{len(data)} embeddings | brute force: {t_brute * 1000.:.3f} ms/query")
+
+    mat = matcher._matrices['model']
+    t = time.perf_counter()
+    index = IVFIndex.train(mat)
+    logging.info(f"IVF training: {index.n_lists} lists in {time.perf_counter() - t:.2f} s")
+
+    for n_probe in args.n_probes:
+        index.search(mat, queries[:1], k=1, n_probe=n_probe)
+        t = time.perf_counter()
+        results = [index.search(mat, query, k=1, n_probe=n_probe)[0] for query in queries]
+        t_ivf = (time.perf_counter() - t) / args.queries
+        recall = np.mean([len(rows) > 0 and rows[0] == row for (rows, _), row in zip(results, expected_rows)])
+        same_name = np.mean([len(rows) > 0 and mat.names[rows[0]] == name
+                             for (rows, _), name in zip(results, expected)])
+        logging.info(f"n_probe={n_probe:3d} | {t_ivf * 1000.:.3f} ms/query | speed-up x{t_brute / t_ivf:5.1f} | "
+                     f"recall@1 {recall:.3f} | same name {same_name:.3f}")
+
+
+if __name__ == '__main__':
+    main()
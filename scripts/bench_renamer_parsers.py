@@ -0,0 +1,91 @@
+import argparse
+import logging
+import random
+import re
+import sys
+import time
+
+from common import nameddic
+from common.constants import FILE_EXTENSION_PHOTO_JPG
+from mvc.views.renamer.parsers import load_plugins, REPO_PARSERS
+from mvc.views.renamer.parsers.base import MetaParser, ParserWithRegexSegments, ResultParser
+
+argparser = argparse.ArgumentParser(description='Per filename parse cost of the renamer parsers: pattern built and '
+                                                'matched segment by segment, a compiled regex per parser tried in '
+                                                'turn, and a single pass over the parsers of the extension')
+argparser.add_argument('--files', help='Number of filenames', type=int, default=20000)
+argparser.add_argument('--tag', help='Tag of the parsers', default='photo')
+
+logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s', level=logging.INFO, stream=sys.stdout)
+
+
+def _try_match_segments(parser: ParserWithRegexSegments, string, result):
+    # Matching before the regexes were compiled: pattern rebuilt, nested parsers matched again on their group
+    for match in (re.match, re.search):
+        out = match(parser.get_regex(do_grouping=True), string=string)
+        if out is None:
+            continue
+        parser._process_string(out.group(0), result)
+        if all(_try_match_segments(seg, out.group(ind + 1), result)
+               for ind, seg in enumerate(parser.reg_segments) if isinstance(seg, ParserWithRegexSegments)):
+            return True
+    return False
+
+
+def _try_match_sequential(meta_parser: MetaParser, string, result, try_match):
+    # Parsers tried in turn, in the order of the list
+    for parser in meta_parser.parser_list:
+        tmp = nameddic()
+        if try_match(parser, string, tmp):
+            result.update(tmp)
+            return True
+    return False
+
+
+def _filenames(n):
+    rng = random.Random(0)
+    formats = ['IMG_{d}_{t}.jpg', '{d}_{t}.jpg', 'IMG_{d}_{t}_HDR.JPG', 'Office Lens {d}-{t}.jpg',
+               'IMG-{d}-WA{n:04d}.jpeg', 'DSC{n:05d}.JPG', 'copy of {d}_{t}.jpg']
+    out = []
+    for _ in range(n):
+        d = f"{rng.randint(1990, 2029)}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+        t = f"{rng.randint(0, 23):02d}{rng.randint(0, 59):02d}{rng.randint(0, 59):02d}"
+        out.append(rng.choice(formats).format(d=d, t=t, n=rng.randint(0, 9999)))
+    return out
+
+
+def _run(try_match, filenames):
+    results = []
+    t = time.perf_counter()
+    for filename in filenames:
+        result = ResultParser()
+        results.append(dict(result) if try_match(filename, result) else None)
+    return results, (time.perf_counter() - t) / len(filenames)
+
+
+def main():
+    args = argparser.parse_args()
+    load_plugins(parent_module_name='mvc.views.renamer.parsers')
+    config = nameddic()
+    config.parser_cls_list = list(dict.fromkeys(REPO_PARSERS[args.tag]))
+    t = time.perf_counter()
+    meta_parser = MetaParser.generate_parser(config=config, file_extensions=FILE_EXTENSION_PHOTO_JPG)
+    logging.info(f"{len(meta_parser.parser_list)} parsers ({len(config.parser_cls_list)} classes x "
+                 f"{len(FILE_EXTENSION_PHOTO_JPG)} extensions) compiled in {(time.perf_counter() - t) * 1000.:.2f} ms")
+
+    filenames = _filenames(args.files)
+    expected, t_segments = _run(
+        lambda string, result: _try_match_sequential(meta_parser, string, result, _try_match_segments), filenames)
+    logging.info(f"{len(filenames)} filenames, {sum(result is not None for result in expected)} matched | "
+                 f"segments: {t_segments * 1e6:.1f} us/file")
+    runs = {'compiled, in turn': lambda string, result: _try_match_sequential(
+                meta_parser, string, result, lambda parser, string, result: parser.try_match(string, result)),
+            'single pass': meta_parser.try_match}
+    for name, try_match in runs.items():
+        results, t = _run(try_match, filenames)
+        n_diff = sum(result != other for result, other in zip(results, expected))
+        logging.info(f"{name}: {t * 1e6:.1f} us/file | speed-up x{t_segments / t:.1f} | {n_diff} different results")
+
+
+if __name__ == '__main__':
+    main()